@@ -0,0 +1,9 @@
+# see store/hot_queries.py and the audit_indexes command
+from django.contrib.contenttypes.models import ContentType
+
+from .models import LikedItem
+
+
+HOT_QUERIES = {
+    'likes of object': lambda: LikedItem.objects.filter(content_type=ContentType(pk=1), object_id=1),
+}
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('likes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='likeditem',
+            index=models.Index(fields=['content_type', 'object_id'], name='likes_liked_content_7292dd_idx'),
+        ),
+    ]
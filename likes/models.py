@@ -20,6 +20,12 @@ class LikedItem(models.Model):
     object_id = models.PositiveIntegerField()
     content_object = GenericForeignKey()
 
+    class Meta:
+        # likes are looked up for a given object, i.e by its type and id together
+        indexes = [
+            models.Index(fields=['content_type', 'object_id'])
+        ]
+
 
 
 
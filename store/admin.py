@@ -1,10 +1,17 @@
 from django.contrib import admin,messages
 from django.contrib.contenttypes.admin import GenericTabularInline
+from django.db import transaction
 from django.db.models import Count
+from django.shortcuts import redirect
 from django.utils.html import format_html, urlencode
+from django.utils import timezone
 from django.urls import reverse
 # from tags.models import TaggedItem
 from . import models # so we can register our models to the admin site
+from . import customers
+from . import catalog, history, outbox, sharding, stock
+from .autocomplete import PrefixSearchMixin
+from .search import normalize
 # Register your models here.
 
 
@@ -24,7 +31,9 @@ class InventoryFilter(admin.SimpleListFilter):
     def queryset(self, request, queryset): # here we then implement the filtering logic
         # return super().queryset(request,queryset) # default implementation
         if self.value() == '<10':
-           return queryset.filter(inventory__lt = 10) # calling the filter on the queryset
+           # thresholds are configurable per product and collection now, stock_status is kept up to date
+           # when inventory changes and is indexed, so this doesnt scan every product (see store/stock.py)
+           return queryset.filter(stock_status=models.Product.STOCK_LOW) # calling the filter on the queryset
 
 
 # class TagInline(GenericTabularInline): # generic inline to be used in the Product admin
@@ -35,7 +44,7 @@ class InventoryFilter(admin.SimpleListFilter):
 # thus the store app wont be dependent on the tags app
 # and it is thus a standalone app that can be used in other projects
 @admin.register(models.Product) # telling django that this is the admin model for the Product class
-class ProductAdmin(admin.ModelAdmin): # class to customise the admin interface for the product model
+class ProductAdmin(PrefixSearchMixin, admin.ModelAdmin): # class to customise the admin interface for the product model
     list_display = ['title','unit_price','inventory_status','collection_title']
     list_editable = ['unit_price']
     list_per_page = 10
@@ -46,7 +55,8 @@ class ProductAdmin(admin.ModelAdmin): # class to customise the admin interface f
         'slug': ['title']
     }
     autocomplete_fields = ['collection']
-    search_fields = ['collection_title']
+    search_fields = ['title'] # needed for the autocomplete of OrderItemInline
+    prefix_search_fields = ['title_key'] # searches use the indexed normalized title instead (see store/autocomplete.py)
     # inlines = [TagInline] # implemented by the store_custom app to enable standalone capability for the store app
 
     def collection_title(selfself,product):# passing in product cus it's a bunch of product objects we are rendering
@@ -57,16 +67,20 @@ class ProductAdmin(admin.ModelAdmin): # class to customise the admin interface f
 
     @admin.display(ordering='inventory')
     def inventory_status(self,product):
-        if product.inventory <10:
-            return "Low"
-        return 'Ok'
+        return product.get_stock_status_display() # Low or Ok, see store/stock.py
 
     # creating a function for custom action in list page
     @admin.action(description="Clear Inventory")
     def clear_inventory(self,request,queryset):
         # request reps current http request and queryset contains the objects the user selected in the list page
         # in this method we can do anything we want for updating objects
-        updated_count = queryset.update(inventory=0) # this will immediately update the database and return a number of objects
+        with transaction.atomic():
+            updated_count = outbox.update(queryset, inventory=0, last_update=timezone.now()) # this will immediately update the database and return a number of objects
+            # outbox.update runs queryset.update and records the change for downstream systems, which a plain update skips
+            product_ids = list(queryset.values_list('pk', flat=True))
+            stock.refresh(product_ids) # queues low stock alerts, update() skips the signals
+            history.capture(product_ids)
+            catalog.invalidate_products(product_ids)
         self.message_user(
             request,
             f'{updated_count} products were succesfully updated',
@@ -74,7 +88,7 @@ class ProductAdmin(admin.ModelAdmin): # class to customise the admin interface f
         )
 
 @admin.register(models.Customer)
-class CustomerAdmin(admin.ModelAdmin):
+class CustomerAdmin(PrefixSearchMixin, admin.ModelAdmin):
     list_display = ['first_name','last_name','membership','orders']
     list_editable = ['membership']
     ordering = ['first_name','last_name']
@@ -82,18 +96,49 @@ class CustomerAdmin(admin.ModelAdmin):
     # search_fields = ['first_name', 'last_name'] # this will bring any customer that has the searched word anywhere in their name
     search_fields = ['first_name__istartswith', 'last_name__istartswith'] # this makes sure we only get results...
     #...where the names start with the searched keyword
+    # istartswith can't use an index under case insensitive collations, so searches (including the autocomplete
+    # in OrderAdmin) go through the indexed normalized names and email instead (see store/customers.py)
+    prefix_search_fields = customers.NAME_FIELDS
 
-    @admin.display(ordering='orders_count')
-    def orders(self, customer):
+    def get_search_results(self, request, queryset, search_term):
+        if not normalize(search_term):
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(customers.search_filter(search_term)), False
+
+    def autocomplete_results(self, queryset, term, offset, limit):
+        if customers.is_email_term(term):
+            matches = queryset.filter(customers.email_filter(term)).order_by('email_local_key', 'pk')
+            return list(matches[offset:offset + limit])
+        return super().autocomplete_results(queryset, term, offset, limit)
+
+    def orders_link(self, customer, count):
         url = (
             reverse('admin:store_order_changelist')
             + '?'
             + urlencode({
                 'customer__id': str(customer.id)
             }))
-        return format_html('<a href="{}">{} Orders</a>', url, customer.orders_count)
+        return format_html('<a href="{}">{} Orders</a>', url, count)
+
+    @admin.display(ordering='orders_count')
+    def orders(self, customer):
+        return self.orders_link(customer, customer.orders_count)
+
+    @admin.display(description='orders')
+    def shard_orders(self, customer):
+        # the orders are on the customer's shard, which the join of the annotation can't reach (see store/sharding.py).
+        # counted on the shard for each customer of the page instead, and the column can't be sorted
+        count = models.Order.objects.for_customer(customer.id).filter(customer_id=customer.id).count()
+        return self.orders_link(customer, count)
+
+    def get_list_display(self, request):
+        if sharding.is_sharded():
+            return ['shard_orders' if field == 'orders' else field for field in self.list_display]
+        return self.list_display
 
     def get_queryset(self, request):
+        if sharding.is_sharded():
+            return super().get_queryset(request)
         return super().get_queryset(request).annotate(
             orders_count=Count('order')
         )
@@ -107,18 +152,142 @@ class OrderItemInline(admin.TabularInline): # cerating inline interface to be us
     min_num = 1 # min number of order items that can be added
     max_num = 10 # max number of order items that can be added
     # extra = 0 # setting the number of empty value holders you see in the inline menu to add order items
+class OrderShardFilter(admin.SimpleListFilter):
+    # orders are on several databases (see store/sharding.py) and a changelist pages through one of them, so the
+    # list shows one shard at a time. a customer's orders (?customer__id=, linked from CustomerAdmin) are read
+    # from their shard, everything else from the first shard until another one is picked
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in sharding.SHARDS]
+
+    def shard(self, request):
+        if self.value() in sharding.SHARDS:
+            return self.value()
+        customer_id = request.GET.get('customer__id', '')
+        return sharding.shard_for(customer_id) if customer_id.isdigit() else sharding.SHARDS[0]
+
+    def queryset(self, request, queryset):
+        self.selected = self.shard(request)
+        return queryset.using(self.selected)
+
+    def choices(self, changelist):
+        # no "All" choice, there is no list of every shard's orders
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': alias == getattr(self, 'selected', sharding.SHARDS[0]),
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
 @admin.register(models.Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['id','placed_at','customer']
     autocomplete_fields = ['customer']
     inlines = [OrderItemInline] # including inlines for the admin form
+    show_full_result_count = not sharding.is_sharded() # the full count would only be the default database's
+    # a shard has no customers table to join, the customers of a page are read from the default database in one query
+    list_select_related = [] if sharding.is_sharded() else ['customer']
+
+    def get_list_filter(self, request):
+        return [OrderShardFilter] if sharding.is_sharded() else []
+
+    def get_queryset(self, request):
+        if sharding.is_sharded():
+            return super().get_queryset(request).prefetch_related('customer')
+        return super().get_queryset(request)
+
+    def get_object(self, request, object_id, from_field=None):
+        # looked up on every shard, the order keeps the database it was found on, which saving, deleting and
+        # the inlines below use (see store/routers.py)
+        if not sharding.is_sharded():
+            return super().get_object(request, object_id, from_field)
+        try:
+            object_id = int(object_id)
+        except (TypeError, ValueError):
+            return None
+        found = self.get_queryset(request).filter(pk=object_id).gather(lambda orders: orders.first())
+        return next((order for order in found.values() if order is not None), None)
+
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if obj is not None and obj._state.db is not None:
+            kwargs['queryset'] = kwargs['queryset'].using(obj._state.db) # the items are on the order's shard
+        return kwargs
+
+    def get_deleted_objects(self, objs, request):
+        # django collects what a delete would touch on the default database, the items that protect an order
+        # from being deleted are on its shard
+        to_delete, model_count, perms_needed, protected = super().get_deleted_objects(objs, request)
+        for order in objs:
+            if order._state.db not in (None, 'default'):
+                items = models.OrderItem.objects.using(order._state.db).filter(order_id=order.pk)
+                protected.extend(f'Order item: {item}' for item in items)
+        return to_delete, model_count, perms_needed, protected
+
+    def _get_obj_does_not_exist_redirect(self, request, opts, object_id):
+        # django calls this when get_object found no order, so the shards are only asked once.
+        # links to old orders keep working after they were archived (see store/archive.py)
+        try:
+            order_id = int(object_id)
+        except (TypeError, ValueError):
+            order_id = None
+        if order_id is not None and models.ArchivedOrder.objects.filter(pk=order_id).exists():
+            return redirect('admin:store_archivedorder_change', order_id)
+        return super()._get_obj_does_not_exist_redirect(request, opts, object_id)
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = models.ArchivedOrderItem
+    fields = ['product', 'quantity', 'unit_price']
+    readonly_fields = fields
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(models.ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    # the archive is read only, orders only get here through the archive_orders command
+    list_display = ['id', 'placed_at', 'payment_status', 'customer']
+    list_select_related = ['customer']
+    list_per_page = 50
+    show_full_result_count = False
+    readonly_fields = ['id', 'placed_at', 'payment_status', 'customer', 'idempotency_key', 'archived_at']
+    inlines = [ArchivedOrderItemInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(models.ReportRun)
+class ReportRunAdmin(admin.ModelAdmin):
+    # how long the raw sql reports take (see store/reports.py)
+    list_display = ['name', 'params', 'rows', 'seconds', 'from_cache', 'started_at']
+    list_filter = ['name', 'from_cache']
+    ordering = ['-started_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 @admin.register(models.Collection)
-class CollectionAdmin(admin.ModelAdmin):
+class CollectionAdmin(PrefixSearchMixin, admin.ModelAdmin):
     list_display = ['title','products_count']
     search_fields = ['title']
+    prefix_search_fields = ['title_key']
 
-    @admin.display(ordering='products_count')# so we tell django what field to use to sort this computed column
+    @admin.display(ordering='summary__products_count')# so we tell django what field to use to sort this computed column
     def products_count(self,collection):
 
         # return collection.products_count
@@ -143,13 +312,20 @@ class CollectionAdmin(admin.ModelAdmin):
             })
 
         )
-        return format_html('<a href= "{}">{}</a>', url, collection.products_count)
+        try:
+            products_count = collection.summary.products_count
+        except models.CollectionSummary.DoesNotExist:
+            products_count = 0
+        return format_html('<a href= "{}">{}</a>', url, products_count)
     def get_queryset(self, request):
         # return super().get_queryset(request) # this is the default implementation
         # rather than return the queryset above we first annotate it
-        return super().get_queryset(request).annotate(
-            products_count = Count('product') # import the count function at beginning of module
-        ) # now our collections objects in our queryset will have a field called products_count
+        # return super().get_queryset(request).annotate(
+        #     products_count = Count('product') # import the count function at beginning of module
+        # ) # now our collections objects in our queryset will have a field called products_count
+        # counting the products of every collection on every page load gets slow with many products,
+        # the counts are kept in CollectionSummary instead (see store/collection_summaries.py)
+        return super().get_queryset(request).select_related('summary')
 
 
 
@@ -0,0 +1,194 @@
+# hot/cold storage of orders
+# archive_orders moves settled orders placed before a cutoff, with their items, from Order/OrderItem to
+# ArchivedOrder/ArchivedOrderItem. every batch is its own transaction (copy, then delete from the hot tables),
+# so the job can be stopped at any time and simply run again: it picks up whatever is still in the hot tables.
+# only complete orders are archived, it's the only final payment status (see store/payments.py): payments can
+# still be reconciled against pending and failed orders. restore_orders moves archived orders back, e.g the failed
+# orders archived before
+# the archive tables are on the default database, orders are archived from every order shard (see store/sharding.py).
+# the archive commits before the shard deletes the orders, a batch that fails in between is copied again next time
+#
+# code that needs old orders as well goes through get_order/customer_orders/order_items,
+# which read the hot tables first and only fall back to the archive when needed
+import time
+
+from django.db import transaction
+
+from . import sharding
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+ARCHIVED_STATUSES = [Order.PAYMENT_STATUS_COMPLETE]
+BATCH_SIZE = 1000
+
+
+class ArchiveResult:
+    def __init__(self):
+        self.orders = 0
+        self.items = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+    @property
+    def orders_per_second(self):
+        return self.orders / self.elapsed if self.elapsed else 0.0
+
+
+def archivable_orders(before):
+    return Order.objects.filter(placed_at__lt=before, payment_status__in=ARCHIVED_STATUSES)
+
+
+def _archive_batch(order_ids, before, shard='default'):
+    # returns (orders, items) moved. runs inside a transaction, the orders are locked while they are copied
+    # and checked again in case their status changed since they were picked
+    orders = list(archivable_orders(before).using(shard).select_for_update().filter(pk__in=order_ids))
+    order_ids = [order.pk for order in orders]
+    items = list(OrderItem.objects.using(shard).filter(order_id__in=order_ids))
+    placed_at = {order.pk: order.placed_at for order in orders}
+    # ignore_conflicts: rows a previous run already copied are left as they are
+    ArchivedOrder.objects.bulk_create(
+        [
+            ArchivedOrder(
+                id=order.pk,
+                placed_at=order.placed_at,
+                payment_status=order.payment_status,
+                customer_id=order.customer_id,
+                idempotency_key=order.idempotency_key,
+            )
+            for order in orders
+        ],
+        ignore_conflicts=True,
+    )
+    ArchivedOrderItem.objects.bulk_create(
+        [
+            ArchivedOrderItem(
+                id=item.pk,
+                order_id=item.order_id,
+                product_id=item.product_id,
+                quantity=item.quantity,
+                unit_price=item.unit_price,
+                placed_at=placed_at[item.order_id],
+            )
+            for item in items
+        ],
+        ignore_conflicts=True,
+    )
+    OrderItem.objects.using(shard).filter(order_id__in=order_ids).delete()
+    Order.objects.using(shard).filter(pk__in=order_ids).delete()
+    return len(orders), len(items)
+
+
+def archive_orders(before, batch_size=BATCH_SIZE, pause=0.0, max_batches=None):
+    result = ArchiveResult()
+    start = time.perf_counter()
+    for shard in sharding.SHARDS:
+        while max_batches is None or result.batches < max_batches:
+            order_ids = list(archivable_orders(before).using(shard).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not order_ids:
+                break
+            with transaction.atomic(using=shard), transaction.atomic():
+                orders, items = _archive_batch(order_ids, before, shard)
+            result.orders += orders
+            result.items += items
+            result.batches += 1
+            if pause:
+                time.sleep(pause)  # give replication and other writers some room
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _restore_batch(orders, shard):
+    # copies archived orders and their items back to the shard, then deletes them from the archive.
+    # the shard commits first, a batch that fails in between is restored again next time (rows already there are
+    # skipped), meanwhile get_order finds the hot copy first
+    order_ids = [order.pk for order in orders]
+    with transaction.atomic(), transaction.atomic(using=shard):
+        items = list(ArchivedOrderItem.objects.filter(order_id__in=order_ids))
+        restored = [
+            Order(
+                id=order.pk,
+                placed_at=order.placed_at,
+                payment_status=order.payment_status,
+                customer_id=order.customer_id,
+                idempotency_key=order.idempotency_key,
+            )
+            for order in orders
+        ]
+        Order.objects.using(shard).bulk_create(restored, ignore_conflicts=True)
+        # bulk_create gave them the time of now (auto_now_add), put back when they were placed
+        for order, archived in zip(restored, orders):
+            order.placed_at = archived.placed_at
+        Order.objects.using(shard).bulk_update(restored, ['placed_at'])
+        OrderItem.objects.using(shard).bulk_create(
+            [
+                OrderItem(
+                    id=item.pk,
+                    order_id=item.order_id,
+                    product_id=item.product_id,
+                    quantity=item.quantity,
+                    unit_price=item.unit_price,
+                )
+                for item in items
+            ],
+            ignore_conflicts=True,
+        )
+        ArchivedOrderItem.objects.filter(order_id__in=order_ids).delete()
+        ArchivedOrder.objects.filter(pk__in=order_ids).delete()
+    return len(orders), len(items)
+
+
+def restore_orders(archived, batch_size=BATCH_SIZE):
+    # moves the orders of a queryset of ArchivedOrder back to the shards of their customers, returns an ArchiveResult
+    result = ArchiveResult()
+    start = time.perf_counter()
+    last = 0
+    while True:
+        orders = list(archived.filter(pk__gt=last).order_by('pk')[:batch_size])
+        if not orders:
+            break
+        last = orders[-1].pk
+        by_shard = {}
+        for order in orders:
+            by_shard.setdefault(sharding.shard_for(order.customer_id), []).append(order)
+        for shard, shard_orders in by_shard.items():
+            restored, items = _restore_batch(shard_orders, shard)
+            result.orders += restored
+            result.items += items
+        result.batches += 1
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def is_archived(order):
+    return isinstance(order, ArchivedOrder)
+
+
+def get_order(order_id):
+    # raises Order.DoesNotExist when the order is in neither table
+    found = Order.objects.filter(pk=order_id).gather(lambda orders: orders.first())
+    order = next((order for order in found.values() if order is not None), None)
+    if order is None:
+        order = ArchivedOrder.objects.filter(pk=order_id).first()
+    if order is None:
+        raise Order.DoesNotExist(f'No order with id {order_id}')
+    return order
+
+
+def customer_orders(customer_id, limit=None):
+    # newest first. archived orders are older than nearly every hot order (only pending orders stay behind),
+    # so when the hot orders fill the limit the archive is only asked for orders newer than the last of them,
+    # which is normally an empty index range
+    orders = list(Order.objects.for_customer(customer_id).filter(customer_id=customer_id).order_by('-placed_at', '-pk')[:limit])
+    archived = ArchivedOrder.objects.filter(customer_id=customer_id).order_by('-placed_at', '-pk')
+    if limit is not None:
+        if len(orders) == limit:
+            archived = archived.filter(placed_at__gt=orders[-1].placed_at)
+        archived = archived[:limit]
+    orders.extend(archived)
+    orders.sort(key=lambda order: (order.placed_at, order.pk), reverse=True)
+    return orders[:limit]
+
+
+def order_items(order):
+    if is_archived(order):
+        return list(ArchivedOrderItem.objects.filter(order_id=order.pk))
+    return list(OrderItem.objects.using(order._state.db).filter(order_id=order.pk))
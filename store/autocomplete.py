@@ -0,0 +1,108 @@
+# fast admin search and autocomplete over the normalized key columns (see store/search.py)
+# the default autocomplete runs get_search_results (an icontains scan on each search field),
+# then counts every match to know if there is a next page, on every keystroke.
+# model admins using PrefixSearchMixin instead:
+#   - search with index range scans on prefix_search_fields
+#   - fetch one row more than the page size to know if there is a next page, without counting
+#   - cache each page of results for a few seconds, since the same prefixes are typed over and over
+import hashlib
+
+from django.conf import settings
+from django.contrib import admin
+from django.contrib.admin.views.autocomplete import AutocompleteJsonView
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db.models import Q
+from django.http import JsonResponse
+
+from .metrics import cache_lookup
+from .search import normalize, prefix_filter
+
+CACHE_TIMEOUT = getattr(settings, 'STORE_AUTOCOMPLETE_CACHE_TIMEOUT', 30)
+
+
+class PrefixSearchMixin:
+    # normalized, indexed columns to search, e.g ['title_key']
+    prefix_search_fields = []
+    # counting all the search results in the changelist costs a second scan, the admin works without it
+    show_full_result_count = False
+
+    def _word_filter(self, words):
+        # every word has to be the prefix of one of the fields, e.g "john smi" finds John Smith
+        condition = Q()
+        for word in words:
+            word_condition = Q()
+            for field in self.prefix_search_fields:
+                word_condition |= prefix_filter(field, word)
+            condition &= word_condition
+        return condition
+
+    def get_search_results(self, request, queryset, search_term):
+        term = normalize(search_term)
+        if not self.prefix_search_fields or not term:
+            return super().get_search_results(request, queryset, search_term)
+        condition = Q()
+        for field in self.prefix_search_fields:
+            condition |= prefix_filter(field, term)
+        words = term.split()
+        if len(words) > 1 and len(self.prefix_search_fields) > 1:
+            condition |= self._word_filter(words)
+        return queryset.filter(condition), False
+
+    def get_autocomplete_queryset(self, request):
+        # the plain queryset, without the annotations some admins add to get_queryset for their changelist
+        return admin.ModelAdmin.get_queryset(self, request)
+
+    def autocomplete_results(self, queryset, term, offset, limit):
+        # one query per search field, each walking its index in key order and stopping after offset + limit rows.
+        # a single OR'ed query would have to collect and sort every match first
+        found = {}
+        words = term.split()
+        for field in self.prefix_search_fields:
+            condition = prefix_filter(field, term)
+            if len(words) > 1 and len(self.prefix_search_fields) > 1:
+                condition |= prefix_filter(field, words[0]) & self._word_filter(words[1:])
+            for obj in queryset.filter(condition).order_by(field, 'pk')[:offset + limit]:
+                found.setdefault(obj.pk, (getattr(obj, field), obj))
+        ordered = sorted(found.values(), key=lambda pair: (pair[0], pair[1].pk))
+        return [obj for _, obj in ordered[offset:offset + limit]]
+
+
+class PrefixAutocompleteJsonView(AutocompleteJsonView):
+    # used by the admin site for every autocomplete request (see storefront/admin.py).
+    # admins without PrefixSearchMixin keep django's behaviour
+
+    def get(self, request, *args, **kwargs):
+        self.term, self.model_admin, self.source_field, to_field_name = self.process_request(request)
+        if not isinstance(self.model_admin, PrefixSearchMixin) or not self.model_admin.prefix_search_fields:
+            return super().get(request, *args, **kwargs)
+        if not self.has_perm(request):
+            raise PermissionDenied
+
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        term = normalize(self.term)
+        # the source field is part of the key as well, its limit_choices_to can change the results
+        source = '{}.{}.{}'.format(*(request.GET.get(name) for name in ('app_label', 'model_name', 'field_name')))
+        cache_key = 'autocomplete:' + hashlib.md5(f'{source}:{to_field_name}:{page}:{term}'.encode()).hexdigest()
+        data = cache.get(cache_key)
+        cache_lookup('autocomplete', data is not None)
+        if data is None:
+            data = self.get_data(term, page, to_field_name)
+            cache.set(cache_key, data, CACHE_TIMEOUT)
+        return JsonResponse(data)
+
+    def get_data(self, term, page, to_field_name):
+        queryset = self.model_admin.get_autocomplete_queryset(self.request) \
+            .complex_filter(self.source_field.get_limit_choices_to())
+        offset = (page - 1) * self.paginate_by
+        if term:
+            objects = self.model_admin.autocomplete_results(queryset, term, offset, self.paginate_by + 1)
+        else:
+            objects = list(queryset[offset:offset + self.paginate_by + 1])
+        return {
+            'results': [self.serialize_result(obj, to_field_name) for obj in objects[:self.paginate_by]],
+            'pagination': {'more': len(objects) > self.paginate_by},
+        }
@@ -0,0 +1,123 @@
+# helpers shared by the benchmark_* management commands
+# every benchmark seeds its own data and runs inside a transaction that is rolled back at the end,
+# so they can be pointed at a real database without leaving anything behind.
+# the seed functions use bulk_create, which skips Model.save(), so they fill in derived columns (search keys) themselves
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from .models import Collection, Customer, Order, OrderItem, Product
+from .search import normalize
+
+SEED_BATCH_SIZE = 5000
+
+
+class BenchmarkCommand(BaseCommand):
+    # subclasses implement run_benchmark instead of handle
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run_benchmark(*args, **options)
+            transaction.set_rollback(True)  # throw away everything the benchmark seeded
+
+    def run_benchmark(self, *args, **options):
+        raise NotImplementedError
+
+    def report(self, label, seconds, count=None, unit='rows'):
+        line = f'{label}: {seconds:.3f}s'
+        if count is not None and seconds:
+            line += f' ({count} {unit}, {count / seconds:,.0f} {unit}/s)'
+        self.stdout.write(line)
+
+
+@contextmanager
+def timer():
+    # with timer() as elapsed: ... then elapsed() returns the seconds spent inside the block
+    start = time.perf_counter()
+    end = None
+
+    def elapsed():
+        return (end or time.perf_counter()) - start
+
+    try:
+        yield elapsed
+    finally:
+        end = time.perf_counter()
+
+
+def _new_ids(model, before):
+    # bulk_create doesnt return primary keys on every backend, so we read back whatever was inserted after `before`
+    return list(model.objects.filter(pk__gt=before).order_by('pk').values_list('pk', flat=True))
+
+
+def _max_pk(model):
+    last = model.objects.order_by('-pk').values_list('pk', flat=True).first()
+    return last or 0
+
+
+def seed_customers(count, prefix='bench'):
+    before = _max_pk(Customer)
+    Customer.objects.bulk_create(
+        (
+            Customer(
+                first_name=f'{prefix}{i}',
+                first_name_key=normalize(f'{prefix}{i}'),
+                last_name=f'customer{i}',
+                last_name_key=f'customer{i}',
+                email=f'{prefix}-{before}-{i}@example.com',
+                email_local_key=normalize(f'{prefix}-{before}-{i}'),
+                email_domain_key='example.com',
+                phone='000',
+            )
+            for i in range(count)
+        ),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    return _new_ids(Customer, before)
+
+
+def seed_products(count, collection=None, prefix='bench'):
+    if collection is None:
+        collection = Collection.objects.create(title=f'{prefix} collection')
+    before = _max_pk(Product)
+    Product.objects.bulk_create(
+        (
+            Product(
+                title=f'{prefix} product {i}',
+                title_key=normalize(f'{prefix} product {i}'),
+                slug=f'{prefix}-{before}-{i}',
+                unit_price=Decimal(10 + i % 90),
+                inventory=100,
+                collection=collection,
+            )
+            for i in range(count)
+        ),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    return _new_ids(Product, before)
+
+
+def seed_orders(count, customer_ids, product_ids, items_per_order=2):
+    before = _max_pk(Order)
+    Order.objects.bulk_create(
+        (Order(customer_id=customer_ids[i % len(customer_ids)]) for i in range(count)),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    order_ids = _new_ids(Order, before)
+    OrderItem.objects.bulk_create(
+        (
+            OrderItem(
+                order_id=order_id,
+                product_id=product_ids[(i * items_per_order + n) % len(product_ids)],
+                quantity=1 + n,
+                unit_price=Decimal('10.00'),
+            )
+            for i, order_id in enumerate(order_ids)
+            for n in range(items_per_order)
+        ),
+        batch_size=SEED_BATCH_SIZE,
+    )
+    return order_ids
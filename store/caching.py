@@ -0,0 +1,145 @@
+# cached reads of hot catalog data that don't stampede the database when an entry expires
+# get_or_compute(key, compute, timeout) returns the cached value of key or computes it, with:
+#   - single flight: on a miss only one thread per process computes, the others wait for its result
+#     and only one process at a time computes, the others poll the cache (a lock added with cache.add)
+#   - early refresh: an entry may be refreshed a little before it expires, more likely the closer it is
+#     to expiring and the longer it took to compute ("optimal probabilistic cache stampede prevention",
+#     Vattani et al.), so busy keys are usually refreshed before anyone misses
+#   - stale while revalidate: entries are kept STORE_CATALOG_CACHE_STALE seconds past their timeout.
+#     the caller that takes the lock refreshes the entry, everyone else is served the stale value meanwhile
+# values are stored as (value, seconds to compute, expiry timestamp), so None is cached like any other value
+import math
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.db import transaction
+
+from .metrics import CACHE_REQUESTS
+
+TIMEOUT = getattr(settings, 'STORE_CATALOG_CACHE_TIMEOUT', 300)
+STALE = getattr(settings, 'STORE_CATALOG_CACHE_STALE', 60)
+BETA = getattr(settings, 'STORE_CATALOG_CACHE_BETA', 1.0)  # > 1 refreshes earlier, 0 never early
+LOCK_TIMEOUT = 30  # seconds, longer than any compute should take. a lock left by a dead process expires then
+POLL_INTERVAL = 0.05
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _single_flight(key, function):
+    # calls function once for all the threads asking for key at the same time
+    with _flights_lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+    try:
+        flight.value = function()
+    except Exception as error:
+        flight.error = error
+        raise
+    finally:
+        with _flights_lock:
+            del _flights[key]
+        flight.done.set()
+    return flight.value
+
+
+def _lock(cache, key):
+    # returns a token if we got the lock, None if another process holds it
+    token = uuid.uuid4().hex
+    return token if cache.add(f'lock:{key}', token, LOCK_TIMEOUT) else None
+
+
+def _unlock(cache, key, token):
+    # not atomic, but a lock is only deleted by its owner unless it expired in between
+    if cache.get(f'lock:{key}') == token:
+        cache.delete(f'lock:{key}')
+
+
+def _compute(cache, key, compute, timeout, stale):
+    start = time.perf_counter()
+    value = compute()
+    delta = time.perf_counter() - start
+    cache.set(key, (value, delta, time.time() + timeout), timeout + stale)
+    return value
+
+
+def _fill(cache, key, compute, timeout, stale):
+    # a miss. the first process to take the lock computes, the others wait for its result to show up
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        token = _lock(cache, key)
+        if token is not None:
+            try:
+                entry = cache.get(key)  # filled while we were waiting for the lock
+                if entry is not None:
+                    return entry[0]
+                return _compute(cache, key, compute, timeout, stale)
+            finally:
+                _unlock(cache, key, token)
+        time.sleep(POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[0]
+        if time.monotonic() > deadline:
+            return _compute(cache, key, compute, timeout, stale)
+
+
+def get_or_compute(key, compute, timeout=TIMEOUT, stale=STALE, beta=BETA, name='catalog', cache=default_cache):
+    # compute() is called without arguments and returns something the cache can pickle
+    entry = cache.get(key)
+    if entry is None:
+        CACHE_REQUESTS.inc(cache=name, result='miss')
+        return _single_flight(key, lambda: _fill(cache, key, compute, timeout, stale))
+    value, delta, expires_at = entry
+    # -log(random()) is 0 to infinity, rarely above 3, so refreshes start about 3 compute times before expiry
+    if time.time() - delta * beta * math.log(1.0 - random.random()) < expires_at:
+        CACHE_REQUESTS.inc(cache=name, result='hit')
+        return value
+    # expired or picked for an early refresh. whoever takes the lock refreshes, the others keep the value we have
+    token = _lock(cache, key)
+    if token is None:
+        CACHE_REQUESTS.inc(cache=name, result='stale')
+        return value
+    CACHE_REQUESTS.inc(cache=name, result='refresh')
+    try:
+        return _compute(cache, key, compute, timeout, stale)
+    finally:
+        _unlock(cache, key, token)
+
+
+def set_many(values, seconds=0.0, timeout=TIMEOUT, stale=STALE, cache=default_cache):
+    # stores {key: value} computed ahead of time, e.g by the warm_caches command. seconds is how long computing
+    # one value took, for the early refresh
+    cache.set_many({key: (value, seconds, time.time() + timeout) for key, value in values.items()}, timeout + stale)
+
+
+def missing(keys, cache=default_cache):
+    # the keys that aren't cached, one round trip
+    found = cache.get_many(keys)
+    return [key for key in keys if key not in found]
+
+
+def invalidate(*keys, cache=default_cache):
+    # the next read computes again. deleted once the transaction commits, otherwise a read before the commit
+    # would cache the old rows again
+    keys = list(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
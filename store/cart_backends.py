@@ -0,0 +1,262 @@
+# cart storage backends
+# code that works with carts asks get_cart_backend() for the configured backend instead of using the models directly,
+# so anonymous carts can live in the cache and only reach the Cart/CartItem tables at checkout or on a flush.
+#   DatabaseCartBackend - every operation reads and writes the Cart/CartItem tables (store/carts.py)
+#   CacheCartBackend    - carts live in the django cache (locmem/file in development, redis in production)
+# the backend is chosen with the STORE_CART_BACKEND setting
+import logging
+import uuid
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from . import carts, catalog, pricing
+from .models import Cart, CartItem
+
+logger = logging.getLogger(__name__)
+
+
+class BaseCartBackend:
+    def create_cart(self):
+        # returns the id used to refer to the cart in the other methods
+        raise NotImplementedError
+
+    def add_item(self, cart_id, product_id, quantity=1):
+        raise NotImplementedError
+
+    def set_quantity(self, cart_id, product_id, quantity):
+        raise NotImplementedError
+
+    def remove_item(self, cart_id, product_id):
+        self.set_quantity(cart_id, product_id, 0)
+
+    def get_items(self, cart_id):
+        # returns {product_id: quantity}
+        raise NotImplementedError
+
+    def get_total(self, cart_id):
+        # the items at their current prices after promotions
+        items = self.get_items(cart_id)
+        prices = catalog.prices(list(items))
+        return sum((prices[product_id] * quantity for product_id, quantity in items.items() if product_id in prices),
+                   Decimal(0))
+
+    def delete_cart(self, cart_id):
+        raise NotImplementedError
+
+    def persist(self, cart_id):
+        # makes sure the cart and its items are stored in the Cart/CartItem tables and returns the Cart
+        raise NotImplementedError
+
+    def checkout(self, cart_id, customer_id):
+        cart = self.persist(cart_id)
+        order = carts.place_order(cart.pk, customer_id)
+        self.delete_cart(cart_id)
+        return order
+
+
+class DatabaseCartBackend(BaseCartBackend):
+    def create_cart(self):
+        return Cart.objects.create().pk
+
+    def add_item(self, cart_id, product_id, quantity=1):
+        carts.add_item(cart_id, product_id, quantity)
+
+    def set_quantity(self, cart_id, product_id, quantity):
+        carts.set_quantity(cart_id, product_id, quantity)
+
+    def get_items(self, cart_id):
+        return dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+
+    def get_total(self, cart_id):
+        return carts.get_total(cart_id)  # kept up to date in the Cart row
+
+    def delete_cart(self, cart_id):
+        Cart.objects.filter(pk=cart_id).delete()
+
+    def persist(self, cart_id):
+        return Cart.objects.get(pk=cart_id)
+
+
+class CacheCartBackend(BaseCartBackend):
+    # a cart is a handful of cache keys, all using only operations the django cache api makes atomic (add/incr):
+    #   cart:<id>:item:<product id>  quantity, changed with incr
+    #   cart:<id>:slots              number of distinct products ever added, incr hands out the next slot
+    #   cart:<id>:slot:<n>           the product id stored in slot n, so we can list the items without a scan
+    #   cart:<id>:db                 pk of the Cart row once the cart has been persisted
+    #   cart:<id>:dirty              set while the cart has changes that haven't been flushed
+    # carts with changes are appended to a global log (cartstore:log:<n>) which flush() works through.
+    # the cache is the only copy of a cart until it is flushed, so it must never evict keys: memcached and caches
+    # culling at a small MAX_ENTRIES are refused, redis has to run with maxmemory-policy noeviction
+    prefix = 'cart'
+    min_entries = 10 ** 6  # MAX_ENTRIES a culling cache (locmem, file, database) needs at least
+    flush_lock_timeout = 15 * 60  # seconds, a flush that died releases its lock after this
+
+    def __init__(self, alias=None, timeout=None):
+        alias = alias or getattr(settings, 'STORE_CART_CACHE', 'default')
+        self.cache = caches[alias]
+        self.timeout = timeout or getattr(settings, 'STORE_CART_TIMEOUT', 7 * 24 * 60 * 60)
+        if isinstance(self.cache, BaseMemcachedCache) or \
+                (not isinstance(self.cache, RedisCache) and self.cache._max_entries < self.min_entries):
+            raise ImproperlyConfigured(
+                f'the {alias!r} cache evicts keys, carts kept in it would be lost. use redis with '
+                f'maxmemory-policy noeviction, or a cache with OPTIONS MAX_ENTRIES of at least {self.min_entries}'
+            )
+
+    def _key(self, cart_id, *parts):
+        return ':'.join([self.prefix, str(cart_id), *map(str, parts)])
+
+    def create_cart(self):
+        cart_id = uuid.uuid4().hex
+        self.cache.set(self._key(cart_id, 'slots'), 0, self.timeout)
+        return cart_id
+
+    def _incr(self, key, delta, forever=False):
+        # returns (new value, whether the key had to be created)
+        try:
+            return self.cache.incr(key, delta), False
+        except ValueError:  # missing key
+            if self.cache.add(key, delta, None if forever else self.timeout):
+                return delta, True
+            return self.cache.incr(key, delta), False
+
+    def _register(self, cart_id, product_id):
+        slot, _ = self._incr(self._key(cart_id, 'slots'), 1)
+        self.cache.set(self._key(cart_id, 'slot', slot), product_id, self.timeout)
+
+    def _changed(self, cart_id):
+        self.cache.touch(self._key(cart_id, 'slots'), self.timeout)
+        if self.cache.add(self._key(cart_id, 'dirty'), 1, self.timeout):
+            # the log counters never expire, otherwise they could restart below what was already flushed
+            position, _ = self._incr('cartstore:log', 1, forever=True)
+            self.cache.set(f'cartstore:log:{position}', cart_id, self.timeout)
+
+    def add_item(self, cart_id, product_id, quantity=1):
+        _, created = self._incr(self._key(cart_id, 'item', product_id), quantity)
+        if created:
+            self._register(cart_id, product_id)
+        else:
+            self.cache.touch(self._key(cart_id, 'item', product_id), self.timeout)
+        self._changed(cart_id)
+
+    def set_quantity(self, cart_id, product_id, quantity):
+        key = self._key(cart_id, 'item', product_id)
+        quantity = max(quantity, 0)  # removed products keep their slot with a quantity of 0
+        if self.cache.add(key, quantity, self.timeout):
+            self._register(cart_id, product_id)
+        else:
+            self.cache.set(key, quantity, self.timeout)
+        self._changed(cart_id)
+
+    def get_items(self, cart_id):
+        slots = self.cache.get(self._key(cart_id, 'slots')) or 0
+        slot_keys = [self._key(cart_id, 'slot', n) for n in range(1, slots + 1)]
+        slot_values = self.cache.get_many(slot_keys)
+        item_keys = {self._key(cart_id, 'item', product_id): product_id for product_id in set(slot_values.values())}
+        quantities = self.cache.get_many(list(item_keys))
+        # keys of products added long ago are only written once, so reading the cart
+        # (which the periodic flush does for every changed cart) refreshes the expiry of all of them
+        self.cache.set_many({**slot_values, **quantities}, self.timeout)
+        return {item_keys[key]: quantity for key, quantity in quantities.items() if quantity > 0}
+
+    def delete_cart(self, cart_id):
+        slots = self.cache.get(self._key(cart_id, 'slots')) or 0
+        slot_keys = [self._key(cart_id, 'slot', n) for n in range(1, slots + 1)]
+        product_ids = self.cache.get_many(slot_keys).values()
+        self.cache.delete_many([
+            *slot_keys,
+            *(self._key(cart_id, 'item', product_id) for product_id in product_ids),
+            self._key(cart_id, 'slots'),
+            self._key(cart_id, 'db'),
+            self._key(cart_id, 'dirty'),
+        ])
+
+    def persist(self, cart_id):
+        # the flag is cleared before reading the cart so changes made while we write are flushed again.
+        # when the write fails the cart is marked as changed again, the next flush retries it
+        self.cache.delete(self._key(cart_id, 'dirty'))
+        try:
+            return self._write(cart_id)
+        except Exception:
+            self._changed(cart_id)
+            raise
+
+    def _write(self, cart_id):
+        items = self.get_items(cart_id)
+        prices = pricing.promotion_prices(list(items))  # only has the products that exist
+        with transaction.atomic():
+            cart_pk = self.cache.get(self._key(cart_id, 'db'))
+            cart = Cart.objects.filter(pk=cart_pk).first() if cart_pk else None
+            if cart is None:
+                cart = Cart.objects.create()
+                if not self.cache.add(self._key(cart_id, 'db'), cart.pk, self.timeout):
+                    # a concurrent flush or checkout persisted this cart first, use its row. the key can also
+                    # point at a row a failed write rolled back (whose id the database may have given us again),
+                    # then it's replaced with ours
+                    other_pk = self.cache.get(self._key(cart_id, 'db'))
+                    other = Cart.objects.filter(pk=other_pk).first() if other_pk != cart.pk else None
+                    if other is not None:
+                        cart.delete()
+                        cart = other
+                    else:
+                        self.cache.set(self._key(cart_id, 'db'), cart.pk, self.timeout)
+            else:
+                carts.touch(cart.pk)
+            # one statement to upsert the quantities (relies on the unique (cart, product) constraint)
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart=cart, product_id=product_id, quantity=min(quantity, carts.MAX_QUANTITY),
+                             unit_price=prices[product_id])
+                    for product_id, quantity in items.items()
+                    if product_id in prices
+                ],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'unit_price'],
+            )
+            CartItem.objects.filter(cart=cart).exclude(product_id__in=prices).delete()
+            carts.update_totals([cart.pk])
+        return cart
+
+    def flush(self):
+        # persists every cart changed since the last flush, returns how many carts were written.
+        # run it on an interval (see the flush_carts command). raises FlushInProgress while another flush runs
+        lock = uuid.uuid4().hex
+        if not self.cache.add('cartstore:flush-lock', lock, self.flush_lock_timeout):
+            raise FlushInProgress('another flush is running')
+        try:
+            flushed = self.cache.get('cartstore:flushed') or 0
+            last = self.cache.get('cartstore:log') or 0
+            count = 0
+            for position in range(flushed + 1, last + 1):
+                cart_id = self.cache.get(f'cartstore:log:{position}')
+                if cart_id is not None and self.cache.get(self._key(cart_id, 'slots')) is not None:
+                    try:
+                        self.persist(cart_id)
+                        count += 1
+                    except Exception:
+                        # persist put the cart back in the log, one bad cart doesn't hold up the others
+                        logger.exception('could not flush cart %s', cart_id)
+                self.cache.delete(f'cartstore:log:{position}')
+                self.cache.set('cartstore:flushed', position, None)
+            return count
+        finally:
+            if self.cache.get('cartstore:flush-lock') == lock:
+                self.cache.delete('cartstore:flush-lock')
+
+
+class FlushInProgress(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def get_cart_backend():
+    path = getattr(settings, 'STORE_CART_BACKEND', 'store.cart_backends.DatabaseCartBackend')
+    return import_string(path)()
@@ -0,0 +1,268 @@
+# cart operations
+# every change to a cart goes through these functions so that Cart.last_touched and Cart.total stay up to date.
+# cart items keep the price of their product (after promotions) from when they were added, and
+# reprice_products() updates them in every open cart once a price or promotion change committed (see store/signals.py).
+# we touch the cart explicitly instead of using signals on CartItem: a post_delete receiver on CartItem
+# would stop django from deleting cart items with a single DELETE statement when carts are swept
+import time
+from datetime import timedelta
+
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Min, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import catalog, collection_summaries, history, outbox, pricing, sharding, stock
+from .metrics import CHECKOUTS
+from .models import Cart, CartItem, Order, OrderItem, Product
+
+MAX_QUANTITY = 32767  # CartItem.quantity is a PositiveSmallIntegerField
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id):
+        super().__init__(f'not enough inventory for product {product_id}')
+        self.product_id = product_id
+
+
+def _totals():
+    # the total of the cart of the outer query, for Cart.objects.update(total=...)
+    money = DecimalField(max_digits=12, decimal_places=2)
+    item_totals = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart') \
+        .annotate(total=Sum(F('quantity') * F('unit_price'), output_field=money)).values('total')
+    return Coalesce(Subquery(item_totals, output_field=money), Value(Decimal(0)), output_field=money)
+
+
+def touch(cart_id):
+    # called after every change to the items of the cart, one statement
+    Cart.objects.filter(pk=cart_id).update(last_touched=timezone.now(), total=_totals())
+
+
+def update_totals(cart_ids):
+    # recomputes Cart.total of many carts in one statement, without touching them
+    return Cart.objects.filter(pk__in=cart_ids).update(total=_totals())
+
+
+def get_total(cart_id):
+    return Cart.objects.filter(pk=cart_id).values_list('total', flat=True).first()
+
+
+def add_item(cart_id, product_id, quantity=1):
+    # prices come from the database rather than the cache (store/catalog.py): a price cached just before a
+    # change would stay on the item after reprice_products ran
+    unit_price = pricing.promotion_prices([product_id]).get(product_id)
+    with transaction.atomic():
+        updated = CartItem.objects.filter(cart_id=cart_id, product_id=product_id) \
+            .update(quantity=F('quantity') + quantity, unit_price=unit_price)
+        if not updated:
+            try:
+                with transaction.atomic():  # savepoint, another request may add the same product at the same time
+                    CartItem.objects.create(cart_id=cart_id, product_id=product_id, quantity=quantity, unit_price=unit_price)
+            except IntegrityError:
+                CartItem.objects.filter(cart_id=cart_id, product_id=product_id) \
+                    .update(quantity=F('quantity') + quantity, unit_price=unit_price)
+        touch(cart_id)
+
+
+def set_quantity(cart_id, product_id, quantity):
+    with transaction.atomic():
+        if quantity <= 0:
+            CartItem.objects.filter(cart_id=cart_id, product_id=product_id).delete()
+        else:
+            CartItem.objects.update_or_create(
+                cart_id=cart_id, product_id=product_id,
+                defaults={'quantity': quantity, 'unit_price': pricing.promotion_prices([product_id]).get(product_id)},
+            )
+        touch(cart_id)
+
+
+def remove_item(cart_id, product_id):
+    set_quantity(cart_id, product_id, 0)
+
+
+def place_order(cart_id, customer_id):
+    # turns a cart into an order and deletes the cart, all or nothing.
+    # inventory is decremented with conditional F() updates so two checkouts can't sell the same last unit.
+    # the order is written to the customer's shard (see store/sharding.py). when that isn't the default database
+    # the two commits aren't atomic: the shard commits the order first, then the default database the stock and the
+    # cart. if that second commit fails the order is deleted again, the customer keeps the cart and the stock
+    try:
+        order = _place_order(cart_id, customer_id)
+    except EmptyCart:
+        CHECKOUTS.inc(outcome='empty_cart')
+        raise
+    except OutOfStock:
+        CHECKOUTS.inc(outcome='out_of_stock')
+        raise
+    except Exception:
+        CHECKOUTS.inc(outcome='error')
+        raise
+    CHECKOUTS.inc(outcome='placed')
+    return order
+
+
+def _place_order(cart_id, customer_id):
+    shard = sharding.shard_for(customer_id)
+    committed = None  # the order, once the shard committed it
+    try:
+        with transaction.atomic():
+            with transaction.atomic(using=shard):
+                order = _write_order(cart_id, customer_id, shard)
+            committed = order
+    except Exception:
+        if committed is not None and shard != 'default':
+            # the default database rolled back the stock and the cart, take the order back
+            OrderItem.objects.using(shard).filter(order_id=committed.pk).delete()
+            Order.objects.using(shard).filter(pk=committed.pk).delete()
+        raise
+    return committed
+
+
+def _write_order(cart_id, customer_id, shard):
+    # runs inside a transaction on the default database and one on the shard
+    quantities = list(
+        CartItem.objects.filter(cart_id=cart_id)
+        .order_by('product_id')  # always lock products in the same order to avoid deadlocks
+        .values_list('product_id', 'quantity')
+    )
+    if not quantities:
+        raise EmptyCart(f'cart {cart_id} is empty')
+    now = timezone.now()  # update() doesn't set the auto_now last_update, the product feeds rely on it
+    for product_id, quantity in quantities:
+        updated = Product.objects.filter(pk=product_id, inventory__gte=quantity) \
+            .update(inventory=F('inventory') - quantity, last_update=now)
+        if not updated:
+            raise OutOfStock(product_id)
+    # the order gets the prices of now, read while the products are locked. the same as the cart's
+    # unit prices, unless a price changed after the cart was loaded
+    prices = pricing.promotion_prices([product_id for product_id, _ in quantities])
+    items = [(product_id, quantity, prices[product_id]) for product_id, quantity in quantities]
+    # the F() updates skip the post_save signal, record the inventory changes ourselves
+    outbox.record_bulk(Product, [product_id for product_id, _, _ in items], fields=['inventory'])
+    stock.refresh([product_id for product_id, _, _ in items])  # alerts for products that just ran low
+    collection_summaries.record_sales({product_id: quantity for product_id, quantity, _ in items})
+    history.capture([product_id for product_id, _, _ in items])
+    catalog.invalidate_products([product_id for product_id, _, _ in items])  # their inventory changed
+
+    order = Order.objects.using(shard).create(customer_id=customer_id)
+    OrderItem.objects.using(shard).bulk_create([
+        OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=unit_price)
+        for product_id, quantity, unit_price in items
+    ])
+    Cart.objects.filter(pk=cart_id).delete()
+    return order
+
+
+class SweepResult:
+    def __init__(self):
+        self.carts = 0
+        self.items = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return (self.carts + self.items) / self.elapsed if self.elapsed else 0.0
+
+
+def sweep_expired_carts(max_age=timedelta(days=30), batch_size=1000, pause=0.0):
+    # deletes carts that haven't been touched for max_age.
+    # we walk the expired carts in primary key order, batch_size at a time, and delete each batch in its own short
+    # transaction, so no statement locks more than batch_size carts (and their items) at a time. every batch starts
+    # after the last id of the previous one, gaps in the ids cost nothing
+    result = SweepResult()
+    start = time.perf_counter()
+    cutoff = timezone.now() - max_age
+    expired = Cart.objects.filter(last_touched__lt=cutoff).order_by('pk')
+    last = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                expired.filter(pk__gt=last)
+                .select_for_update(skip_locked=True)  # carts being changed right now are left for the next run
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last = ids[-1]
+            # cart items have no signals or relations of their own, so django deletes them in one statement
+            _, deleted = Cart.objects.filter(pk__in=ids).delete()
+            result.carts += deleted.get(Cart._meta.label, 0)
+            result.items += deleted.get(CartItem._meta.label, 0)
+        result.batches += 1
+        if pause:
+            time.sleep(pause)  # gives replicas and other writers some room between batches
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def merge_duplicate_items(batch_size=1000):
+    # folds CartItem rows for the same (cart, product) into the row with the lowest id.
+    # the unique constraint on CartItem prevents new duplicates, this cleans up rows written before it existed.
+    # returns the number of rows removed
+    removed = 0
+    duplicates = CartItem.objects.values('cart_id', 'product_id') \
+        .annotate(rows=Count('id'), keep=Min('id'), total=Sum('quantity')) \
+        .filter(rows__gt=1) \
+        .order_by()
+    while True:
+        batch = list(duplicates[:batch_size])
+        if not batch:
+            return removed
+        with transaction.atomic():
+            CartItem.objects.bulk_update(
+                [CartItem(id=group['keep'], quantity=min(group['total'], MAX_QUANTITY)) for group in batch],
+                ['quantity'],
+            )
+            extra = Q()
+            for group in batch:
+                extra |= Q(cart_id=group['cart_id'], product_id=group['product_id']) & ~Q(id=group['keep'])
+            count, _ = CartItem.objects.filter(extra).delete()
+            removed += count
+            update_totals({group['cart_id'] for group in batch})
+
+
+class RepriceResult:
+    def __init__(self):
+        self.items = 0
+        self.carts = 0
+        self.batches = 0
+        self.elapsed = 0.0
+
+
+def reprice_products(product_ids, batch_size=5000):
+    # sets the current price (after promotions) on every cart item of the products and recomputes the totals
+    # of the carts they're in. a batch is three statements: find up to batch_size items still at another price,
+    # update them, update the totals of their carts. carts are only ever open (placed carts are deleted)
+    result = RepriceResult()
+    start = time.perf_counter()
+    prices = pricing.promotion_prices(product_ids)
+    for product_id, price in sorted(prices.items()):
+        stale = CartItem.objects.filter(product_id=product_id).exclude(unit_price=price)
+        last = 0
+        while True:
+            with transaction.atomic():
+                rows = list(stale.filter(pk__gt=last).order_by('pk').values_list('pk', 'cart_id')[:batch_size])
+                if not rows:
+                    break
+                last = rows[-1][0]
+                result.items += CartItem.objects.filter(pk__in=[pk for pk, _ in rows]).update(unit_price=price)
+                result.carts += update_totals({cart_id for _, cart_id in rows})
+            result.batches += 1
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def reprice_after_commit(product_ids):
+    # the signals run inside the transaction saving the product or promotion (an admin save is one transaction),
+    # repricing there would hold the locks of every cart item it updated until that commits.
+    # the carts are repriced once it committed, one transaction per batch. a failure is logged, the save stays
+    product_ids = list(product_ids)
+    if product_ids:
+        transaction.on_commit(lambda: reprice_products(product_ids), robust=True)
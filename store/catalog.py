@@ -0,0 +1,144 @@
+# the cached catalog reads: product pages, collection pages and promotion prices
+# the views and the warm_caches command both go through these functions, so they fill the same keys.
+# product pages and prices are invalidated by the signals in store/signals.py (and by the code that changes
+# products with update()), collection pages just expire
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import caching, collection_summaries, pricing
+from .models import OrderItem, Product, ProductViewCount
+
+
+def product_key(pk):
+    return f'product:{pk}'
+
+
+def collection_key(pk, by):
+    return f'collection:{pk}:{by}'
+
+
+def price_key(pk):
+    return f'price:{pk}'
+
+
+def product_dict(product):
+    return {
+        'id': product.id,
+        'title': product.title,
+        'slug': product.slug,
+        'description': product.description,
+        'unit_price': str(product.unit_price),
+        'inventory': product.inventory,
+        'collection': {'id': product.collection_id, 'title': product.collection.title},
+    }
+
+
+def product_summary(product):
+    return {'id': product.id, 'title': product.title, 'slug': product.slug, 'unit_price': str(product.unit_price)}
+
+
+def load_product(pk):
+    product = Product.objects.select_related('collection').filter(pk=pk).first()
+    return product_dict(product) if product is not None else None
+
+
+def load_collection(pk, by):
+    page = collection_summaries.collection_page(pk, by)
+    if page is None:
+        return None
+    collection, products_count, top = page
+    featured = collection.featured_product
+    return {
+        'id': collection.id,
+        'title': collection.title,
+        'products_count': products_count,
+        'featured_product': product_summary(featured) if featured is not None else None,
+        'top_products': [product_summary(product) for product in top],
+    }
+
+
+def product(pk):
+    # the product page data or None, see store/caching.py
+    return caching.get_or_compute(product_key(pk), lambda: load_product(pk), name='products')
+
+
+def collection(pk, by):
+    return caching.get_or_compute(collection_key(pk, by), lambda: load_collection(pk, by), name='collections')
+
+
+def prices(product_ids):
+    # {product_id: price after promotions}, one cache round trip for all the products plus two queries for
+    # the ones that weren't cached. these are plain cache entries: a miss is cheap for one product
+    keys = {price_key(pk): pk for pk in product_ids}
+    found = {keys[key]: price for key, price in cache.get_many(keys).items()}
+    missing = [pk for pk in keys.values() if pk not in found]
+    if missing:
+        computed = pricing.promotion_prices(missing)
+        cache.set_many({price_key(pk): price for pk, price in computed.items()}, caching.TIMEOUT)
+        found.update(computed)
+    return found
+
+
+# warming, used by the warm_caches command after a deploy. each function fills the keys of a batch that aren't
+# cached yet, with as few queries as it can, and returns how many keys it filled
+
+def hot_products(days=7, limit=1000, view_weight=0.1):
+    # product ids by units sold plus view_weight per view over the last days, most popular first.
+    # views are lifetime totals of the products viewed since then
+    since = timezone.now() - timedelta(days=days)
+    scores = Counter()
+    sold = OrderItem.objects.filter(order__placed_at__gte=since) \
+        .values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units')
+    for shard_sold in sold.gather(list).values():  # summed on every order shard (see store/sharding.py)
+        for product_id, units in shard_sold:
+            scores[product_id] += units
+    viewed = ProductViewCount.objects.filter(updated_at__gte=since).order_by('-views').values_list('product_id', 'views')
+    for product_id, views in viewed[:limit]:
+        scores[product_id] += views * view_weight
+    return [product_id for product_id, _ in scores.most_common(limit)]
+
+
+def warm_products(product_ids):
+    keys = {product_key(pk): pk for pk in product_ids}
+    missing = [keys[key] for key in caching.missing(list(keys))]
+    if not missing:
+        return 0
+    start = time.perf_counter()
+    products = Product.objects.select_related('collection').filter(pk__in=missing)
+    values = {product_key(product.pk): product_dict(product) for product in products}
+    caching.set_many(values, (time.perf_counter() - start) / len(missing))
+    return len(values)
+
+
+def warm_prices(product_ids):
+    keys = {price_key(pk): pk for pk in product_ids}
+    missing = [keys[key] for key in caching.missing(list(keys))]
+    if not missing:
+        return 0
+    computed = pricing.promotion_prices(missing)
+    cache.set_many({price_key(pk): price for pk, price in computed.items()}, caching.TIMEOUT)
+    return len(computed)
+
+
+def warm_collections(collection_ids):
+    warmed = 0
+    keys = [(pk, by) for pk in collection_ids for by in collection_summaries.RANKINGS]
+    missing = set(caching.missing([collection_key(pk, by) for pk, by in keys]))
+    for pk, by in keys:
+        if collection_key(pk, by) in missing:
+            collection(pk, by)  # two queries, the same as a page view
+            warmed += 1
+    return warmed
+
+
+def invalidate_products(product_ids):
+    keys = []
+    for pk in product_ids:
+        keys += [product_key(pk), price_key(pk)]
+    if keys:
+        caching.invalidate(*keys)
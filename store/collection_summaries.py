@@ -0,0 +1,146 @@
+# collection pages: product count, featured product and the best selling or most liked products,
+# served in two queries whatever the size of the collection.
+# instead of counting and ranking products when a page is read, we keep
+#   CollectionSummary   products_count per collection, adjusted by one as products are added, moved or deleted
+#   ProductPopularity   units_sold and likes per product, with the product's collection, indexed by
+#                       (collection, -units_sold) and (collection, -likes) so a top list is an index range read
+# the product signals (store/signals.py) and checkout/ingestion call the functions below.
+# likes live in another app, store_custom keeps ProductPopularity.likes up to date.
+# rebuild() recomputes everything, e.g after products or orders were bulk loaded
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import ArchivedOrderItem, Collection, CollectionSummary, OrderItem, Product, ProductPopularity
+
+TOP_N = getattr(settings, 'STORE_COLLECTION_TOP_N', 10)
+RANKINGS = {
+    'sales': '-units_sold',
+    'likes': '-likes',
+}
+BATCH_SIZE = 1000
+
+
+def _adjust_count(collection_id, delta):
+    updated = CollectionSummary.objects.filter(pk=collection_id).update(products_count=F('products_count') + delta)
+    if not updated:
+        # first change since the collection was created without a summary, count once
+        CollectionSummary.objects.get_or_create(
+            pk=collection_id,
+            defaults={'products_count': Product.objects.filter(collection_id=collection_id).count()},
+        )
+
+
+def collection_added(collection_id):
+    CollectionSummary.objects.get_or_create(pk=collection_id)
+
+
+def product_added(product_id, collection_id):
+    with transaction.atomic():
+        ProductPopularity.objects.get_or_create(product_id=product_id, defaults={'collection_id': collection_id})
+        _adjust_count(collection_id, 1)
+
+
+def product_moved(product_id, old_collection_id, collection_id):
+    with transaction.atomic():
+        ProductPopularity.objects.filter(product_id=product_id).update(collection_id=collection_id)
+        _adjust_count(old_collection_id, -1)
+        _adjust_count(collection_id, 1)
+
+
+def product_removed(collection_id):
+    # the product's ProductPopularity row is deleted with it
+    _adjust_count(collection_id, -1)
+
+
+def _add_to_products(field, amounts):
+    # amounts is {product_id: amount}, one update per product in id order (the lock order of checkout)
+    # the totals never go below 0: a negative amount only updates a row that can take it (like Tag.usage_count)
+    missing = []
+    for product_id in sorted(amounts):
+        popularity = ProductPopularity.objects.filter(product_id=product_id)
+        if amounts[product_id] < 0:
+            popularity = popularity.filter(**{f'{field}__gte': -amounts[product_id]})
+        updated = popularity.update(**{field: F(field) + amounts[product_id]})
+        if not updated:
+            missing.append(product_id)
+    if missing:
+        # products created with bulk_create, which skips the signals. rows that exist are left alone
+        ProductPopularity.objects.bulk_create(
+            [
+                ProductPopularity(product_id=product_id, collection_id=collection_id, **{field: max(amounts[product_id], 0)})
+                for product_id, collection_id in Product.objects.filter(pk__in=missing).values_list('pk', 'collection_id')
+            ],
+            ignore_conflicts=True,
+        )
+
+
+def record_sales(quantities):
+    # quantities is {product_id: units} of orders that were just placed
+    _add_to_products('units_sold', quantities)
+
+
+def record_likes(product_id, delta):
+    _add_to_products('likes', {product_id: delta})
+
+
+def top_products(collection_id, by='sales', limit=TOP_N):
+    return [
+        popularity.product
+        for popularity in ProductPopularity.objects.filter(collection_id=collection_id)
+        .select_related('product')
+        .order_by(RANKINGS[by], 'product_id')[:limit]
+    ]
+
+
+def collection_page(collection_id, by='sales', limit=TOP_N):
+    # returns (collection, products_count, top products) or None. two queries
+    collection = Collection.objects.select_related('summary', 'featured_product').filter(pk=collection_id).first()
+    if collection is None:
+        return None
+    try:
+        products_count = collection.summary.products_count
+    except CollectionSummary.DoesNotExist:
+        products_count = 0
+    return collection, products_count, top_products(collection_id, by, limit)
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    # recomputes the summaries and units sold from the products and orders, returns (collections, products).
+    # likes are left alone, their owner rebuilds them
+    with transaction.atomic():
+        counts = dict(Product.objects.values('collection_id').annotate(count=Count('pk')).values_list('collection_id', 'count'))
+        collection_ids = list(Collection.objects.values_list('pk', flat=True))
+        CollectionSummary.objects.filter(pk__in=collection_ids).delete()
+        CollectionSummary.objects.bulk_create(
+            [CollectionSummary(pk=pk, products_count=counts.get(pk, 0)) for pk in collection_ids],
+            batch_size=batch_size,
+        )
+
+        sold = Counter()
+        units = OrderItem.objects.values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units')
+        for shard_units in units.gather(list).values():  # summed on every order shard (see store/sharding.py)
+            sold.update(dict(shard_units))
+        # and on the archived orders (see store/archive.py)
+        sold.update(dict(
+            ArchivedOrderItem.objects.values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units')
+        ))
+        likes = dict(ProductPopularity.objects.values_list('product_id', 'likes'))
+        ProductPopularity.objects.all().delete()
+        products = 0
+        rows = Product.objects.order_by('pk').values_list('pk', 'collection_id').iterator(chunk_size=batch_size)
+        batch = []
+        for product_id, collection_id in rows:
+            batch.append(ProductPopularity(
+                product_id=product_id, collection_id=collection_id,
+                units_sold=sold.get(product_id, 0), likes=likes.get(product_id, 0),
+            ))
+            if len(batch) == batch_size:
+                ProductPopularity.objects.bulk_create(batch)
+                products += len(batch)
+                batch = []
+        ProductPopularity.objects.bulk_create(batch)
+        products += len(batch)
+    return len(collection_ids), products
@@ -0,0 +1,107 @@
+# customer lookup over the normalized, indexed search keys kept on Customer
+# (first_name_key, last_name_key, email_local_key and email_domain_key, see Customer.save)
+#   "jo"            customers whose first name, last name or email local part starts with jo
+#   "john smi"      every word is the start of one of those, e.g John Smith
+#   "john.smith@"   the email local part is john.smith
+#   "john@exa"      local part john, domain starting with exa
+#   "@example.com"  domain starting with example.com
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Customer
+from .search import normalize, prefix_filter, split_email
+
+NAME_FIELDS = ['first_name_key', 'last_name_key', 'email_local_key']
+
+
+def is_email_term(term):
+    return '@' in term
+
+
+def email_filter(term):
+    local, domain = split_email(term)
+    if not local and not domain:
+        return Q(pk__in=[])  # just "@", an empty Q() would match every customer
+    condition = Q()
+    if local:
+        condition &= Q(email_local_key=local)
+    if domain:
+        condition &= prefix_filter('email_domain_key', domain)
+    return condition
+
+
+def _words_filter(words):
+    # every word has to be the start of one of the name fields
+    condition = Q()
+    for word in words:
+        word_condition = Q()
+        for field in NAME_FIELDS:
+            word_condition |= prefix_filter(field, word)
+        condition &= word_condition
+    return condition
+
+
+def _field_filter(field, term):
+    # the matches of search_filter(term) whose first word matches this field,
+    # written so the database can answer it with a range scan on the field's index
+    words = term.split()
+    condition = prefix_filter(field, term)
+    if len(words) > 1:
+        condition |= prefix_filter(field, words[0]) & _words_filter(words[1:])
+    return condition
+
+
+def search_filter(term):
+    term = normalize(term)
+    if is_email_term(term):
+        return email_filter(term)
+    condition = Q()
+    for field in NAME_FIELDS:
+        condition |= _field_filter(field, term)
+    return condition
+
+
+def lookup_customers(term, limit=20):
+    term = normalize(term)
+    if not term:
+        return []
+    queryset = Customer.objects.only(
+        'id', 'first_name', 'last_name', 'email', 'membership', 'first_name_key', 'last_name_key', 'email_local_key'
+    )
+    if is_email_term(term):
+        return list(queryset.filter(email_filter(term)).order_by('email_local_key', 'pk')[:limit])
+    # one index range scan per key column, each stopping after limit rows, merged in python
+    found = {}
+    for field in NAME_FIELDS:
+        for customer in queryset.filter(_field_filter(field, term)).order_by(field, 'pk')[:limit]:
+            found.setdefault(customer.pk, customer)
+    ordered = sorted(found.values(), key=lambda customer: (customer.first_name_key, customer.last_name_key, customer.pk))
+    return ordered[:limit]
+
+
+def backfill_search_keys(batch_size=2000):
+    # recomputes the search keys of every customer in primary key batches and writes only the rows that changed,
+    # e.g after customers were created with bulk_create or the normalization changed. returns (checked, updated)
+    checked = updated = 0
+    last_pk = 0
+    fields = ['first_name_key', 'last_name_key', 'email_local_key', 'email_domain_key']
+    while True:
+        batch = list(
+            Customer.objects.filter(pk__gt=last_pk).order_by('pk')
+            .only('pk', 'first_name', 'last_name', 'email', *fields)[:batch_size]
+        )
+        if not batch:
+            return checked, updated
+        changed = []
+        for customer in batch:
+            keys = (normalize(customer.first_name), normalize(customer.last_name), *split_email(customer.email))
+            if keys != tuple(getattr(customer, field) for field in fields):
+                customer.first_name_key, customer.last_name_key, customer.email_local_key, \
+                    customer.email_domain_key = keys
+                changed.append(customer)
+        if changed:
+            with transaction.atomic():
+                Customer.objects.bulk_update(changed, fields)
+        checked += len(batch)
+        updated += len(changed)
+        last_pk = batch[-1].pk
@@ -0,0 +1,189 @@
+# xml sitemaps and a google merchant product feed of the whole catalog, written as gzip files to STORE_FEEDS_DIR
+# products are split into shards of SHARD_SIZE consecutive ids, so a shard's files never hold more than the
+# 50,000 urls a sitemap may list (well under its 50MB too, slugs are short), and a product always stays in the
+# same shard. every shard has two files, sitemap-products-<n>.xml.gz and products-<n>.xml.gz, written from one
+# .iterator() read of its id range straight into gzip, so memory doesn't grow with the catalog.
+# sitemap.xml is the sitemap index listing the shard sitemaps, submit that one.
+#
+# generate() only rewrites the shards that changed since the last run, recorded in manifest.json:
+#   - shards with a product whose last_update is after the last run started (an index range read on last_update)
+#   - shards whose product count changed, i.e products were deleted (one grouped count over the id index)
+# code changing products with update() sets last_update too, so inventory changes at checkout are picked up
+import gzip
+import json
+import os
+import time
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, F
+from django.db.models.functions import Floor
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Collection, Product
+
+FEEDS_DIR = getattr(settings, 'STORE_FEEDS_DIR', os.path.join(settings.BASE_DIR, 'feeds'))
+SITE_URL = getattr(settings, 'STORE_SITE_URL', 'http://localhost:8000').rstrip('/')
+FEEDS_URL = getattr(settings, 'STORE_FEEDS_URL', SITE_URL + '/')  # where the files of FEEDS_DIR are served
+CURRENCY = getattr(settings, 'STORE_FEED_CURRENCY', 'USD')
+SHARD_SIZE = 50000  # the most urls a sitemap may list
+CHUNK_SIZE = 2000
+COMPRESS_LEVEL = 6  # 9 is a lot slower for files a few percent smaller
+
+SITEMAP_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+SITEMAP_FOOTER = '</urlset>\n'
+FEED_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n<channel>\n'
+    '<title>Storefront products</title>\n<link>{site}</link>\n<description>Products of the store</description>\n'
+)
+FEED_FOOTER = '</channel>\n</rss>\n'
+
+
+class FeedResult:
+    def __init__(self):
+        self.shards = 0  # shards rewritten
+        self.removed = 0  # shards without products anymore
+        self.products = 0  # products written
+        self.elapsed = 0.0
+
+    @property
+    def products_per_second(self):
+        return self.products / self.elapsed if self.elapsed else 0.0
+
+
+def sitemap_name(shard):
+    return f'sitemap-products-{shard:05d}.xml.gz'
+
+
+def feed_name(shard):
+    return f'products-{shard:05d}.xml.gz'
+
+
+def _product_url():
+    # the url of every product page is this prefix + slug + suffix, reverse() once instead of 5 million times
+    prefix, suffix = reverse('product-detail', kwargs={'slug': 'slug'}).rsplit('slug', 1)
+    return SITE_URL + prefix, suffix
+
+
+def read_manifest(directory=FEEDS_DIR):
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {'started_at': None, 'shards': {}}
+
+
+def _replace(directory, name, write):
+    # writes to a temporary file and renames it, crawlers never download a half written file
+    path = os.path.join(directory, name)
+    with open(path + '.tmp', 'wb') as raw:
+        write(raw)
+    os.replace(path + '.tmp', path)
+
+
+def shard_counts():
+    # {shard: products}, one grouped query
+    rows = Product.objects.annotate(shard=Floor(F('pk') / SHARD_SIZE)).values('shard').annotate(count=Count('pk')) \
+        .order_by().values_list('shard', 'count')
+    return {int(shard): count for shard, count in rows}
+
+
+def changed_shards(since):
+    # shards with a product updated at or after since, streamed off the last_update index
+    shards = set()
+    ids = Product.objects.filter(last_update__gte=since).values_list('pk', flat=True).iterator(chunk_size=CHUNK_SIZE)
+    for pk in ids:
+        shards.add(pk // SHARD_SIZE)
+    return shards
+
+
+def write_shard(shard, directory=FEEDS_DIR, collections=None, chunk_size=CHUNK_SIZE):
+    # rewrites the sitemap and the feed of a shard, returns the number of products in them
+    if collections is None:
+        collections = dict(Collection.objects.values_list('pk', 'title'))
+    url_prefix, url_suffix = _product_url()
+    rows = Product.objects.filter(pk__gte=shard * SHARD_SIZE, pk__lt=(shard + 1) * SHARD_SIZE) \
+        .order_by('pk') \
+        .values_list('pk', 'slug', 'title', 'unit_price', 'inventory', 'collection_id', 'last_update') \
+        .iterator(chunk_size=chunk_size)
+    count = 0
+    sitemap_path = os.path.join(directory, sitemap_name(shard))
+    feed_path = os.path.join(directory, feed_name(shard))
+    with gzip.open(sitemap_path + '.tmp', 'wt', encoding='utf-8', compresslevel=COMPRESS_LEVEL) as sitemap, \
+            gzip.open(feed_path + '.tmp', 'wt', encoding='utf-8', compresslevel=COMPRESS_LEVEL) as feed:
+        sitemap.write(SITEMAP_HEADER)
+        feed.write(FEED_HEADER.format(site=escape(SITE_URL)))
+        for pk, slug, title, unit_price, inventory, collection_id, last_update in rows:
+            url = escape(url_prefix + slug + url_suffix)
+            sitemap.write(f'<url><loc>{url}</loc><lastmod>{last_update:%Y-%m-%d}</lastmod></url>\n')
+            feed.write(
+                f'<item><g:id>{pk}</g:id><title>{escape(title)}</title><link>{url}</link>'
+                f'<g:price>{unit_price} {CURRENCY}</g:price>'
+                f'<g:availability>{"in_stock" if inventory > 0 else "out_of_stock"}</g:availability>'
+                f'<g:sell_on_google_quantity>{max(inventory, 0)}</g:sell_on_google_quantity>'
+                f'<g:product_type>{escape(collections.get(collection_id, ""))}</g:product_type></item>\n'
+            )
+            count += 1
+        sitemap.write(SITEMAP_FOOTER)
+        feed.write(FEED_FOOTER)
+    os.replace(sitemap_path + '.tmp', sitemap_path)
+    os.replace(feed_path + '.tmp', feed_path)
+    return count
+
+
+def _remove_shard(shard, directory):
+    for name in (sitemap_name(shard), feed_name(shard)):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def _write_index(shards, directory):
+    def write(raw):
+        raw.write(b'<?xml version="1.0" encoding="UTF-8"?>\n')
+        raw.write(b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        for shard, entry in sorted(shards.items(), key=lambda item: int(item[0])):
+            loc = escape(FEEDS_URL + entry['sitemap'])
+            raw.write(f'<sitemap><loc>{loc}</loc><lastmod>{entry["lastmod"]}</lastmod></sitemap>\n'.encode())
+        raw.write(b'</sitemapindex>\n')
+    _replace(directory, 'sitemap.xml', write)
+
+
+def generate(full=False, directory=FEEDS_DIR, chunk_size=CHUNK_SIZE):
+    # rewrites the shards that changed since the last run (every shard when full), then the index and the manifest
+    result = FeedResult()
+    start = time.perf_counter()
+    started_at = timezone.now()  # products changed while we run are after this, the next run picks them up
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    previous = manifest['shards'] if not full else {}
+    counts = shard_counts()
+
+    stale = {shard for shard, count in counts.items() if previous.get(str(shard), {}).get('count') != count}
+    if manifest['started_at'] and not full:
+        stale |= changed_shards(parse_datetime(manifest['started_at']))
+    stale &= set(counts)
+
+    collections = dict(Collection.objects.values_list('pk', 'title'))
+    shards = {shard: entry for shard, entry in previous.items() if int(shard) in counts}
+    for shard in sorted(stale):
+        count = write_shard(shard, directory, collections, chunk_size)
+        shards[str(shard)] = {
+            'count': count, 'lastmod': started_at.isoformat(timespec='seconds'),
+            'sitemap': sitemap_name(shard), 'feed': feed_name(shard),
+        }
+        result.shards += 1
+        result.products += count
+    for shard in set(manifest['shards']) - set(shards):
+        _remove_shard(int(shard), directory)
+        result.removed += 1
+
+    _write_index(shards, directory)
+    manifest = {'started_at': started_at.isoformat(), 'shards': shards}
+    _replace(directory, 'manifest.json', lambda raw: raw.write(json.dumps(manifest, indent=1).encode()))
+    result.elapsed = time.perf_counter() - start
+    return result
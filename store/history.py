@@ -0,0 +1,134 @@
+# price and inventory history of products, in ProductHistory
+# a row is appended whenever the price or inventory of a product changes:
+#   - Product.save() (the admin forms, list_editable prices) through the signals in store/signals.py
+#   - update() skips the signals, so code changing products in bulk (checkout, the clear inventory action)
+#     calls capture() with the products it changed, inside its transaction
+# times are stored as minutes since 1970 and prices in cents (see the model). price_at() and inventory_between()
+# read them back as datetimes and decimals, one index range read per call.
+# compact() merges old rows so the table doesn't grow forever, the compact_history command runs it
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, ProductHistory
+
+BATCH_SIZE = 1000
+HOUR = 60
+DAY = 24 * 60
+ALL = 0  # the resolution of a row merging every change before a date
+
+
+def to_bucket(when):
+    return int(when.timestamp() // 60)
+
+
+def from_bucket(bucket):
+    return datetime.fromtimestamp(bucket * 60, tz=dt_timezone.utc)
+
+
+def to_cents(price):
+    return int((Decimal(price) * 100).to_integral_value())
+
+
+def from_cents(cents):
+    return Decimal(cents).scaleb(-2)  # 1999 -> 19.99, 1000 -> 10.00
+
+
+def record(product_id, price=None, inventory=None, when=None):
+    # appends one change, price and inventory are None when they didn't change
+    return ProductHistory.objects.create(
+        product_id=product_id,
+        bucket=to_bucket(when or timezone.now()),
+        price_cents=to_cents(price) if price is not None else None,
+        inventory=inventory,
+    )
+
+
+def capture(product_ids, price=False, inventory=True, when=None, batch_size=BATCH_SIZE):
+    # appends the current price and/or inventory of the products, read back from the database.
+    # for bulk updates, call it after the update inside the same transaction. returns the number of rows added
+    bucket = to_bucket(when or timezone.now())
+    product_ids = sorted(set(product_ids))
+    added = 0
+    for start in range(0, len(product_ids), batch_size):
+        rows = Product.objects.filter(pk__in=product_ids[start:start + batch_size]) \
+            .values_list('pk', 'unit_price', 'inventory')
+        added += len(ProductHistory.objects.bulk_create([
+            ProductHistory(
+                product_id=pk,
+                bucket=bucket,
+                price_cents=to_cents(unit_price) if price else None,
+                inventory=current_inventory if inventory else None,
+            )
+            for pk, unit_price, current_inventory in rows
+        ]))
+    return added
+
+
+def price_at(product_id, when):
+    # the unit price the product had at when, or None before its first recorded price
+    cents = ProductHistory.objects.filter(
+        product_id=product_id, bucket__lte=to_bucket(when), price_cents__isnull=False
+    ).order_by('-bucket', '-id').values_list('price_cents', flat=True).first()
+    return from_cents(cents) if cents is not None else None
+
+
+def inventory_between(product_id, start, end):
+    # [(time, inventory)] of the changes in [start, end), beginning with the inventory at start when it is known
+    first, last = to_bucket(start), to_bucket(end)
+    history = ProductHistory.objects.filter(product_id=product_id, inventory__isnull=False)
+    before = history.filter(bucket__lt=first).order_by('-bucket', '-id').values_list('inventory', flat=True).first()
+    series = [(start, before)] if before is not None else []
+    changes = history.filter(bucket__gte=first, bucket__lt=last).order_by('bucket', 'id').values_list('bucket', 'inventory')
+    series += [(from_bucket(bucket), value) for bucket, value in changes]
+    return series
+
+
+def _last(values):
+    for value in reversed(values):
+        if value is not None:
+            return value
+    return None
+
+
+def compact(older_than, resolution, batch_size=BATCH_SIZE):
+    # merges the rows before older_than into one row per product and period of `resolution` minutes (ALL merges
+    # them into a single row). a merged row has the last price and inventory of its period, at the time of the
+    # period's last change, so price_at() is only approximate inside a merged period.
+    # returns (rows removed, rows added)
+    cutoff = to_bucket(older_than)
+    finer = ProductHistory.objects.filter(bucket__lt=cutoff)
+    if resolution != ALL:
+        finer = finer.filter(resolution__gt=ALL, resolution__lt=resolution)
+    product_ids = list(finer.values_list('product_id', flat=True).distinct().order_by('product_id'))
+    removed = added = 0
+    for start in range(0, len(product_ids), batch_size):
+        with transaction.atomic():
+            rows = list(
+                ProductHistory.objects.filter(product_id__in=product_ids[start:start + batch_size], bucket__lt=cutoff)
+                .order_by('product_id', 'bucket', 'id')
+                .values_list('id', 'product_id', 'bucket', 'price_cents', 'inventory')
+            )
+            obsolete, merged = [], []
+            periods = groupby(rows, key=lambda row: (row[1], row[2] // resolution if resolution != ALL else 0))
+            for (product_id, _), group in periods:
+                group = list(group)
+                if len(group) == 1:
+                    continue
+                obsolete += [row[0] for row in group]
+                merged.append(ProductHistory(
+                    product_id=product_id,
+                    bucket=group[-1][2],
+                    price_cents=_last([row[3] for row in group]),
+                    inventory=_last([row[4] for row in group]),
+                    resolution=resolution,
+                ))
+            for begin in range(0, len(obsolete), batch_size):
+                ProductHistory.objects.filter(pk__in=obsolete[begin:begin + batch_size]).delete()
+            ProductHistory.objects.bulk_create(merged, batch_size=batch_size)
+        removed += len(obsolete)
+        added += len(merged)
+    return removed, added
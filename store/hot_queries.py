@@ -0,0 +1,49 @@
+# queries the storefront runs all the time. the audit_indexes command runs EXPLAIN on every one of them
+# and reports the ones that scan a whole table, so a missing index shows up as soon as a model changes.
+# every installed app can have a hot_queries module with a HOT_QUERIES dict of name -> function returning a queryset
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Cart, CartItem, Collection, Customer, LowStockAlert, Order, OrderItem, OutboxEvent,
+    Product, ProductHistory, ProductPopularity, ProductRecommendation, ProductViewCount,
+)
+from .search import prefix_filter
+
+
+def _recently():
+    return timezone.now() - timedelta(days=1)
+
+
+HOT_QUERIES = {
+    'product by slug': lambda: Product.objects.filter(slug='some-product'),
+    'products updated recently': lambda: Product.objects.filter(last_update__gte=_recently()),
+    'low stock products': lambda: Product.objects.filter(stock_status=Product.STOCK_LOW).order_by('inventory'),
+    'products in collection': lambda: Product.objects.filter(collection_id=1),
+    'product title prefix': lambda: Product.objects.filter(prefix_filter('title_key', 'cof')).order_by('title_key'),
+    'collection title prefix': lambda: Collection.objects.filter(prefix_filter('title_key', 'cof')),
+    'customer by email': lambda: Customer.objects.filter(email='someone@example.com'),
+    'customer first name prefix': lambda: Customer.objects.filter(prefix_filter('first_name_key', 'jo')),
+    'customer last name prefix': lambda: Customer.objects.filter(prefix_filter('last_name_key', 'jo')),
+    'customer email local part': lambda: Customer.objects.filter(email_local_key='someone'),
+    'customer email domain prefix': lambda: Customer.objects.filter(prefix_filter('email_domain_key', 'exa')),
+    'orders placed recently': lambda: Order.objects.filter(placed_at__gte=_recently()),
+    'orders of customer': lambda: Order.objects.filter(customer_id=1),
+    'order by idempotency key': lambda: Order.objects.filter(idempotency_key='some-key'),
+    'items of order': lambda: OrderItem.objects.filter(order_id=1),
+    'archived orders of customer': lambda: ArchivedOrder.objects.filter(customer_id=1).order_by('-placed_at'),
+    'archived items of order': lambda: ArchivedOrderItem.objects.filter(order_id=1),
+    'best sellers of collection': lambda: ProductPopularity.objects.filter(collection_id=1).order_by('-units_sold'),
+    'most liked of collection': lambda: ProductPopularity.objects.filter(collection_id=1).order_by('-likes'),
+    'recommendations for product': lambda: ProductRecommendation.objects.filter(product_id=1).order_by('-score'),
+    'outbox events to relay': lambda: OutboxEvent.objects.filter(relayed_at__isnull=True).order_by('pk'),
+    'low stock alerts to send': lambda: LowStockAlert.objects.filter(notified_at__isnull=True).order_by('pk'),
+    'most viewed products': lambda: ProductViewCount.objects.order_by('-views')[:10],
+    'price of product at a time': lambda: ProductHistory.objects.filter(
+        product_id=1, bucket__lte=29000000, price_cents__isnull=False).order_by('-bucket', '-id')[:1],
+    'inventory of product over a range': lambda: ProductHistory.objects.filter(
+        product_id=1, inventory__isnull=False, bucket__gte=28000000, bucket__lt=29000000).order_by('bucket', 'id'),
+    'items of cart': lambda: CartItem.objects.filter(cart_id=1),
+    'expired carts': lambda: Cart.objects.filter(last_touched__lt=_recently()),
+}
@@ -0,0 +1,240 @@
+# bulk ingestion of orders coming from partner channels (marketplace feeds)
+# saving every order and order item one by one (see sayhello3 in the playground views) means two queries per order
+# and thousands of round trips per batch. here we instead:
+#   1. validate the whole batch in python
+#   2. resolve customers (by their unique email), products and already ingested keys with one query each
+#   3. bulk_create the orders and their items inside a single transaction per shard (see store/sharding.py).
+#      a batch spread over several shards can be half saved when one of them fails, sending it again
+#      creates the rest, the idempotency keys of the saved orders are found on their shards
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from . import collection_summaries, sharding
+from .models import ArchivedOrder, Customer, Order, OrderItem, Product
+
+MAX_BATCH_SIZE = getattr(settings, 'STORE_INGEST_MAX_BATCH_SIZE', 5000)
+BULK_CREATE_BATCH_SIZE = 1000
+
+# OrderItem.quantity is a PositiveSmallIntegerField and unit_price a DecimalField(max_digits=6, decimal_places=2)
+MAX_QUANTITY = 32767
+MAX_UNIT_PRICE = Decimal('9999.99')
+
+PAYMENT_STATUSES = {status for status, _ in Order.PAYMENT_STATUS_CHOICE}
+
+
+class IngestionError(Exception):
+    # raised when the batch as a whole can't be processed (e.g it is too big), as opposed to per row errors
+    pass
+
+
+class IngestionResult:
+    def __init__(self):
+        self.created = []  # (idempotency_key, order id) of the orders created by this batch
+        self.duplicates = []  # (idempotency_key, order id) of orders created by an earlier delivery of the same key
+        self.errors = []  # one entry per rejected row with the row index and the list of problems found
+        self.elapsed = 0.0
+
+    @property
+    def orders_per_second(self):
+        if not self.elapsed:
+            return 0.0
+        return len(self.created) / self.elapsed
+
+    def add_error(self, index, key, messages):
+        self.errors.append({'row': index, 'idempotency_key': key, 'errors': messages})
+
+    def as_dict(self):
+        return {
+            'created': [{'idempotency_key': key, 'order_id': pk} for key, pk in self.created],
+            'duplicates': [{'idempotency_key': key, 'order_id': pk} for key, pk in self.duplicates],
+            'errors': self.errors,
+            'elapsed_seconds': round(self.elapsed, 6),
+            'orders_per_second': round(self.orders_per_second, 2),
+        }
+
+
+def _parse_item(item, position, errors):
+    if not isinstance(item, dict):
+        errors.append(f'items[{position}] must be an object')
+        return None
+    try:
+        product_id = int(item.get('product_id'))
+    except (TypeError, ValueError):
+        errors.append(f'items[{position}].product_id must be an integer')
+        return None
+    try:
+        quantity = int(item.get('quantity'))
+    except (TypeError, ValueError):
+        errors.append(f'items[{position}].quantity must be an integer')
+        return None
+    if not 1 <= quantity <= MAX_QUANTITY:
+        errors.append(f'items[{position}].quantity must be between 1 and {MAX_QUANTITY}')
+        return None
+
+    unit_price = item.get('unit_price')
+    if unit_price is not None:  # when the partner doesnt send a price we use the current product price
+        try:
+            unit_price = Decimal(str(unit_price))
+            if not unit_price.is_finite():  # NaN can't be compared, Infinity can't be quantized
+                raise InvalidOperation
+            unit_price = unit_price.quantize(Decimal('0.01'))
+        except InvalidOperation:
+            errors.append(f'items[{position}].unit_price must be a decimal')
+            return None
+        if not Decimal('0') <= unit_price <= MAX_UNIT_PRICE:
+            errors.append(f'items[{position}].unit_price must be between 0 and {MAX_UNIT_PRICE}')
+            return None
+    return product_id, quantity, unit_price
+
+
+def _parse_row(row, errors):
+    # returns (key, email, payment_status, items) or None. problems found are appended to errors
+    if not isinstance(row, dict):
+        errors.append('row must be an object')
+        return None
+
+    key = row.get('idempotency_key')
+    if not isinstance(key, str) or not key.strip():
+        errors.append('idempotency_key is required')
+    elif len(key.strip()) > Order._meta.get_field('idempotency_key').max_length:
+        errors.append('idempotency_key is too long')
+
+    email = row.get('customer_email')
+    if not isinstance(email, str) or not email.strip():
+        errors.append('customer_email is required')
+
+    payment_status = row.get('payment_status', Order.PAYMENT_STATUS_PENDING)
+    if not isinstance(payment_status, str) or payment_status not in PAYMENT_STATUSES:  # a list or dict can't be hashed
+        errors.append(f'payment_status must be one of {", ".join(sorted(PAYMENT_STATUSES))}')
+
+    items = row.get('items')
+    parsed_items = []
+    if not isinstance(items, list) or not items:
+        errors.append('items must be a non empty list')
+    else:
+        for position, item in enumerate(items):
+            parsed = _parse_item(item, position, errors)
+            if parsed is not None:
+                parsed_items.append(parsed)
+
+    if errors:
+        return None
+    return key.strip(), email.strip(), payment_status, parsed_items
+
+
+def ingest_orders(rows):
+    if not isinstance(rows, list):
+        raise IngestionError('expected a list of orders')
+    if len(rows) > MAX_BATCH_SIZE:
+        raise IngestionError(f'a batch can contain at most {MAX_BATCH_SIZE} orders')
+
+    # if a concurrent delivery of the same keys wins the race, the unique constraint on idempotency_key
+    # makes our transaction fail. running the batch again then reports those rows as duplicates
+    for attempt in range(2):
+        try:
+            return _ingest(rows)
+        except IntegrityError:
+            if attempt:
+                raise
+
+
+def _ingest(rows):
+    result = IngestionResult()
+    start = time.perf_counter()
+
+    # first pass: validate the shape of every row and collect what we need to look up
+    parsed_rows = []
+    seen_keys = set()
+    for index, row in enumerate(rows):
+        errors = []
+        parsed = _parse_row(row, errors)
+        if parsed is not None and parsed[0] in seen_keys:
+            errors.append('idempotency_key is repeated in this batch')
+            parsed = None
+        if parsed is None:
+            key = row.get('idempotency_key') if isinstance(row, dict) else None
+            result.add_error(index, key, errors)
+            continue
+        seen_keys.add(parsed[0])
+        parsed_rows.append((index, parsed))
+
+    # one query each for customers, products and keys that were already ingested
+    emails = {email for _, (_, email, _, _) in parsed_rows}
+    product_ids = {product_id for _, (_, _, _, items) in parsed_rows for product_id, _, _ in items}
+    customers = Customer.objects.only('id', 'email').in_bulk(emails, field_name='email')
+    products = Product.objects.only('id', 'unit_price').in_bulk(product_ids)
+    existing = {}
+    found = Order.objects.filter(idempotency_key__in=seen_keys) \
+        .gather(lambda orders: list(orders.values_list('idempotency_key', 'id')))
+    for keys in found.values():
+        existing.update(keys)
+    if len(existing) < len(seen_keys):
+        # keys of orders that were archived since they were first delivered
+        existing.update(
+            ArchivedOrder.objects.filter(idempotency_key__in=seen_keys - set(existing)).values_list('idempotency_key', 'id')
+        )
+
+    # second pass: resolve references and build the model objects (nothing is saved yet)
+    orders = []
+    items_by_key = {}
+    for index, (key, email, payment_status, items) in parsed_rows:
+        if key in existing:
+            result.duplicates.append((key, existing[key]))
+            continue
+        errors = []
+        customer = customers.get(email)
+        if customer is None:
+            errors.append(f'no customer with email {email}')
+        missing = sorted({product_id for product_id, _, _ in items if product_id not in products})
+        if missing:
+            errors.append(f'unknown product ids {missing}')
+        if errors:
+            result.add_error(index, key, errors)
+            continue
+
+        orders.append(Order(customer_id=customer.id, payment_status=payment_status, idempotency_key=key))
+        items_by_key[key] = [
+            OrderItem(
+                product_id=product_id,
+                quantity=quantity,
+                unit_price=products[product_id].unit_price if unit_price is None else unit_price,
+            )
+            for product_id, quantity, unit_price in items
+        ]
+
+    if orders:
+        by_shard = {}
+        for order in orders:
+            by_shard.setdefault(sharding.shard_for(order.customer_id), []).append(order)
+        with transaction.atomic():
+            ids = {}
+            order_items = []
+            for shard, shard_orders in by_shard.items():
+                with transaction.atomic(using=shard):
+                    Order.objects.using(shard).bulk_create(shard_orders, batch_size=BULK_CREATE_BATCH_SIZE)
+                    # bulk_create doesnt set the primary keys on every backend (e.g mysql),
+                    # so we read them back through the idempotency keys
+                    keys = [order.idempotency_key for order in shard_orders]
+                    ids.update(
+                        Order.objects.using(shard).filter(idempotency_key__in=keys).values_list('idempotency_key', 'id')
+                    )
+                    shard_items = []
+                    for order in shard_orders:
+                        for item in items_by_key[order.idempotency_key]:
+                            item.order_id = ids[order.idempotency_key]
+                            shard_items.append(item)
+                    OrderItem.objects.using(shard).bulk_create(shard_items, batch_size=BULK_CREATE_BATCH_SIZE)
+                order_items += shard_items
+            sold = Counter()
+            for item in order_items:
+                sold[item.product_id] += item.quantity
+            collection_summaries.record_sales(sold)  # best sellers of the collection pages
+        result.created = [(order.idempotency_key, ids[order.idempotency_key]) for order in orders]
+
+    result.errors.sort(key=lambda error: error['row'])
+    result.elapsed = time.perf_counter() - start
+    return result
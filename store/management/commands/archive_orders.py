@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.archive import ARCHIVED_STATUSES, BATCH_SIZE, archivable_orders, archive_orders, restore_orders
+from store.models import ArchivedOrder
+
+
+class Command(BaseCommand):
+    help = 'Moves settled orders older than the cutoff, with their items, to the archive tables in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=getattr(settings, 'STORE_ARCHIVE_AFTER_DAYS', 730),
+                            help='archive orders placed more than this many days ago')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+        parser.add_argument('--max-batches', type=int, default=None, help='stop after this many batches, run again to resume')
+        parser.add_argument('--dry-run', action='store_true', help='only count the orders that would be archived')
+        parser.add_argument('--restore', action='store_true',
+                            help='move archived orders that are no longer archived (failed ones) back to their shard')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            # earlier versions also archived failed orders, a late payment can still complete them
+            result = restore_orders(
+                ArchivedOrder.objects.exclude(payment_status__in=ARCHIVED_STATUSES), batch_size=options['batch_size']
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f'restored {result.orders} orders and {result.items} items in {result.batches} batches'
+            ))
+            return
+
+        before = timezone.now() - timedelta(days=options['days'])
+        if options['dry_run']:
+            count = sum(archivable_orders(before).gather(lambda orders: orders.count()).values())
+            self.stdout.write(f'{count} orders placed before {before:%Y-%m-%d} to archive')
+            return
+
+        result = archive_orders(
+            before,
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            max_batches=options['max_batches'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'archived {result.orders} orders and {result.items} items in {result.batches} batches, '
+            f'{result.elapsed:.2f}s ({result.orders_per_second:,.0f} orders/s)'
+        ))
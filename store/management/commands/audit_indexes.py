@@ -0,0 +1,61 @@
+import re
+from importlib import import_module
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.module_loading import module_has_submodule
+
+
+def collect_hot_queries():
+    # {(app label, query name): function returning a queryset} from every installed app's hot_queries module
+    queries = {}
+    for app_config in apps.get_app_configs():
+        if module_has_submodule(app_config.module, 'hot_queries'):
+            module = import_module(f'{app_config.name}.hot_queries')
+            for name, build in getattr(module, 'HOT_QUERIES', {}).items():
+                queries[(app_config.label, name)] = build
+    return queries
+
+
+def full_scans(plan, vendor):
+    # returns the tables the plan reads from start to end, or None when we can't read plans of this database
+    if vendor == 'sqlite':
+        # "SCAN store_product" is a full scan, "SEARCH ..." or "SCAN ... USING (COVERING) INDEX" aren't.
+        # \b keeps the lookahead at the end of the table name, without it "SCAN store_product USING INDEX x"
+        # backtracks to a scan of "store_produc"
+        return re.findall(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)', plan)
+    if vendor == 'mysql':
+        return re.findall(r'"table_name": "(\w+)",\s*"access_type": "ALL"', plan)
+    if vendor == 'postgresql':
+        return re.findall(r'Seq Scan on (\w+)', plan)
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the hot queries registered in each app (hot_queries.py) and reports full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+        parser.add_argument('--verbose-plans', action='store_true', help='print every query plan')
+        parser.add_argument('--fail-on-scan', action='store_true', help='exit with an error if a full scan is found')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        explain_options = {'format': 'JSON'} if connection.vendor == 'mysql' else {}
+        problems = 0
+        for (app_label, name), build in sorted(collect_hot_queries().items()):
+            plan = build().using(options['database']).explain(**explain_options)
+            scans = full_scans(plan, connection.vendor)
+            if scans is None:
+                self.stdout.write(f'{app_label}: {name}: cannot read {connection.vendor} plans')
+            elif scans:
+                problems += 1
+                self.stdout.write(self.style.ERROR(f'{app_label}: {name}: FULL SCAN of {", ".join(sorted(set(scans)))}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{app_label}: {name}: ok'))
+            if options['verbose_plans']:
+                self.stdout.write(plan)
+
+        if problems and options['fail_on_scan']:
+            raise CommandError(f'{problems} hot queries scan a whole table')
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.customers import backfill_search_keys
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the normalized name and email search keys of every customer, writing only changed rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        checked, updated = backfill_search_keys(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'checked {checked} customers, updated {updated} in {time.perf_counter() - start:.2f}s'
+        ))
@@ -0,0 +1,93 @@
+import random
+import statistics
+import time
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory
+
+from store.benchmarking import SEED_BATCH_SIZE, BenchmarkCommand, timer
+from store.models import Collection, Customer, Product
+from store.search import normalize
+
+WORDS = (
+    'coffee tea bean mug cup kettle grinder filter roast dark light medium espresso latte mocha cocoa '
+    'chai green black herbal mint lemon honey ginger vanilla caramel hazelnut almond oat milk sugar '
+    'spoon plate bowl glass bottle jar lid box bag pack set kit gift classic premium organic fresh'
+).split()
+FIRST_NAMES = 'james mary john patricia robert jennifer michael linda david elizabeth william barbara'.split()
+
+
+class Command(BenchmarkCommand):
+    help = 'Compares admin autocomplete keystroke latency of icontains + count against the prefix search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='products and customers to seed')
+        parser.add_argument('--terms', type=int, default=50, help='random words typed letter by letter')
+
+    def seed(self, rows):
+        collection = Collection.objects.create(title='autocomplete benchmark')
+        for start in range(0, rows, SEED_BATCH_SIZE):
+            titles = [' '.join(random.choices(WORDS, k=3)).title() for _ in range(start, min(start + SEED_BATCH_SIZE, rows))]
+            Product.objects.bulk_create(
+                Product(title=title, title_key=normalize(title), slug=f'autocomplete-{start + i}',
+                        unit_price=10, inventory=10, collection=collection)
+                for i, title in enumerate(titles)
+            )
+            names = [(random.choice(FIRST_NAMES), f'{random.choice(WORDS)}son') for _ in titles]
+            Customer.objects.bulk_create(
+                Customer(first_name=first.title(), first_name_key=first, last_name=last.title(), last_name_key=last,
+                         email=f'autocomplete-{start + i}@example.com', phone='000')
+                for i, (first, last) in enumerate(names)
+            )
+
+    def measure(self, label, keystrokes, search):
+        latencies = []
+        for term in keystrokes:
+            start = time.perf_counter()
+            search(term)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        self.stdout.write(
+            f'  {label}: mean {statistics.mean(latencies) * 1000:.2f}ms, '
+            f'p50 {latencies[len(latencies) // 2] * 1000:.2f}ms, '
+            f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.2f}ms'
+        )
+
+    def run_benchmark(self, *args, **options):
+        with timer() as elapsed:
+            self.seed(options['rows'])
+        self.report('seeding', elapsed(), options['rows'] * 2, 'rows')
+
+        factory = RequestFactory()
+        user = User.objects.create_superuser('autocomplete-benchmark', 'autocomplete@example.com', 'unused')
+        targets = [
+            ('products', Product, 'orderitem', 'product', lambda term: Product.objects.filter(title__icontains=term),
+             random.sample(WORDS, min(options['terms'], len(WORDS)))),
+            ('customers', Customer, 'order', 'customer',
+             lambda term: Customer.objects.filter(first_name__istartswith=term) | Customer.objects.filter(
+                 last_name__istartswith=term),
+             random.choices(FIRST_NAMES, k=options['terms'])),
+        ]
+        for name, model, source_model, field, old_search, words in targets:
+            keystrokes = [word[:n] for word in words for n in range(1, len(word) + 1)]
+            self.stdout.write(f'{name} ({len(keystrokes)} keystrokes):')
+
+            def before(term):
+                queryset = old_search(term).order_by(*model._meta.ordering)
+                queryset.count()  # the page_obj.has_next() of the default autocomplete
+                list(queryset[:20])
+
+            self.measure('icontains/istartswith + count', keystrokes, before)
+
+            def autocomplete(term):
+                request = factory.get('/admin/autocomplete/', {
+                    'term': term, 'app_label': 'store', 'model_name': source_model, 'field_name': field,
+                })
+                request.user = user
+                return admin.site.autocomplete_view(request)
+
+            cache.clear()
+            self.measure('prefix search (cache cold)', keystrokes, autocomplete)
+            self.measure('prefix search (cached)', keystrokes, autocomplete)
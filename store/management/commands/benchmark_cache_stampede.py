@@ -0,0 +1,90 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection
+
+from store import caching
+from store.benchmarking import BenchmarkCommand
+from store.models import Product
+
+
+class Command(BenchmarkCommand):
+    help = 'Counts the database queries when a hot cached entry expires under concurrent reads, with and without stampede protection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=50)
+        parser.add_argument('--expiries', type=int, default=10)
+        parser.add_argument('--query-seconds', type=float, default=0.05, help='added to the query, like a slow page')
+
+    def run_benchmark(self, *args, **options):
+        key = 'benchmark:stampede'
+        computes = []
+        computes_lock = threading.Lock()
+
+        def compute():
+            with computes_lock:
+                computes.append(1)
+            count = Product.objects.count()
+            time.sleep(options['query_seconds'])
+            return count
+
+        def naive():
+            value = cache.get(key)
+            if value is None:
+                value = compute()
+                cache.set(key, value, 300)
+            return value
+
+        def protected():
+            return caching.get_or_compute(key, compute, timeout=300, name='benchmark')
+
+        def expire_hard():
+            cache.delete(key)
+
+        def expire_soft():
+            # still in the cache, past its timeout: served stale while one reader refreshes
+            cache.set(key, (0, options['query_seconds'], time.time() - 1), 300)
+
+        scenarios = [
+            ('no protection', naive, expire_hard),
+            ('single flight, entry gone', protected, expire_hard),
+            ('stale while revalidate', protected, expire_soft),
+        ]
+        for label, read, expire in scenarios:
+            computes.clear()
+            slowest, medians = [], []
+            start = time.perf_counter()
+            for _ in range(options['expiries']):
+                expire()
+                durations = sorted(self.concurrent_reads(read, options['threads']))
+                slowest.append(durations[-1])
+                medians.append(durations[len(durations) // 2])
+            elapsed = time.perf_counter() - start
+            self.report(label, elapsed, options['expiries'], 'expiries')
+            self.stdout.write(
+                f'  {len(computes) / options["expiries"]:.1f} database queries per expiry, '
+                f'median read {sum(medians) / len(medians) * 1000:.1f}ms, slowest {max(slowest) * 1000:.0f}ms'
+            )
+        cache.delete(key)
+
+    def concurrent_reads(self, read, threads):
+        # every thread reads at the same moment, returns how long each read took in seconds
+        barrier = threading.Barrier(threads)
+        durations = []
+
+        def reader():
+            try:
+                barrier.wait()
+                start = time.perf_counter()
+                read()
+                durations.append(time.perf_counter() - start)
+            finally:
+                connection.close()  # every thread has its own connection
+
+        workers = [threading.Thread(target=reader) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return durations
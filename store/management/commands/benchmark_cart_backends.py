@@ -0,0 +1,43 @@
+import statistics
+import time
+
+from store.benchmarking import BenchmarkCommand, seed_products, timer
+from store.cart_backends import CacheCartBackend, DatabaseCartBackend
+
+
+class Command(BenchmarkCommand):
+    help = 'Compares add-to-cart latency of the database and cache cart backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=200)
+        parser.add_argument('--adds-per-cart', type=int, default=20)
+        parser.add_argument('--cache', default=None, help='cache alias for the cache backend (defaults to STORE_CART_CACHE), '
+                                 'it must not evict keys')
+
+    def run_benchmark(self, *args, **options):
+        product_ids = seed_products(100)
+        backends = [
+            ('database', DatabaseCartBackend()),
+            ('cache', CacheCartBackend(alias=options['cache'])),
+        ]
+        for name, backend in backends:
+            latencies = []
+            cart_ids = [backend.create_cart() for _ in range(options['carts'])]
+            for cart_id in cart_ids:
+                for n in range(options['adds_per_cart']):
+                    start = time.perf_counter()
+                    backend.add_item(cart_id, product_ids[n % len(product_ids)])
+                    latencies.append(time.perf_counter() - start)
+
+            latencies.sort()
+            self.stdout.write(
+                f'{name}: mean {statistics.mean(latencies) * 1000:.3f}ms, '
+                f'p50 {latencies[len(latencies) // 2] * 1000:.3f}ms, '
+                f'p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f}ms over {len(latencies)} adds'
+            )
+            if hasattr(backend, 'flush'):
+                with timer() as elapsed:
+                    flushed = backend.flush()
+                self.report(f'{name} flush', elapsed(), flushed, 'carts')
+            for cart_id in cart_ids:
+                backend.delete_cart(cart_id)
@@ -0,0 +1,65 @@
+from decimal import Decimal
+
+from django.db.models import Max
+
+from store.benchmarking import SEED_BATCH_SIZE, BenchmarkCommand, seed_products, timer
+from store.carts import reprice_products, update_totals
+from store.models import Cart, CartItem, Product
+
+
+class Command(BenchmarkCommand):
+    help = 'Compares repricing the open carts of a product cart by cart against the batched set based repricing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=100000, help='open carts holding the product')
+        parser.add_argument('--sample', type=int, default=2000, help='carts repriced one by one')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def seed(self, carts, product_id, other_id, price):
+        before = Cart.objects.aggregate(last=Max('pk'))['last'] or 0
+        for start in range(0, carts, SEED_BATCH_SIZE):
+            Cart.objects.bulk_create([Cart() for _ in range(min(SEED_BATCH_SIZE, carts - start))])
+        cart_ids = list(Cart.objects.filter(pk__gt=before).order_by('pk').values_list('pk', flat=True))
+        for start in range(0, len(cart_ids), SEED_BATCH_SIZE):
+            items = []
+            for cart_id in cart_ids[start:start + SEED_BATCH_SIZE]:
+                items.append(CartItem(cart_id=cart_id, product_id=product_id, quantity=1 + cart_id % 3, unit_price=price))
+                if cart_id % 2:  # half the carts hold something else too
+                    items.append(CartItem(cart_id=cart_id, product_id=other_id, quantity=1, unit_price=price))
+            CartItem.objects.bulk_create(items)
+            update_totals(cart_ids[start:start + SEED_BATCH_SIZE])
+        return cart_ids
+
+    def one_by_one(self, cart_ids, product_id, price):
+        # what repricing cart by cart does: load the cart's items, update the changed one, save the total
+        for cart_id in cart_ids:
+            items = list(CartItem.objects.filter(cart_id=cart_id))
+            for item in items:
+                if item.product_id == product_id:
+                    item.unit_price = price
+                    item.save(update_fields=['unit_price'])
+            Cart.objects.filter(pk=cart_id).update(total=sum(item.quantity * item.unit_price for item in items))
+
+    def run_benchmark(self, *args, **options):
+        product_id, other_id = seed_products(2)
+        price = Product.objects.get(pk=product_id).unit_price
+        with timer() as elapsed:
+            cart_ids = self.seed(options['carts'], product_id, other_id, price)
+        self.report('seeding', elapsed(), len(cart_ids), 'carts')
+
+        new_price = price + Decimal('1.00')
+        Product.objects.filter(pk=product_id).update(unit_price=new_price)  # update() skips the repricing signal
+        sample = cart_ids[:options['sample']]
+        with timer() as elapsed:
+            self.one_by_one(sample, product_id, new_price)
+        self.report('cart by cart', elapsed(), len(sample), 'carts')
+        if sample:
+            self.stdout.write(f'  estimated for {len(cart_ids)} carts: {elapsed() / len(sample) * len(cart_ids):,.1f}s')
+
+        result = reprice_products([product_id], batch_size=options['batch_size'])
+        self.report('set based', result.elapsed, result.carts, 'carts')
+        self.stdout.write(f'  {result.items} items in {result.batches} batches of {options["batch_size"]}')
+
+        expected = {cart_id: (1 + cart_id % 3) * new_price + (price if cart_id % 2 else 0) for cart_id in cart_ids}
+        totals = dict(Cart.objects.filter(pk__in=cart_ids).values_list('pk', 'total'))
+        self.stdout.write('  totals match' if totals == expected else '  TOTALS DIFFER')
@@ -0,0 +1,62 @@
+import os
+import random
+import shutil
+import tempfile
+import tracemalloc
+
+from django.utils import timezone
+
+from store.benchmarking import BenchmarkCommand, seed_products, timer
+from store.feeds import SHARD_SIZE, generate
+from store.models import Collection, CollectionSummary, Product
+
+
+class Command(BenchmarkCommand):
+    help = 'Times writing the sitemaps and product feed of the whole catalog, then regenerating after a few changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=5000000)
+        parser.add_argument('--changed', type=int, default=100, help='products updated before the incremental run')
+        parser.add_argument('--deleted', type=int, default=10, help='products deleted before the incremental run')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='run the full generation again under tracemalloc and report its peak')
+
+    def files_size(self, directory):
+        return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+    def run_benchmark(self, *args, **options):
+        with timer() as elapsed:
+            collection = Collection.objects.create(title='bench feeds collection')
+            products = seed_products(options['products'], collection)
+            # bulk_create skipped the signals counting the products, deleting some below would go negative
+            CollectionSummary.objects.filter(pk=collection.pk).update(products_count=len(products))
+        self.report('seeding', elapsed(), len(products), 'products')
+        directory = tempfile.mkdtemp(prefix='feeds-')
+        try:
+            with timer() as elapsed:
+                result = generate(full=True, directory=directory)
+            self.report('full generation', elapsed(), result.products, 'products')
+            self.stdout.write(f'  {result.shards} shards of up to {SHARD_SIZE} products, '
+                              f'{self.files_size(directory) / 1e6:.1f}MB gzipped')
+
+            if options['trace_memory']:
+                tracemalloc.start()
+                generate(full=True, directory=directory)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.stdout.write(f'  peak python memory of a full generation: {peak / 1e6:.1f}MB')
+
+            with timer() as elapsed:
+                result = generate(directory=directory)
+            self.report('nothing changed', elapsed())
+            self.stdout.write(f'  {result.shards} shards rewritten')
+
+            Product.objects.filter(pk__in=random.sample(products, options['changed'])).update(last_update=timezone.now())
+            Product.objects.filter(pk__in=random.sample(products, options['deleted'])).delete()
+            with timer() as elapsed:
+                result = generate(directory=directory)
+            self.report(f'after {options["changed"]} updates and {options["deleted"]} deletes', elapsed(),
+                        result.products, 'products')
+            self.stdout.write(f'  {result.shards} shards rewritten')
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,61 @@
+from store.benchmarking import BenchmarkCommand, seed_customers, seed_products, timer
+from store.ingestion import MAX_BATCH_SIZE, ingest_orders
+from store.models import Customer, Order, OrderItem
+
+
+class Command(BenchmarkCommand):
+    help = 'Measures bulk order ingestion throughput (orders/sec) against saving orders one by one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=20000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--naive-orders', type=int, default=1000,
+                            help='how many orders to save one by one for the baseline (0 to skip)')
+
+    def run_benchmark(self, *args, **options):
+        batch_size = min(options['batch_size'], MAX_BATCH_SIZE)
+        per_order = options['items_per_order']
+        customer_ids = seed_customers(1000)
+        product_ids = seed_products(500)
+        emails = list(Customer.objects.filter(pk__in=customer_ids).values_list('email', flat=True))
+
+        def row(i, prefix):
+            return {
+                'idempotency_key': f'{prefix}-{i}',
+                'customer_email': emails[i % len(emails)],
+                'items': [
+                    {'product_id': product_ids[(i + n) % len(product_ids)], 'quantity': 1 + n}
+                    for n in range(per_order)
+                ],
+            }
+
+        total = options['orders']
+        created = 0
+        with timer() as elapsed:
+            for start in range(0, total, batch_size):
+                rows = [row(i, 'bench') for i in range(start, min(start + batch_size, total))]
+                created += len(ingest_orders(rows).created)
+        self.report('bulk ingestion', elapsed(), created, 'orders')
+
+        # delivering the same batches again should be a no-op
+        with timer() as elapsed:
+            duplicates = 0
+            for start in range(0, total, batch_size):
+                rows = [row(i, 'bench') for i in range(start, min(start + batch_size, total))]
+                duplicates += len(ingest_orders(rows).duplicates)
+        self.report('retried batches (all duplicates)', elapsed(), duplicates, 'orders')
+
+        naive = options['naive_orders']
+        if naive:
+            with timer() as elapsed:
+                for i in range(naive):
+                    order = Order.objects.create(customer_id=customer_ids[i % len(customer_ids)])
+                    for n in range(per_order):
+                        OrderItem.objects.create(
+                            order=order,
+                            product_id=product_ids[(i + n) % len(product_ids)],
+                            quantity=1 + n,
+                            unit_price=10,
+                        )
+            self.report('one save per row', elapsed(), naive, 'orders')
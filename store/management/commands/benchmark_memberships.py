@@ -0,0 +1,69 @@
+import random
+from datetime import timedelta
+
+from django.db.models import DecimalField, F, Max, Sum
+from django.utils import timezone
+
+from store.benchmarking import SEED_BATCH_SIZE, BenchmarkCommand, seed_customers, seed_orders, seed_products, timer
+from store.membership import get_thresholds, recalculate_memberships, score_tiers
+from store.models import Customer, Order, OrderItem
+
+
+class Command(BenchmarkCommand):
+    help = 'Compares recalculating membership tiers customer by customer against the chunked grouped pass'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=5000000)
+        parser.add_argument('--orders', type=int, default=None, help='orders to seed, defaults to one per customer')
+        parser.add_argument('--sample', type=int, default=2000, help='customers recalculated one by one')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def seed(self, customers, orders):
+        customer_ids = seed_customers(customers)
+        # a few customers place many orders, most place one or none
+        buyers = random.choices(customer_ids, weights=[1 / (1 + i % 50) for i in range(customers)], k=orders)
+        order_ids = seed_orders(orders, buyers, seed_products(100))
+        # spread the orders over the last two years and fail some of them
+        now = timezone.now()
+        for start in range(0, len(order_ids), SEED_BATCH_SIZE):
+            batch = order_ids[start:start + SEED_BATCH_SIZE]
+            Order.objects.filter(pk__gte=batch[0], pk__lte=batch[-1]).update(
+                placed_at=now - timedelta(days=random.randint(0, 730)),
+                payment_status=random.choice([Order.PAYMENT_STATUS_COMPLETE] * 9 + [Order.PAYMENT_STATUS_FAILED]),
+            )
+        return customer_ids
+
+    def one_by_one(self, customer_ids, now, thresholds):
+        # what a naive job does: aggregate and save every customer separately
+        for customer_id in customer_ids:
+            orders = Order.objects.filter(customer_id=customer_id, payment_status=Order.PAYMENT_STATUS_COMPLETE)
+            last_order = orders.aggregate(last=Max('placed_at'))['last']
+            spent = OrderItem.objects.filter(order__in=orders).aggregate(
+                spent=Sum(F('quantity') * F('unit_price'), output_field=DecimalField()))['spent']
+            days = (now - last_order).days if last_order else None
+            tier, = score_tiers([(days, orders.count(), float(spent or 0))], thresholds)
+            customer = Customer.objects.get(pk=customer_id)
+            customer.membership = tier
+            customer.save()
+
+    def run_benchmark(self, *args, **options):
+        customers = options['customers']
+        orders = options['orders'] if options['orders'] is not None else customers
+        with timer() as elapsed:
+            customer_ids = self.seed(customers, orders)
+        self.report('seeding', elapsed(), customers + orders, 'customers and orders')
+
+        now = timezone.now()
+        sample = customer_ids[:options['sample']]
+        with timer() as elapsed:
+            self.one_by_one(sample, now, get_thresholds())
+        self.report('one by one', elapsed(), len(sample), 'customers')
+        if sample:
+            self.stdout.write(f'  estimated for {customers} customers: {elapsed() / len(sample) * customers:,.0f}s')
+
+        Customer.objects.filter(pk__in=sample).update(membership=Customer.MEMBERSHIP_BRONZE)
+        for label in ('grouped pass', 'grouped pass, nothing changed'):
+            result = recalculate_memberships(chunk_size=options['chunk_size'], batch_size=options['batch_size'], now=now)
+            self.report(label, result.elapsed, result.customers, 'customers')
+            self.stdout.write(f'  {result.changed} changed, tiers {dict(result.tiers)}')
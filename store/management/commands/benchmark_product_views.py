@@ -0,0 +1,59 @@
+import random
+
+from django.db.models import F
+from django.utils import timezone
+
+from store.benchmarking import BenchmarkCommand, seed_products, timer
+from store.models import ProductViewCount
+from store.product_views import ViewBuffer
+
+
+class Command(BenchmarkCommand):
+    help = 'Compares counting product views with an update per view against the buffered, batched writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--views', type=int, default=100000)
+        parser.add_argument('--max-pending', type=int, default=1000)
+
+    def synchronous(self, product_ids):
+        # what counting in the view does: an update per view, an insert the first time a product is viewed
+        for product_id in product_ids:
+            updated = ProductViewCount.objects.filter(pk=product_id).update(views=F('views') + 1)
+            if not updated:
+                ProductViewCount.objects.create(product_id=product_id, views=1, updated_at=timezone.now())
+
+    def run_benchmark(self, *args, **options):
+        products = seed_products(options['products'])
+        # a few products get most of the views
+        views = random.choices(products, weights=[1 / (1 + i) for i in range(len(products))], k=options['views'])
+
+        with timer() as elapsed:
+            self.synchronous(views)
+        self.report('update per view', elapsed(), len(views), 'views')
+        self.stdout.write(f'  {elapsed() / len(views) * 1e6:.1f}us per view')
+        synchronous = dict(ProductViewCount.objects.values_list('pk', 'views'))
+        ProductViewCount.objects.all().delete()
+
+        # only flushed for max_pending, so the interval doesn't depend on how fast this machine is
+        buffer = ViewBuffer(interval=float('inf'), max_pending=options['max_pending'])
+        with timer() as elapsed:
+            for product_id in views:
+                buffer.add(product_id)
+            buffer.flush()
+        self.report('buffered', elapsed(), len(views), 'views')
+        self.stdout.write(f'  {elapsed() / len(views) * 1e6:.1f}us per view, flushes included')
+
+        # the part a request pays when the buffer isn't due
+        buffer = ViewBuffer(interval=float('inf'), max_pending=float('inf'))
+        with timer() as elapsed:
+            for product_id in views:
+                buffer.add(product_id)
+        self.stdout.write(f'  {elapsed() / len(views) * 1e6:.2f}us per view without flushing')
+        with timer() as elapsed:
+            buffer.flush()
+        self.report('one flush of every product', elapsed(), len(set(views)), 'products')
+
+        buffered = dict(ProductViewCount.objects.values_list('pk', 'views'))
+        expected = {product_id: views * 2 for product_id, views in synchronous.items()}
+        self.stdout.write('  counts match' if buffered == expected else '  COUNTS DIFFER')
@@ -0,0 +1,37 @@
+import csv
+import os
+import random
+import tempfile
+
+from store.benchmarking import BenchmarkCommand, seed_customers, seed_orders, timer
+from store.payments import reconcile
+
+
+class Command(BenchmarkCommand):
+    help = 'Reconciles a generated payment provider file against freshly seeded orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=1000000)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def run_benchmark(self, *args, **options):
+        count = options['records']
+        with timer() as elapsed:
+            order_ids = seed_orders(count, seed_customers(1000), [], items_per_order=0)
+        self.report('seeding orders', elapsed(), len(order_ids), 'orders')
+
+        statuses = ['complete'] * 6 + ['failed'] * 3 + ['pending']
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w', newline='') as provider_file:
+                writer = csv.writer(provider_file)
+                writer.writerow(['order_id', 'status'])
+                for order_id in order_ids:
+                    writer.writerow([order_id, random.choice(statuses)])
+
+            with open(path, newline='') as provider_file, timer() as elapsed:
+                result = reconcile(csv.DictReader(provider_file), chunk_size=options['chunk_size'])
+            self.report('reconciliation', elapsed(), result.records, 'records')
+            self.stdout.write(str(result.as_dict()))
+        finally:
+            os.remove(path)
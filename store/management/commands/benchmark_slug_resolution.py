@@ -0,0 +1,58 @@
+import random
+import statistics
+import time
+
+from store.benchmarking import BenchmarkCommand, seed_products, timer
+from store.models import Product
+from store.slugs import SlugCache, resolve_slug, slug_cache
+
+
+class Command(BenchmarkCommand):
+    help = 'Measures slug -> product id resolution latency with and without the in-process slug cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000000)
+        parser.add_argument('--lookups', type=int, default=100000)
+        parser.add_argument('--hot-slugs', type=int, default=10000,
+                            help='lookups are spread over this many distinct products')
+
+    def measure(self, label, slugs, resolve):
+        latencies = []
+        for slug in slugs:
+            start = time.perf_counter()
+            resolve(slug)
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        self.stdout.write(
+            f'{label}: mean {statistics.mean(latencies) * 1e6:.1f}us, '
+            f'p50 {latencies[len(latencies) // 2] * 1e6:.1f}us, '
+            f'p99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f}us'
+        )
+
+    def run_benchmark(self, *args, **options):
+        with timer() as elapsed:
+            product_ids = seed_products(options['products'])
+        self.report('seeding products', elapsed(), len(product_ids), 'products')
+
+        sample = random.sample(product_ids, min(options['hot_slugs'], len(product_ids)))
+        hot = list(Product.objects.filter(pk__in=sample).values_list('slug', flat=True))
+        slugs = [random.choice(hot) for _ in range(options['lookups'])]
+
+        def database(slug):
+            return Product.objects.filter(slug=slug).values_list('pk', flat=True).first()
+
+        self.measure('database lookup', slugs, database)
+        slug_cache.clear()
+        self.measure('slug cache (cold start)', slugs, resolve_slug)
+        self.measure('slug cache (warm)', slugs, resolve_slug)
+        self.stdout.write(f'cache hits {slug_cache.hits}, misses {slug_cache.misses}, entries {len(slug_cache)}')
+
+        # a cache smaller than the working set shows what LRU eviction costs
+        small = SlugCache(maxsize=len(hot) // 2)
+
+        def small_cache(slug):
+            pk = small.get(slug)
+            if pk is None:
+                small.set(slug, database(slug))
+
+        self.measure(f'slug cache of {small.maxsize} entries', slugs, small_cache)
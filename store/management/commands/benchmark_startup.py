@@ -0,0 +1,107 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# runs in a fresh interpreter for every measurement, so nothing is imported or cached yet.
+# prints the seconds spent importing the module (django.setup(), apps, models, urls aren't loaded until the
+# first request), and answering the first and the second request
+CHILD = '''
+import asyncio, importlib, json, sys, time
+from io import BytesIO
+from wsgiref.util import setup_testing_defaults
+
+interface, path, host = sys.argv[1:4]
+start = time.perf_counter()
+application = importlib.import_module(f'storefront.{interface}').application
+imported = time.perf_counter() - start
+
+
+def wsgi_request():
+    environ = {'PATH_INFO': path, 'HTTP_HOST': host, 'wsgi.input': BytesIO()}
+    setup_testing_defaults(environ)
+    status = []
+    body = application(environ, lambda code, headers, exc_info=None: status.append(code))
+    try:
+        b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return int(status[0].split()[0])
+
+
+async def asgi_request():
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', host.encode())], 'client': ('127.0.0.1', 50000), 'server': (host, 80),
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await application(scope, receive, send)
+    return messages[0]['status']
+
+
+def request():
+    begin = time.perf_counter()
+    status = wsgi_request() if interface == 'wsgi' else asyncio.run(asgi_request())
+    return time.perf_counter() - begin, status
+
+
+first, status = request()
+second, _ = request()
+print(json.dumps({'import': imported, 'first': first, 'second': second, 'status': status}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measures the import time and first request latency of storefront.wsgi and storefront.asgi ' \
+           'under the development and production settings profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/playground/hello/', help='the url requested')
+        parser.add_argument('--host', default='localhost')
+        parser.add_argument('--runs', type=int, default=5, help='fresh processes per measurement, the median is reported')
+        parser.add_argument('--profile', action='append', choices=['development', 'production'],
+                            help='STOREFRONT_ENV to measure, repeat for several (default both)')
+        parser.add_argument('--interface', action='append', choices=['wsgi', 'asgi'],
+                            help='repeat for several (default both)')
+
+    def measure(self, profile, interface, options):
+        env = dict(os.environ, STOREFRONT_ENV=profile)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(settings.BASE_DIR), env.get('PYTHONPATH')]))
+        if profile == 'production':
+            # what a deployment sets, only filled in so the profile can start here
+            env.setdefault('DJANGO_SECRET_KEY', 'benchmark-startup-' + os.urandom(16).hex())
+            env.setdefault('DJANGO_ALLOWED_HOSTS', options['host'])
+            env.setdefault('STOREFRONT_CACHE_URL', 'redis://localhost:6379/0')
+            env.setdefault('STOREFRONT_METRICS_TOKEN', os.urandom(16).hex())
+            env.setdefault('DATABASE_PASSWORD', '')
+        completed = subprocess.run(
+            [sys.executable, '-c', CHILD, interface, options['path'], options['host']],
+            env=env, cwd=settings.BASE_DIR, capture_output=True, text=True,
+        )
+        if completed.returncode:
+            raise RuntimeError(f'{profile} {interface} failed:\n{completed.stderr}')
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        for profile in options['profile'] or ['development', 'production']:
+            for interface in options['interface'] or ['wsgi', 'asgi']:
+                runs = [self.measure(profile, interface, options) for _ in range(options['runs'])]
+                median = {key: statistics.median(run[key] for run in runs) * 1000 for key in ('import', 'first', 'second')}
+                self.stdout.write(
+                    f'{profile} {interface}: import {median["import"]:.1f}ms, '
+                    f'first request {median["first"]:.1f}ms, second {median["second"]:.1f}ms '
+                    f'(status {runs[-1]["status"]}, median of {len(runs)})'
+                )
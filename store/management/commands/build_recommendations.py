@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from store.recommendations import TOP_K, build_recommendations, np
+
+
+class Command(BaseCommand):
+    help = 'Builds "frequently bought together" recommendations from orders placed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='recount every order instead of only new ones')
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        result = build_recommendations(full=options['full'], top_k=options['top_k'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{"full" if result.full else "incremental"} build ({"numpy" if np is not None else "pure python"}): '
+            f'{result.orders} orders, {result.products} products, {result.rows} recommendations '
+            f'in {result.elapsed:.2f}s'
+        ))
@@ -0,0 +1,35 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from store.history import ALL, BATCH_SIZE, DAY, HOUR, compact
+
+
+class Command(BaseCommand):
+    help = 'Merges old price and inventory history into hourly, then daily rows, and collapses the oldest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hourly-after-days', type=int,
+                            default=getattr(settings, 'STORE_HISTORY_HOURLY_AFTER_DAYS', 30))
+        parser.add_argument('--daily-after-days', type=int,
+                            default=getattr(settings, 'STORE_HISTORY_DAILY_AFTER_DAYS', 365))
+        parser.add_argument('--keep-days', type=int, default=getattr(settings, 'STORE_HISTORY_KEEP_DAYS', 3 * 365))
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='products per transaction')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        steps = [
+            ('hourly', options['hourly_after_days'], HOUR),
+            ('daily', options['daily_after_days'], DAY),
+            ('collapsed', options['keep_days'], ALL),
+        ]
+        for label, days, resolution in steps:
+            start = time.perf_counter()
+            removed, added = compact(now - timedelta(days=days), resolution, options['batch_size'])
+            self.stdout.write(
+                f'{label} (older than {days} days): {removed} rows merged into {added} '
+                f'in {time.perf_counter() - start:.2f}s'
+            )
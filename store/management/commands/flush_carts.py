@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.cart_backends import FlushInProgress, get_cart_backend
+
+
+class Command(BaseCommand):
+    help = 'Writes carts changed in the cache backend to the Cart/CartItem tables (run it on an interval)'
+
+    def handle(self, *args, **options):
+        backend = get_cart_backend()
+        if not hasattr(backend, 'flush'):
+            raise CommandError(f'{type(backend).__name__} stores carts in the database already, nothing to flush')
+        try:
+            flushed = backend.flush()
+        except FlushInProgress:
+            self.stdout.write(self.style.WARNING('another flush is running, skipped'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'flushed {flushed} carts'))
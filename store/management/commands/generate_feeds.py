@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.feeds import CHUNK_SIZE, FEEDS_DIR, generate
+
+
+class Command(BaseCommand):
+    help = 'Writes the product sitemaps and the google product feed, only the shards whose products changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='rewrite every shard')
+        parser.add_argument('--dir', default=FEEDS_DIR)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        result = generate(full=options['full'], directory=options['dir'], chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'wrote {result.shards} shards ({result.products} products), removed {result.removed} '
+            f'in {result.elapsed:.2f}s ({result.products_per_second:,.0f} products/s)'
+        ))
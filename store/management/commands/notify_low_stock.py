@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.mail import mail_admins
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store.models import LowStockAlert
+from store.stock import BATCH_SIZE, pending_alerts
+
+
+class Command(BaseCommand):
+    help = 'Sends the queued low stock alerts to the site admins, one email per batch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='print the alerts instead of sending them')
+
+    def handle(self, *args, **options):
+        if not settings.ADMINS and not options['dry_run']:
+            # mail_admins sends nothing without recipients, the alerts would be marked as sent and lost
+            raise CommandError('ADMINS is empty, set STOREFRONT_ADMINS to the addresses to notify')
+        sent = 0
+        while True:
+            alerts = pending_alerts(options['batch_size'])
+            if not alerts:
+                break
+            lines = [
+                f'{alert.product.title} (id {alert.product_id}): {alert.inventory} left, threshold {alert.threshold}'
+                for alert in alerts
+            ]
+            if options['dry_run']:
+                self.stdout.write('\n'.join(lines))
+                break
+            mail_admins(f'{len(alerts)} products are low on stock', '\n'.join(lines))
+            LowStockAlert.objects.filter(pk__in=[alert.pk for alert in alerts]).update(notified_at=timezone.now())
+            sent += len(alerts)
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'sent {sent} low stock alerts'))
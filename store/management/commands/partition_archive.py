@@ -0,0 +1,69 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from store.models import ArchivedOrder, ArchivedOrderItem
+
+
+class Command(BaseCommand):
+    help = 'Range partitions the order archive tables by month or year of placed_at (mysql only)'
+    # mysql wants the partitioning column in every unique key, so the primary keys become (id, placed_at).
+    # django still looks rows up by id alone, the archive only gets the ids of the hot tables, which are unique.
+    # queries on archived orders filtering placed_at only read the partitions of their range. the items are
+    # partitioned on their copy of placed_at, so the partitions of both tables hold the same periods.
+    # running the command again repartitions the tables with the periods archived since
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=['month', 'year'], default='year')
+        parser.add_argument('--execute', action='store_true', help='run the statements instead of printing them')
+
+    def period_starts(self, period):
+        # the start of every period from the oldest archived order up to the first period after the newest one.
+        # naive datetimes in utc, the time zone mysql stores placed_at in
+        first = ArchivedOrder.objects.order_by('placed_at').values_list('placed_at', flat=True).first()
+        last = ArchivedOrder.objects.order_by('-placed_at').values_list('placed_at', flat=True).first()
+        if first is None:
+            return []
+        year, month = first.year, first.month if period == 'month' else 1
+        starts = []
+        while True:
+            starts.append(datetime(year, month, 1))
+            if (year, month) > (last.year, last.month):
+                return starts
+            if period == 'month':
+                year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+            else:
+                year += 1
+
+    def statement(self, table, starts):
+        # the partition of a period ends where the next one starts, pmax takes what is archived after the last
+        lines = [
+            f"PARTITION p{start:%Y%m} VALUES LESS THAN ('{end:%Y-%m-%d %H:%M:%S}')"
+            for start, end in zip(starts, starts[1:])
+        ]
+        lines.append('PARTITION pmax VALUES LESS THAN (MAXVALUE)')
+        return (
+            f'ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, placed_at)\n'
+            f'PARTITION BY RANGE COLUMNS (placed_at) (\n    ' + ',\n    '.join(lines) + '\n)'
+        )
+
+    def handle(self, *args, **options):
+        if options['execute'] and connection.vendor != 'mysql':
+            raise CommandError(f'partitioning is only supported on mysql, not {connection.vendor}')
+
+        starts = self.period_starts(options['period'])
+        statements = [
+            self.statement(ArchivedOrder._meta.db_table, starts),
+            self.statement(ArchivedOrderItem._meta.db_table, starts),
+        ]
+        for sql in statements:
+            if options['execute']:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql)
+            else:
+                self.stdout.write(sql + ';')
+        if options['execute']:
+            self.stdout.write(self.style.SUCCESS(
+                f'partitioned the archived orders into {max(len(starts) - 1, 0) + 1} partitions'
+            ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import sharding
+from store.rebalance import BATCH_SIZE, RebalanceError, rebalance
+
+
+class Command(BaseCommand):
+    help = 'Moves the orders of customers to the shard of STORE_ORDER_SHARDS they belong to, after shards were added'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='customers per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='only count the customers that would move')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'shards: {", ".join(sharding.SHARDS)}')
+        try:
+            result = rebalance(batch_size=options['batch_size'], pause=options['pause'], dry_run=options['dry_run'])
+        except RebalanceError as error:
+            raise CommandError(str(error))
+        for (source, target), customers in sorted(result.moves.items()):
+            self.stdout.write(f'  {source} -> {target}: {customers} customers')
+        if options['dry_run']:
+            self.stdout.write(f'{result.customers} customers to move')
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'moved {result.customers} customers, {result.orders} orders and {result.items} items '
+            f'in {result.batches} batches, {result.elapsed:.2f}s ({result.orders_per_second:,.0f} orders/s)'
+        ))
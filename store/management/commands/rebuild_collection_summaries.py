@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.collection_summaries import BATCH_SIZE, rebuild
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the product counts and units sold behind the collection pages, e.g after a bulk import'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        collections, products = rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'rebuilt {collections} collection summaries and {products} product totals '
+            f'in {time.perf_counter() - start:.2f}s'
+        ))
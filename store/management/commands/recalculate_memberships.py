@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from store.membership import BATCH_SIZE, CHUNK_SIZE, recalculate_memberships
+from store.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Recalculates the membership tier of every customer from recency, frequency and monetary scores'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='customers scored per grouped query')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='changed customers per bulk_update')
+        parser.add_argument('--dry-run', action='store_true', help='score the customers without saving the tiers')
+
+    def handle(self, *args, **options):
+        result = recalculate_memberships(
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        tiers = ', '.join(f'{result.tiers[tier]} {label.lower()}' for tier, label in Customer.MEMBERSHIP_CHOICES)
+        self.stdout.write(self.style.SUCCESS(
+            f'scored {result.customers} customers ({tiers}), '
+            f'{"would change" if options["dry_run"] else "changed"} {result.changed} '
+            f'in {result.elapsed:.2f}s ({result.customers_per_second:,.0f} customers/s)'
+        ))
@@ -0,0 +1,34 @@
+import csv
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.payments import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Applies the payment statuses from a payment provider file (csv with order_id and status columns)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--dry-run', action='store_true', help='report what would change without updating')
+
+    def handle(self, *args, **options):
+        try:
+            provider_file = open(options['path'], newline='')
+        except OSError as error:
+            raise CommandError(error)
+
+        start = time.perf_counter()
+        with provider_file:
+            reader = csv.DictReader(provider_file)
+            if not {'order_id', 'status'} <= set(reader.fieldnames or ()):
+                raise CommandError('the file needs order_id and status columns')
+            result = reconcile(reader, chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        elapsed = time.perf_counter() - start
+
+        for name, value in result.as_dict().items():
+            self.stdout.write(f'{name}: {value}')
+        rate = result.records / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(f'reconciled {result.records} records in {elapsed:.2f}s ({rate:,.0f}/s)'))
@@ -0,0 +1,49 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from store.outbox import BATCH_SIZE, SINKS, get_sink, prune, relay
+
+
+class Command(BaseCommand):
+    help = 'Sends the recorded catalog change events to a sink in id order'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sink', default='stdout',
+                            help=f'one of {", ".join(SINKS)} or the dotted path of a store.outbox.BaseSink subclass')
+        parser.add_argument('--path', help='the file the file sink appends to')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, default=None)
+        parser.add_argument('--follow', action='store_true', help='keep relaying new events until interrupted')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds to wait for new events with --follow')
+        parser.add_argument('--prune-days', type=int, default=7, help='delete events relayed more than this many days ago')
+
+    def handle(self, *args, **options):
+        if options['sink'] == 'file' and not options['path']:
+            raise CommandError('the file sink needs --path')
+        sink = get_sink(options['sink'], *([options['path']] if options['sink'] == 'file' else []))
+        # with the stdout sink the events go to stdout, so the report goes to stderr
+        report = self.stderr if options['sink'] == 'stdout' else self.stdout
+        try:
+            while True:
+                result = relay(sink, batch_size=options['batch_size'], max_batches=options['max_batches'])
+                if result.events or not options['follow']:
+                    report.write(
+                        f'relayed {result.events} events in {result.batches} batches, {result.elapsed:.2f}s '
+                        f'({result.events_per_second:,.0f} events/s), lag mean {result.mean_lag:.2f}s '
+                        f'max {result.max_lag:.2f}s, {result.backlog} events waiting'
+                    )
+                if not options['follow']:
+                    break
+                if not result.events:
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sink.close()
+
+        pruned = prune(timezone.now() - timedelta(days=options['prune_days']))
+        if pruned:
+            report.write(f'pruned {pruned} relayed events')
@@ -0,0 +1,41 @@
+import csv
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+
+from store.reports import CHUNK_SIZE, REPORTS, ReportError, get_report, run_report
+
+
+class Command(BaseCommand):
+    help = 'Runs one of the raw sql reports of store/reports.py and writes it as csv or json lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help=', '.join(REPORTS))
+        parser.add_argument('--param', action='append', default=[], metavar='NAME=VALUE')
+        parser.add_argument('--format', choices=['csv', 'json'], default='csv')
+        parser.add_argument('--output', help='file to write to instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        data = dict(param.partition('=')[::2] for param in options['param'])
+        try:
+            report = get_report(options['name'])
+            params = report.clean(data)
+        except ReportError as error:
+            raise CommandError(error)
+
+        columns, rows = run_report(report, params, chunk_size=options['chunk_size'])
+        output = open(options['output'], 'w', newline='') if options['output'] else sys.stdout
+        try:
+            if options['format'] == 'csv':
+                writer = csv.writer(output)
+                writer.writerow(columns)
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    output.write(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n')
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,30 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from store.carts import merge_duplicate_items, sweep_expired_carts
+
+
+class Command(BaseCommand):
+    help = 'Deletes abandoned carts in small batches and merges duplicate cart items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='delete carts not touched for this many days')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+        parser.add_argument('--skip-merge', action='store_true', help="don't merge duplicate cart items")
+
+    def handle(self, *args, **options):
+        if not options['skip_merge']:
+            merged = merge_duplicate_items(batch_size=options['batch_size'])
+            self.stdout.write(f'merged {merged} duplicate cart items')
+
+        result = sweep_expired_carts(
+            max_age=timedelta(days=options['days']),
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'deleted {result.carts} carts and {result.items} items in {result.batches} batches, '
+            f'{result.elapsed:.2f}s ({result.rows_per_second:,.0f} rows/s)'
+        ))
@@ -0,0 +1,156 @@
+# nightly membership tier recalculation from RFM scores
+#   recency    days since the last completed order
+#   frequency  number of completed orders
+#   monetary   total spent on completed orders
+# each of them scores 0 to 3 points against the thresholds in the STORE_MEMBERSHIP_RFM setting
+# and the sum of the points decides the tier.
+# customers are walked in primary key chunks: one grouped query per order shard and one on the archive
+# (see store/archive.py) compute the rfm values of every customer in the chunk, the tiers are scored (vectorized when numpy is installed) and only the customers whose
+# tier changed are written back with bulk_update
+import time
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Sum
+from django.utils import timezone
+
+from .models import ArchivedOrder, Customer, Order
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, scoring falls back to bisect
+    np = None
+
+DEFAULT_THRESHOLDS = {
+    'recency_days': [365, 90, 30],  # last order within this many days: 1, 2 or 3 points
+    'frequency': [2, 5, 10],  # at least this many orders
+    'monetary': [100, 500, 2000],  # at least this much spent
+    'silver': 4,  # points needed for silver
+    'gold': 7,  # points needed for gold
+}
+CHUNK_SIZE = 10000
+BATCH_SIZE = 1000
+
+
+def get_thresholds():
+    return {**DEFAULT_THRESHOLDS, **getattr(settings, 'STORE_MEMBERSHIP_RFM', {})}
+
+
+def _grouped_orders(queryset, items, first_id, last_id):
+    return queryset \
+        .filter(customer_id__gte=first_id, customer_id__lte=last_id, payment_status=Order.PAYMENT_STATUS_COMPLETE) \
+        .values('customer_id') \
+        .annotate(
+            last_order=Max('placed_at'),
+            orders=Count('pk', distinct=True),
+            spent=Sum(F(f'{items}__quantity') * F(f'{items}__unit_price'), output_field=DecimalField()),
+        ) \
+        .order_by() \
+        .values_list('customer_id', 'last_order', 'orders', 'spent')
+
+
+def rfm_values(first_id, last_id, now):
+    # {customer_id: (days since last order, orders, spent)} for customers with completed orders in the pk range.
+    # a customer's orders are on the customer's shard (see store/sharding.py) and in the archive
+    found = list(_grouped_orders(Order.objects, 'orderitem', first_id, last_id).gather(list).values())
+    found.append(_grouped_orders(ArchivedOrder.objects, 'archivedorderitem', first_id, last_id))
+    merged = {}
+    for rows in found:
+        for customer_id, last_order, orders, spent in rows:
+            if customer_id in merged:
+                previous_last, previous_orders, previous_spent = merged[customer_id]
+                last_order = max(last_order, previous_last)
+                orders += previous_orders
+                spent = (spent or 0) + (previous_spent or 0)
+            merged[customer_id] = (last_order, orders, spent)
+    return {
+        customer_id: ((now - last_order).days, orders, float(spent or 0))
+        for customer_id, (last_order, orders, spent) in merged.items()
+    }
+
+
+def _tiers_python(values, thresholds):
+    recency = sorted(thresholds['recency_days'])
+    frequency = sorted(thresholds['frequency'])
+    monetary = sorted(thresholds['monetary'])
+    tiers = []
+    for days, orders, spent in values:
+        points = len(recency) - bisect_left(recency, days) if days is not None else 0
+        points += bisect_right(frequency, orders) + bisect_right(monetary, spent)
+        tiers.append(points)
+    return tiers
+
+
+def _tiers_numpy(values, thresholds):
+    if not values:
+        return []
+    days, orders, spent = np.array(values, dtype=np.float64).T
+    recency = np.sort(thresholds['recency_days'])
+    # customers without orders have nan days, searchsorted puts nan after every threshold: 0 points
+    points = len(recency) - np.searchsorted(recency, days, side='left')
+    points += np.searchsorted(np.sort(thresholds['frequency']), orders, side='right')
+    points += np.searchsorted(np.sort(thresholds['monetary']), spent, side='right')
+    return points.tolist()
+
+
+def score_tiers(values, thresholds):
+    # values is a list of (days since last order or None, orders, spent), returns the tier of each
+    if np is not None:
+        points = _tiers_numpy([(float('nan') if days is None else days, orders, spent) for days, orders, spent in values],
+                              thresholds)
+    else:
+        points = _tiers_python(values, thresholds)
+    return [
+        Customer.MEMBERSHIP_GOLD if p >= thresholds['gold']
+        else Customer.MEMBERSHIP_SILVER if p >= thresholds['silver']
+        else Customer.MEMBERSHIP_BRONZE
+        for p in points
+    ]
+
+
+class RecalculationResult:
+    def __init__(self):
+        self.customers = 0
+        self.changed = 0
+        self.tiers = Counter()
+        self.elapsed = 0.0
+
+    @property
+    def customers_per_second(self):
+        return self.customers / self.elapsed if self.elapsed else 0.0
+
+
+def recalculate_memberships(chunk_size=CHUNK_SIZE, batch_size=BATCH_SIZE, now=None, dry_run=False):
+    start = time.perf_counter()
+    now = now or timezone.now()
+    thresholds = get_thresholds()
+    result = RecalculationResult()
+    no_orders = (None, 0, 0.0)
+
+    last_id = 0
+    while True:
+        customers = list(
+            Customer.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', 'membership')[:chunk_size]
+        )
+        if not customers:
+            break
+        first_id, last_id = customers[0][0], customers[-1][0]
+        values = rfm_values(first_id, last_id, now)
+        tiers = score_tiers([values.get(pk, no_orders) for pk, _ in customers], thresholds)
+
+        changed = [
+            Customer(pk=pk, membership=tier)
+            for (pk, membership), tier in zip(customers, tiers)
+            if tier != membership
+        ]
+        if changed and not dry_run:
+            with transaction.atomic():
+                Customer.objects.bulk_update(changed, ['membership'], batch_size=batch_size)
+        result.customers += len(customers)
+        result.changed += len(changed)
+        result.tiers.update(tiers)
+
+    result.elapsed = time.perf_counter() - start
+    return result
@@ -0,0 +1,253 @@
+# prometheus style metrics, exposed in the text exposition format at /metrics (see store/views.py)
+# metrics are declared once at import time with counter() or histogram() and updated with inc()/observe().
+# each update is a dict lookup and one addition to a float under a short per process lock.
+#
+# values live in a store:
+#   MemoryStore  a dict in the process, fine for runserver or a single worker
+#   MmapStore    with STORE_METRICS_DIR set, every process writes its values to its own memory mapped file
+#                in that directory and /metrics sums the files of all the workers. empty the directory
+#                when the server (re)starts, files of workers that exited keep counting until then
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_left
+
+from django.conf import settings
+
+METRICS_DIR = getattr(settings, 'STORE_METRICS_DIR', '')
+# seconds, from a fast cached view to a slow report
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class MemoryStore:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, key, amount):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class MmapFile:
+    # a file of entries, each a 4 byte key length, the utf-8 key padded to 8 bytes and an 8 byte float.
+    # the first 8 bytes hold how many bytes are used, written after an entry is complete,
+    # so other processes reading the file never see half an entry
+    initial_size = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a+b')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(self.initial_size)
+        self._capacity = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        self._used = struct.unpack_from('q', self._map, 0)[0] or 8
+        self._positions = {key: position for key, position, _ in self._entries(self._map, self._used)}
+
+    @staticmethod
+    def _entries(data, used):
+        position = 8
+        while position < used:
+            length = struct.unpack_from('i', data, position)[0]
+            key = bytes(data[position + 4:position + 4 + length]).decode()
+            position += 4 + length + (-(4 + length) % 8)
+            yield key, position, struct.unpack_from('d', data, position)[0]
+            position += 8
+
+    @classmethod
+    def read(cls, path):
+        # {key: value} of a file written by any process
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < 8:
+            return {}
+        return {key: value for key, _, value in cls._entries(data, struct.unpack_from('q', data, 0)[0])}
+
+    def _add(self, key):
+        encoded = key.encode()
+        padding = -(4 + len(encoded)) % 8
+        size = 4 + len(encoded) + padding + 8
+        while self._used + size > self._capacity:
+            self._map.close()
+            self._capacity *= 2
+            self._file.truncate(self._capacity)
+            self._map = mmap.mmap(self._file.fileno(), self._capacity)
+        position = self._used
+        struct.pack_into(f'i{len(encoded)}s{padding}x', self._map, position, len(encoded), encoded)
+        position += 4 + len(encoded) + padding
+        struct.pack_into('d', self._map, position, 0.0)
+        self._used += size
+        struct.pack_into('q', self._map, 0, self._used)
+        self._positions[key] = position
+        return position
+
+    def inc(self, key, amount):
+        position = self._positions.get(key)
+        if position is None:
+            position = self._add(key)
+        value = struct.unpack_from('d', self._map, position)[0]
+        struct.pack_into('d', self._map, position, value + amount)
+
+
+class MmapStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+
+    def inc(self, key, amount):
+        with self._lock:
+            if self._pid != os.getpid():
+                # first use, or a worker forked from the process that imported us: one file per process
+                self._pid = os.getpid()
+                self._file = MmapFile(os.path.join(self.directory, f'metrics_{self._pid}.db'))
+            self._file.inc(key, amount)
+
+    def collect(self):
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.db')):
+            for key, value in MmapFile.read(path).items():
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+
+store = MmapStore(METRICS_DIR) if METRICS_DIR else MemoryStore()
+REGISTRY = {}
+
+
+def _key(name, labels):
+    return json.dumps([name, labels])
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}  # label values -> store keys, so json.dumps runs once per label combination
+
+    def _label_values(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects the labels {", ".join(self.labelnames)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = self._label_values(labels)
+        key = self._keys.get(values)
+        if key is None:
+            key = self._keys[values] = _key(self.name + '_total', dict(zip(self.labelnames, values)))
+        store.inc(key, amount)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def _bucket_keys(self, values):
+        labels = dict(zip(self.labelnames, values))
+        return (
+            [_key(self.name + '_bucket', {**labels, 'le': _format(bound)}) for bound in self.buckets],
+            _key(self.name + '_sum', labels),
+            _key(self.name + '_count', labels),
+        )
+
+    def observe(self, value, **labels):
+        values = self._label_values(labels)
+        keys = self._keys.get(values)
+        if keys is None:
+            keys = self._keys[values] = self._bucket_keys(values)
+        buckets, sum_key, count_key = keys
+        # only the bucket the value falls in is counted, the exposition makes them cumulative
+        store.inc(buckets[bisect_left(self.buckets, value)], 1)
+        store.inc(sum_key, value)
+        store.inc(count_key, 1)
+
+
+def counter(name, documentation, labelnames=()):
+    # names follow the prometheus conventions: counters get _total added, e.g counter('store_checkouts', ...)
+    return REGISTRY.setdefault(name, Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else f'{value:.1f}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    label_text = ','.join(f'{label}="{_escape(str(text))}"' for label, text in labels.items())
+    value_text = repr(value) if value != int(value) else str(int(value))
+    return f'{name}{{{label_text}}} {value_text}' if label_text else f'{name} {value_text}'
+
+
+def exposition():
+    # the text format of https://prometheus.io/docs/instrumenting/exposition_formats/
+    samples = {}
+    for key, value in store.collect().items():
+        name, labels = json.loads(key)
+        samples.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for metric in sorted(REGISTRY.values(), key=lambda metric: metric.name):
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        if isinstance(metric, Counter):
+            for labels, value in sorted(samples.get(metric.name + '_total', []), key=lambda sample: sorted(sample[0].items())):
+                lines.append(_sample(metric.name + '_total', labels, value))
+            continue
+        bounds = [_format(bound) for bound in metric.buckets]
+        series = {}
+        for labels, value in samples.get(metric.name + '_bucket', []):
+            le = labels.pop('le')
+            series.setdefault(tuple(labels.items()), {})[le] = value
+        sums = {tuple(labels.items()): value for labels, value in samples.get(metric.name + '_sum', [])}
+        counts = {tuple(labels.items()): value for labels, value in samples.get(metric.name + '_count', [])}
+        for labels in sorted(series):
+            cumulative = 0.0
+            for bound in bounds:
+                cumulative += series[labels].get(bound, 0.0)
+                lines.append(_sample(metric.name + '_bucket', {**dict(labels), 'le': bound}, cumulative))
+            lines.append(_sample(metric.name + '_sum', dict(labels), sums.get(labels, 0.0)))
+            lines.append(_sample(metric.name + '_count', dict(labels), counts.get(labels, 0.0)))
+    return '\n'.join(lines) + '\n'
+
+
+# metrics of the store app, the middleware (store/middleware.py) and the views update them
+REQUEST_DURATION = histogram(
+    'http_request_duration_seconds', 'Time spent handling requests', ['view', 'method']
+)
+REQUESTS = counter('http_requests', 'Requests handled', ['view', 'method', 'status'])
+DB_QUERIES = counter('db_queries', 'Database queries run while handling requests', ['view'])
+DB_QUERY_DURATION = counter('db_query_duration_seconds', 'Time spent in database queries', ['view'])
+CACHE_REQUESTS = counter('store_cache_requests', 'Cache lookups by result (hit, miss, stale, refresh), hit ratio = hit / (hit + miss)', ['cache', 'result'])
+CHECKOUTS = counter('store_checkouts', 'Checkouts by outcome', ['outcome'])
+
+
+def cache_lookup(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
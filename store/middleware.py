@@ -0,0 +1,47 @@
+import time
+from contextlib import ExitStack
+
+from django.db import connections
+
+from .metrics import DB_QUERIES, DB_QUERY_DURATION, REQUEST_DURATION, REQUESTS
+
+
+class QueryTimer:
+    # an execute wrapper (https://docs.djangoproject.com/en/4.2/topics/db/instrumentation/) adding up
+    # how many queries a request ran and how long they took
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    # records request latency per url name and the database time of every request (see store/metrics.py).
+    # keep it first in MIDDLEWARE so the time spent in the other middleware is included
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        timer = QueryTimer()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        # streamed responses (e.g reports) are timed until their first byte
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unresolved'
+        REQUEST_DURATION.observe(elapsed, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        DB_QUERIES.inc(timer.count, view=view)
+        DB_QUERY_DURATION.inc(timer.seconds, view=view)
+        return response
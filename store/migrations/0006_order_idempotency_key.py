@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:06
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0005_alter_collection_options_alter_customer_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='idempotency_key',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='description',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='promotions',
+            field=models.ManyToManyField(blank=True, to='store.promotion'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=6, validators=[django.core.validators.MinValueValidator(1)]),
+        ),
+    ]
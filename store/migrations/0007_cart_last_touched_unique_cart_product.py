@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:08
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min, Sum
+
+
+def backfill_last_touched(apps, schema_editor):
+    # existing carts get the time they were created rather than the time of the migration
+    Cart = apps.get_model('store', 'Cart')
+    Cart.objects.update(last_touched=F('created_at'))
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    # the unique constraint below can only be created once every (cart, product) appears once,
+    # so duplicates are folded into the row with the lowest id (same as store.carts.merge_duplicate_items)
+    CartItem = apps.get_model('store', 'CartItem')
+    duplicates = CartItem.objects.values('cart_id', 'product_id') \
+        .annotate(rows=Count('id'), keep=Min('id'), total=Sum('quantity')) \
+        .filter(rows__gt=1) \
+        .order_by()
+    for group in duplicates.iterator():
+        CartItem.objects.filter(id=group['keep']).update(quantity=min(group['total'], 32767))
+        CartItem.objects.filter(cart_id=group['cart_id'], product_id=group['product_id']) \
+            .exclude(id=group['keep']) \
+            .delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0006_order_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_touched',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(backfill_last_touched, migrations.RunPython.noop),
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0007_cart_last_touched_unique_cart_product'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='placed_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='last_update',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
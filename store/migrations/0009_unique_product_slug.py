@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:11
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def dedupe_slugs(apps, schema_editor):
+    # before the slug can be unique, every product sharing a slug with an older product
+    # (and every product with an empty slug) gets its id appended to it
+    Product = apps.get_model('store', 'Product')
+    duplicated = Product.objects.values('slug').annotate(rows=Count('id')).filter(rows__gt=1).values('slug')
+    clashing = Product.objects.filter(slug__in=duplicated).order_by('slug', 'id')
+    kept = None
+    for product in clashing.iterator():
+        if product.slug and product.slug != kept:
+            kept = product.slug  # the oldest product keeps the slug
+            continue
+        suffix = f'-{product.id}'
+        product.slug = (product.slug or 'product')[:50 - len(suffix)] + suffix
+        product.save(update_fields=['slug'])
+    for product in Product.objects.filter(slug='').iterator():
+        product.slug = f'product-{product.id}'
+        product.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0008_index_hot_lookups'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(unique=True),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:14
+
+from django.db import migrations, models
+
+
+def normalize(value):
+    # same as store.search.normalize at the time of this migration
+    return ' '.join((value or '').casefold().split())
+
+
+def backfill(model, sources, batch_size=2000):
+    # sources maps each key column to the column it is computed from
+    batch = []
+    for obj in model.objects.only('pk', *sources.values()).iterator(chunk_size=batch_size):
+        for key, source in sources.items():
+            setattr(obj, key, normalize(getattr(obj, source)))
+        batch.append(obj)
+        if len(batch) == batch_size:
+            model.objects.bulk_update(batch, list(sources))
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, list(sources))
+
+
+def backfill_search_keys(apps, schema_editor):
+    backfill(apps.get_model('store', 'Collection'), {'title_key': 'title'})
+    backfill(apps.get_model('store', 'Product'), {'title_key': 'title'})
+    backfill(apps.get_model('store', 'Customer'), {'first_name_key': 'first_name', 'last_name_key': 'last_name'})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0009_unique_product_slug'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='title_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='first_name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='last_name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='title_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+    ]
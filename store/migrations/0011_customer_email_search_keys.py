@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0010_search_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customer',
+            name='email_domain_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='email_local_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+    ]
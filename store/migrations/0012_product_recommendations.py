@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0011_customer_email_search_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_order_id', models.BigIntegerField()),
+                ('full', models.BooleanField()),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='store.product')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', '-score'], name='store_produ_product_fe1e11_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productrecommendation',
+            constraint=models.UniqueConstraint(fields=('product', 'recommended'), name='unique_product_recommendation'),
+        ),
+    ]
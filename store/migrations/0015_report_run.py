@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_outbox_event'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(db_index=True, max_length=100)),
+                ('params', models.JSONField()),
+                ('rows', models.PositiveIntegerField()),
+                ('seconds', models.FloatField()),
+                ('from_cache', models.BooleanField()),
+                ('started_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
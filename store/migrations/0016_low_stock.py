@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_stock_status(apps, schema_editor):
+    # no product or collection has its own threshold yet, so low stock means below the default.
+    # no alerts are queued for products that were already low
+    Product = apps.get_model('store', 'Product')
+    threshold = getattr(settings, 'STORE_LOW_STOCK_THRESHOLD', 10)
+    Product.objects.filter(inventory__lt=threshold).update(stock_status='L')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_report_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LowStockAlert',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inventory', models.IntegerField()),
+                ('threshold', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('notified_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='low_stock_threshold',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='stock_status',
+            field=models.CharField(choices=[('O', 'Ok'), ('L', 'Low')], default='O', editable=False, max_length=1),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['stock_status', 'inventory'], name='store_produ_stock_s_6b5ab9_idx'),
+        ),
+        migrations.AddField(
+            model_name='lowstockalert',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product'),
+        ),
+        migrations.AddIndex(
+            model_name='lowstockalert',
+            index=models.Index(fields=['notified_at', 'id'], name='store_lowst_notifie_d933b8_idx'),
+        ),
+        migrations.RunPython(backfill_stock_status, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:29
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+import django.db.models.deletion
+
+
+def backfill(apps, schema_editor):
+    # the same as store.collection_summaries.rebuild(), with the models of this migration
+    Collection = apps.get_model('store', 'Collection')
+    CollectionSummary = apps.get_model('store', 'CollectionSummary')
+    Product = apps.get_model('store', 'Product')
+    ProductPopularity = apps.get_model('store', 'ProductPopularity')
+    OrderItem = apps.get_model('store', 'OrderItem')
+    ArchivedOrderItem = apps.get_model('store', 'ArchivedOrderItem')
+
+    counts = dict(Product.objects.values('collection_id').annotate(count=Count('pk')).values_list('collection_id', 'count'))
+    CollectionSummary.objects.bulk_create(
+        [CollectionSummary(collection_id=pk, products_count=counts.get(pk, 0))
+         for pk in Collection.objects.values_list('pk', flat=True)],
+        batch_size=1000,
+    )
+    sold = Counter(dict(OrderItem.objects.values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units')))
+    sold.update(dict(ArchivedOrderItem.objects.values('product_id').annotate(units=Sum('quantity')).values_list('product_id', 'units')))
+    ProductPopularity.objects.bulk_create(
+        (ProductPopularity(product_id=pk, collection_id=collection_id, units_sold=sold.get(pk, 0))
+         for pk, collection_id in Product.objects.values_list('pk', 'collection_id').iterator(chunk_size=1000)),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_low_stock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CollectionSummary',
+            fields=[
+                ('collection', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='summary', serialize=False, to='store.collection')),
+                ('products_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='store.product')),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('likes', models.PositiveIntegerField(default=0)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.collection')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['collection', '-units_sold'], name='store_produ_collect_24cab1_idx'), models.Index(fields=['collection', '-likes'], name='store_produ_collect_cdc24f_idx')],
+            },
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_collection_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViewCount',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='view_count', serialize=False, to='store.product')),
+                ('views', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-views'], name='store_produ_views_fc214b_idx')],
+            },
+        ),
+    ]
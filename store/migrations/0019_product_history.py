@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:38
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def record_current_values(apps, schema_editor):
+    # the history starts with the price and inventory every product has now
+    Product = apps.get_model('store', 'Product')
+    ProductHistory = apps.get_model('store', 'ProductHistory')
+    bucket = int(timezone.now().timestamp() // 60)
+    rows = Product.objects.values_list('pk', 'unit_price', 'inventory').iterator(chunk_size=1000)
+    ProductHistory.objects.bulk_create(
+        (ProductHistory(product_id=pk, bucket=bucket, price_cents=int(unit_price * 100), inventory=inventory)
+         for pk, unit_price, inventory in rows),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_product_view_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveIntegerField()),
+                ('price_cents', models.PositiveIntegerField(null=True)),
+                ('inventory', models.IntegerField(null=True)),
+                ('resolution', models.PositiveSmallIntegerField(default=1)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='store.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'bucket'], name='store_produ_product_6e0b3e_idx')],
+            },
+        ),
+        migrations.RunPython(record_current_values, migrations.RunPython.noop),
+    ]
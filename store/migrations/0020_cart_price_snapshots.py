@@ -0,0 +1,47 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:40
+
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Max, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def snapshot_prices(apps, schema_editor):
+    # the prices of store/pricing.py when this migration was written: the biggest discount of the product's promotions
+    Product = apps.get_model('store', 'Product')
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    CartItem.objects.update(unit_price=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('unit_price')[:1]))
+    promoted = Product.promotions.through.objects.filter(product__cartitem__isnull=False).distinct() \
+        .values('product_id').annotate(discount=Max('promotion__discount')) \
+        .values_list('product_id', 'product__unit_price', 'discount')
+    for product_id, unit_price, discount in promoted:
+        discount = Decimal(str(min(max(discount or 0, 0), 1)))
+        price = (unit_price * (1 - discount)).quantize(Decimal('0.01'), ROUND_HALF_UP)
+        CartItem.objects.filter(product_id=product_id).update(unit_price=price)
+    money = DecimalField(max_digits=12, decimal_places=2)
+    totals = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart') \
+        .annotate(total=Sum(F('quantity') * F('unit_price'), output_field=money)).values('total')
+    Cart.objects.update(total=Coalesce(Subquery(totals, output_field=money), Value(Decimal(0)), output_field=money))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0019_product_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cartitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=6, null=True),
+        ),
+        migrations.RunPython(snapshot_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_cart_price_snapshots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='customer',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, to='store.customer'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.PROTECT, to='store.product'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:40
+
+from django.db import migrations
+
+
+def normalize(value):
+    # same as store.search.normalize at the time of this migration
+    return ' '.join((value or '').casefold().split())
+
+
+def split_email(email):
+    # same as store.search.split_email at the time of this migration
+    value = normalize(email)
+    if '@' not in value:
+        return value, ''
+    local, _, domain = value.rpartition('@')
+    return local, domain
+
+
+def backfill_email_keys(apps, schema_editor, batch_size=2000):
+    # 0011 added the email keys without computing them for the customers that were already there
+    Customer = apps.get_model('store', 'Customer')
+    batch = []
+    for customer in Customer.objects.only('pk', 'email').iterator(chunk_size=batch_size):
+        customer.email_local_key, customer.email_domain_key = split_email(customer.email)
+        batch.append(customer)
+        if len(batch) == batch_size:
+            Customer.objects.bulk_update(batch, ['email_local_key', 'email_domain_key'])
+            batch = []
+    if batch:
+        Customer.objects.bulk_update(batch, ['email_local_key', 'email_domain_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_order_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_email_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:10
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_placed_at(apps, schema_editor):
+    # one statement, the items of an archived order are always archived with it
+    ArchivedOrder = apps.get_model('store', 'ArchivedOrder')
+    ArchivedOrderItem = apps.get_model('store', 'ArchivedOrderItem')
+    ArchivedOrderItem.objects.update(
+        placed_at=Subquery(ArchivedOrder.objects.filter(pk=OuterRef('order_id')).values('placed_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_backfill_customer_email_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorderitem',
+            name='placed_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(copy_placed_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='archivedorderitem',
+            name='placed_at',
+            field=models.DateTimeField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0023_archived_item_placed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationrun',
+            name='last_order_ids',
+            field=models.JSONField(default=dict),
+        ),
+    ]
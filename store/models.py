@@ -1,5 +1,20 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
+from django.utils.text import slugify
+
+from . import sharding
+from .search import normalize, split_email
+
+class AtomicSaveMixin:
+    # save() and its post_save receivers in one transaction, the outbox (store/outbox.py) writes the model's event
+    # from post_save and it must commit with the row. savepoint=False like the transaction save_base opens itself:
+    # inside an outer atomic block nothing changes
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
 
 # creating a promotions class which would have many to many relationship with products
 # products can have different promotions and promotions can apply to different products
@@ -9,7 +24,7 @@ from django.core.validators import MinValueValidator
 # so that along side every product, the promotion that applies to it is shown
 # see promotions field defined in products class below, django then defines the reverse relation to link the promtions class
 
-class Promotion(models.Model):
+class Promotion(AtomicSaveMixin, models.Model):
     description = models.CharField(max_length= 255)
     discount = models.FloatField()
 
@@ -19,8 +34,10 @@ class Promotion(models.Model):
 # we reference it as by passing Collections object as the first argunent in the foreign key field
 # if we cant arrange it like this, i.e collection before the product class....
 #...we can just pass collection as a string instead e.g collection = models.ForeignKey("Collection",on_delete=models.PROTECT)
-class Collection(models.Model):
+class Collection(AtomicSaveMixin, models.Model):
     title = models.CharField(max_length=255)
+    # normalized copy of the title for fast prefix searches (see store/search.py), kept up to date in save()
+    title_key = models.CharField(max_length=255, db_index=True, editable=False, default='')
 
     # product_set
     # we would have the field above when django creates the reverse relationship to complete the many to many
@@ -30,6 +47,9 @@ class Collection(models.Model):
 
     featured_product = models.ForeignKey("Product", on_delete=models.SET_NULL, null=True,
                                          related_name='+')
+    # products of this collection are low on stock below this many units, unless they set their own threshold
+    # (see store/stock.py). empty uses the STORE_LOW_STOCK_THRESHOLD setting
+    low_stock_threshold = models.PositiveIntegerField(null=True, blank=True)
     # we also have a field called featured_product which is a dependency on the product class
     # if you look at the product class we also have a field called collections which initiates...
     # ..a dependency of the products class on the collections class also
@@ -50,10 +70,21 @@ class Collection(models.Model):
     def __str__(self): # overriding the str method to influence default display of collection objecs in admin site
         return self.title
 
+    def save(self, *args, **kwargs):
+        self.title_key = normalize(self.title)
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering=['title']
 
-class Product(models.Model):
+class Product(AtomicSaveMixin, models.Model):
+    STOCK_OK = "O"
+    STOCK_LOW = "L"
+
+    STOCK_STATUS_CHOICES = [
+        (STOCK_OK, "Ok"),
+        (STOCK_LOW, "Low"),
+    ]
 
     # django creates id field automatically so we dont need create a field and make it ID
     # every entity or model class will have an id field that will serve as the primary key
@@ -65,11 +96,14 @@ class Product(models.Model):
     # every field type has a bunch of options, some generic or particular to that type
     # we want our title to be of the charfield type
     title = models.CharField(max_length=255)
-    slug = models.SlugField() # we can either define slugfield like this line and select the default value
+    title_key = models.CharField(max_length=255, db_index=True, editable=False, default='') # see Collection.title_key
+    slug = models.SlugField(unique=True) # we can either define slugfield like this line and select the default value
     # ...when django prompts us to while making the migration .
     # this would mmean that the default slug value will be defined in our migrations file only
     # the alternative is the line below where we can either set a default value or set null to true
     # slug = models.SlugField(default='-')
+    # product pages are looked up by slug (see store/slugs.py), so every slug must point to exactly one product
+    # unique=True also gives us the index for that lookup
     description = models.TextField(null=True,blank=True)
     unit_price = models.DecimalField(
         max_digits=6,
@@ -78,7 +112,12 @@ class Product(models.Model):
         #.. when adding new product via admin form
     )
     inventory = models.IntegerField()
-    last_update = models.DateTimeField(auto_now=True)
+    low_stock_threshold = models.PositiveIntegerField(null=True, blank=True) # overrides the collection's threshold
+    # whether inventory is below the threshold, kept up to date whenever inventory changes (see store/stock.py)
+    # so the low stock products can be listed from an index. a char rather than a boolean: django compares
+    # boolean filters as a bare "WHERE column", which the databases wont look up in an index
+    stock_status = models.CharField(max_length=1, choices=STOCK_STATUS_CHOICES, default=STOCK_OK, editable=False)
+    last_update = models.DateTimeField(auto_now=True, db_index=True) # indexed cus the admin filters products by it
     collection = models.ForeignKey(Collection,on_delete=models.PROTECT)
     # used models.protect above so if we delete a collection we dont delete all products in the collection
 
@@ -92,8 +131,31 @@ class Product(models.Model):
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # slug collisions are only ever resolved here, when writing, so reading a product by slug never has to
+        self.slug = self.unique_slug(self.slug or slugify(self.title))
+        self.title_key = normalize(self.title)
+        super().save(*args, **kwargs)
+
+    def unique_slug(self, slug):
+        # returns slug, or slug-2, slug-3 ... if another product already uses it
+        max_length = self._meta.get_field('slug').max_length
+        slug = slug[:max_length] or 'product'
+        others = Product.objects.exclude(pk=self.pk)
+        if not others.filter(slug=slug).exists():
+            return slug
+        base = slug[:max_length - 8]  # leaves room for the suffix
+        taken = set(others.filter(slug__startswith=f'{base}-').values_list('slug', flat=True))
+        suffix = 2
+        while f'{base}-{suffix}' in taken:
+            suffix += 1
+        return f'{base}-{suffix}'
+
     class Meta:
         ordering= ['title']
+        indexes = [
+            models.Index(fields=['stock_status', 'inventory'])
+        ]
 
 class Customer(models.Model):
     # sometimes we may also need to limit the number of values that can be stored in  field
@@ -115,7 +177,13 @@ class Customer(models.Model):
     ]
     first_name = models.CharField(max_length=255)
     last_name = models.CharField(max_length=255)
+    # normalized copies of the names for fast prefix searches (see store/search.py), kept up to date in save()
+    first_name_key = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    last_name_key = models.CharField(max_length=255, db_index=True, editable=False, default='')
     email = models.EmailField(unique=True)
+    # the email split in normalized parts so customers can be searched by either (see store/customers.py)
+    email_local_key = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    email_domain_key = models.CharField(max_length=255, db_index=True, editable=False, default='')
     phone = models.CharField(max_length=255)
     birth_date = models.DateField(null=True) # using date field rather than datetime cus we dont need time here
     membership = models.CharField(max_length=1, choices=MEMBERSHIP_CHOICES, default= MEMBERSHIP_BRONZE)
@@ -129,8 +197,25 @@ class Customer(models.Model):
     def __str__(self):
         return f'{self.first_name} {self.last_name}'
 
+    def save(self, *args, **kwargs):
+        self.first_name_key = normalize(self.first_name)
+        self.last_name_key = normalize(self.last_name)
+        self.email_local_key, self.email_domain_key = split_email(self.email)
+        super().save(*args, **kwargs)
+
+
 
 
+# orders and their items live on the shard of their customer (see store/sharding.py)
+class OrderQuerySet(models.QuerySet):
+    def for_customer(self, customer_id):
+        # the customer's orders (or items, filter them by order__customer_id), read from the customer's shard
+        return self.using(sharding.shard_for(customer_id))
+
+    def gather(self, function):
+        # {alias: function(this queryset on the shard)} of every shard, queried at the same time
+        return sharding.scatter(lambda alias: function(self.using(alias)))
+
 
 class Order(models.Model):
     PAYMENT_STATUS_PENDING = "P"
@@ -144,21 +229,56 @@ class Order(models.Model):
     ]
     # auto_now_add in the field below means that the first time we place an order and thus an order object is created
     # ......, djnago automatically populates this field
-    placed_at = models.DateTimeField(auto_now_add=True)
+    placed_at = models.DateTimeField(auto_now_add=True, db_index=True) # orders are mostly looked up by date ranges
     payment_status = models.CharField(
         max_length=1,choices=PAYMENT_STATUS_CHOICE,default=PAYMENT_STATUS_PENDING
     )
-    customer = models.ForeignKey(Customer, on_delete=models.PROTECT)
-    # using protect above so we dont delete orders is a customer is deleted
+    # using protect so we dont delete orders is a customer is deleted.
+    # no constraint, the orders can be on another database than the customer (see store/sharding.py)
+    customer = models.ForeignKey(Customer, on_delete=models.PROTECT, db_constraint=False)
+
+    # orders coming in from partner feeds carry a key chosen by the partner
+    # a retried batch sends the same keys again, so the unique constraint makes sure we never create an order twice
+    # it also lets us look the new orders up again after bulk_create, since mysql doesnt return the ids of bulk inserts
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order,on_delete=models.PROTECT)
-    product= models.ForeignKey(Product,on_delete=models.PROTECT)
+    product= models.ForeignKey(Product,on_delete=models.PROTECT, db_constraint=False) # on the shard of the order
+
+    objects = OrderQuerySet.as_manager()
     quantity = models.PositiveSmallIntegerField()
     unit_price = models.DecimalField(max_digits=6,decimal_places=2)
     # unit_price is stored here in order item also, because since the price of the product can always change..
     #.. it is good to store the price of the item at the time ordered
 
+
+# orders older than the archive cutoff are moved out of Order/OrderItem into these tables (see store/archive.py)
+# so the tables the shop works with stay small. rows keep their original ids.
+# the archive has no foreign key constraints and no unique keys besides the id, so on mysql it can be
+# range partitioned on placed_at (see the partition_archive command), which doesnt allow either.
+# the items keep a copy of their order's placed_at for that
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    placed_at = models.DateTimeField(db_index=True)
+    payment_status = models.CharField(max_length=1, choices=Order.PAYMENT_STATUS_CHOICE)
+    customer = models.ForeignKey(Customer, on_delete=models.DO_NOTHING, db_constraint=False)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'Order {self.pk} (archived)'
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.DO_NOTHING, db_constraint=False)
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False)
+    quantity = models.PositiveSmallIntegerField()
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
+    placed_at = models.DateTimeField()
+
 # we can also implement one to one relationships between two models
 # each address should belong to one and only one! customer
 class Address(models.Model):
@@ -193,6 +313,12 @@ class Address(models.Model):
 
 class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
+    # the last time the cart or one of its items changed (see store/carts.py which touches it on every change)
+    # indexed so the sweeper can find abandoned carts without scanning the whole table
+    last_touched = models.DateTimeField(auto_now=True, db_index=True)
+    # the sum of the items at their unit_price, kept up to date by store/carts.py so showing a cart
+    # doesn't need the products
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
 
 class CartItem(models.Model):
@@ -201,32 +327,143 @@ class CartItem(models.Model):
     # cascade above meaning if you can delete a product i.e product has also never been ordered before..
     # ...then that product should be removed from all the existing shopping carts as well
     quantity = models.PositiveSmallIntegerField()
+    # the price of the product after promotions, set when the item is added and updated for every open cart
+    # when the product's price or promotions change (see reprice_products in store/carts.py)
+    unit_price = models.DecimalField(max_digits=6, decimal_places=2, null=True)
 
+    class Meta:
+        # a product appears at most once per cart, adding it again increases the quantity instead
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product')
+        ]
 
 
+class ProductRecommendation(models.Model):
+    # "frequently bought together": the products most often ordered together with product,
+    # built from OrderItem by store/recommendations.py. only the top few per product are kept
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField() # the number of orders that contain both products
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'recommended'], name='unique_product_recommendation')
+        ]
+        # recommendations for a product are read best first, straight from this index
+        indexes = [
+            models.Index(fields=['product', '-score'])
+        ]
+
+
+class RecommendationRun(models.Model):
+    # one row per build of the recommendations, the newest one tells the next incremental build where to start
+    last_order_id = models.BigIntegerField() # the highest on any shard
+    last_order_ids = models.JSONField(default=dict) # {shard: last order id counted there} (see store/sharding.py)
+    full = models.BooleanField()
+    finished_at = models.DateTimeField(auto_now_add=True)
+
+
+class OutboxEvent(models.Model):
+    # a change to a catalog row, written in the same transaction as the change itself (see store/outbox.py)
+    # so downstream systems hear about exactly the changes that were committed
+    ACTION_CREATED = 'created'
+    ACTION_UPDATED = 'updated'
+    ACTION_DELETED = 'deleted'
+
+    ACTION_CHOICES = [
+        (ACTION_CREATED, 'Created'),
+        (ACTION_UPDATED, 'Updated'),
+        (ACTION_DELETED, 'Deleted'),
+    ]
+    model = models.CharField(max_length=100) # app_label.model_name, e.g store.product
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=7, choices=ACTION_CHOICES)
+    fields = models.JSONField(null=True) # the fields a bulk update changed, null when any field may have changed
+    payload = models.JSONField(null=True, encoder=DjangoJSONEncoder) # the row after the change, null for deletes
+    created_at = models.DateTimeField(auto_now_add=True)
+    relayed_at = models.DateTimeField(null=True)
 
+    class Meta:
+        # the relay reads the events that weren't relayed yet in id order
+        indexes = [
+            models.Index(fields=['relayed_at', 'id'])
+        ]
+
+
+class ReportRun(models.Model):
+    # one row per run of a raw sql report (see store/reports.py), to see which reports are slow or popular
+    name = models.CharField(max_length=100, db_index=True)
+    params = models.JSONField()
+    rows = models.PositiveIntegerField()
+    seconds = models.FloatField()
+    from_cache = models.BooleanField()
+    started_at = models.DateTimeField(auto_now_add=True)
+
+
+class LowStockAlert(models.Model):
+    # queued when a product's inventory drops below its low stock threshold (see store/stock.py),
+    # sent and marked as notified by the notify_low_stock command
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    inventory = models.IntegerField()
+    threshold = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    notified_at = models.DateTimeField(null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['notified_at', 'id'])
+        ]
 
 
+class CollectionSummary(models.Model):
+    # what a collection page shows about the collection as a whole, maintained as products come and go
+    # (see store/collection_summaries.py) so nobody has to count the products of a collection when reading it
+    collection = models.OneToOneField(Collection, on_delete=models.CASCADE, primary_key=True, related_name='summary')
+    products_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
 
 
+class ProductPopularity(models.Model):
+    # running totals per product, with a copy of the product's collection so the best sellers or most liked
+    # products of a collection are read straight from an index (see store/collection_summaries.py)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='popularity')
+    collection = models.ForeignKey(Collection, on_delete=models.CASCADE, related_name='+')
+    units_sold = models.PositiveIntegerField(default=0)
+    likes = models.PositiveIntegerField(default=0) # maintained by whoever knows about likes, e.g the store_custom app
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['collection', '-units_sold']),
+            models.Index(fields=['collection', '-likes']),
+        ]
 
 
+class ProductViewCount(models.Model):
+    # page views per product. views are counted in memory and added here in batches (see store/product_views.py)
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='view_count')
+    views = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-views'])
+        ]
+
+
+class ProductHistory(models.Model):
+    # price and inventory changes of products, appended as they happen (see store/history.py)
+    # kept small so years of changes stay cheap to store and to read:
+    #   - prices in cents and times in minutes since 1970 (bucket), 4 byte integers instead of decimals and datetimes
+    #   - a row only holds the values that changed, the other one is null
+    #   - old rows are merged into one row per hour, then per day, by the compact_history command
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    bucket = models.PositiveIntegerField()
+    price_cents = models.PositiveIntegerField(null=True)
+    inventory = models.IntegerField(null=True)
+    # minutes covered by the row: 1 as recorded, 60 or 1440 once compacted
+    resolution = models.PositiveSmallIntegerField(default=1)
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'bucket'])
+        ]
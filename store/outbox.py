@@ -0,0 +1,231 @@
+# transactional outbox for catalog changes
+# every change to a tracked model (STORE_OUTBOX_MODELS) adds an OutboxEvent row in the same transaction,
+# so a rolled back change never produces an event and a committed one always does.
+#   - save() and delete() are recorded by signal receivers (see connect). delete() sends post_delete inside its
+#     transaction, but save() sends post_save after its own has ended, so in autocommit the row would commit
+#     before the event is written. the tracked models open a transaction in their own save() for that
+#     (AtomicSaveMixin in store/models.py, TaggedItem.save), callers don't have to open one
+#   - queryset.update() and bulk_create() skip the signals, code doing bulk changes records them with
+#     update() or record_bulk() below
+# the relay_outbox command then drains the events in id order, in batches, to a sink
+# (a json lines file or stdout here, a message broker or search indexer in production)
+import json
+import sys
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboxEvent
+
+TRACKED_MODELS = getattr(
+    settings, 'STORE_OUTBOX_MODELS', ['store.Product', 'store.Collection', 'store.Promotion', 'tags.TaggedItem']
+)
+BATCH_SIZE = 1000
+
+
+def _label(model):
+    return model._meta.label_lower
+
+
+def _payload(instance):
+    return {field.attname: field.value_from_object(instance) for field in instance._meta.concrete_fields}
+
+
+def record(instance, action, fields=None):
+    return OutboxEvent.objects.create(
+        model=_label(instance),
+        object_id=instance.pk,
+        action=action,
+        fields=fields,
+        payload=None if action == OutboxEvent.ACTION_DELETED else _payload(instance),
+    )
+
+
+def record_bulk(model, pks, action=OutboxEvent.ACTION_UPDATED, fields=None, batch_size=BATCH_SIZE):
+    # one event per primary key. the payloads are read back from the database,
+    # so call it inside the transaction that made the change, after the change
+    pks = list(pks)
+    for start in range(0, len(pks), batch_size):
+        batch = pks[start:start + batch_size]
+        if action == OutboxEvent.ACTION_DELETED:
+            payloads = {}
+        else:
+            payloads = {obj.pk: _payload(obj) for obj in model._base_manager.filter(pk__in=batch)}
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(model=_label(model), object_id=pk, action=action, fields=fields, payload=payloads.get(pk))
+            for pk in batch
+            if action == OutboxEvent.ACTION_DELETED or pk in payloads
+        ])
+    return len(pks)
+
+
+def update(queryset, **values):
+    # queryset.update(**values) that records an event for every updated row. returns the number of rows updated
+    with transaction.atomic():
+        pks = list(queryset.values_list('pk', flat=True))
+        count = 0
+        for start in range(0, len(pks), BATCH_SIZE):
+            count += queryset.model._base_manager.filter(pk__in=pks[start:start + BATCH_SIZE]).update(**values)
+        record_bulk(queryset.model, pks, fields=sorted(values))
+    return count
+
+
+def tracked_models():
+    # models of apps that aren't installed are skipped, the store app works without tags
+    return [apps.get_model(label) for label in TRACKED_MODELS if label.split('.')[0] in apps.app_configs]
+
+
+def on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if not raw:  # fixtures
+        action = OutboxEvent.ACTION_CREATED if created else OutboxEvent.ACTION_UPDATED
+        record(instance, action, sorted(update_fields) if update_fields else None)
+
+
+def on_delete(sender, instance, **kwargs):
+    record(instance, OutboxEvent.ACTION_DELETED)
+
+
+def on_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    # e.g product.promotions.add(...): the row itself didn't change, but its relations did
+    if not action.startswith('post_'):
+        return
+    field = next(
+        (f.name for f in instance._meta.many_to_many if f.remote_field.through is sender),
+        None,
+    )
+    tracked = tracked_models()
+    if field is not None and instance.__class__ in tracked:
+        record(instance, OutboxEvent.ACTION_UPDATED, [field])
+    elif reverse and pk_set and model in tracked:
+        # promotion.products.add(...) changes the promotions of every product in pk_set
+        field = next(f.name for f in model._meta.many_to_many if f.remote_field.through is sender)
+        record_bulk(model, pk_set, fields=[field])
+
+
+def connect():
+    # called from StoreConfig.ready()
+    for model in tracked_models():
+        post_save.connect(on_save, sender=model, dispatch_uid=f'outbox_save_{_label(model)}')
+        post_delete.connect(on_delete, sender=model, dispatch_uid=f'outbox_delete_{_label(model)}')
+        for field in model._meta.many_to_many:
+            m2m_changed.connect(on_m2m_changed, sender=field.remote_field.through,
+                                dispatch_uid=f'outbox_m2m_{_label(field.remote_field.through)}')
+        for related in model._meta.related_objects:
+            if related.many_to_many:
+                m2m_changed.connect(on_m2m_changed, sender=related.through,
+                                    dispatch_uid=f'outbox_m2m_{_label(related.through)}')
+
+
+def as_dict(event):
+    return {
+        'id': event.pk,
+        'model': event.model,
+        'object_id': event.object_id,
+        'action': event.action,
+        'fields': event.fields,
+        'payload': event.payload,
+        'created_at': event.created_at,
+    }
+
+
+class BaseSink:
+    def send(self, events):
+        # raising makes the relay roll back, the events are sent again on the next run
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StreamSink(BaseSink):
+    # one json object per line
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, events):
+        self.stream.write(''.join(json.dumps(as_dict(event), cls=DjangoJSONEncoder) + '\n' for event in events))
+        self.stream.flush()
+
+
+class FileSink(StreamSink):
+    def __init__(self, path):
+        super().__init__(open(path, 'a'))
+
+    def close(self):
+        self.stream.close()
+
+
+SINKS = {
+    'stdout': StreamSink,
+    'file': FileSink,
+}
+
+
+def get_sink(name, *args):
+    # a name from SINKS or the dotted path of a BaseSink subclass
+    return SINKS[name](*args) if name in SINKS else import_string(name)(*args)
+
+
+class RelayResult:
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+        self.elapsed = 0.0
+        self.max_lag = 0.0  # seconds between an event being written and being relayed
+        self.total_lag = 0.0
+        self.backlog = 0  # events still waiting when the relay stopped
+
+    @property
+    def events_per_second(self):
+        return self.events / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mean_lag(self):
+        return self.total_lag / self.events if self.events else 0.0
+
+
+def relay(sink, batch_size=BATCH_SIZE, max_batches=None):
+    # sends the waiting events to sink in id order. every batch is locked, sent and marked in one transaction,
+    # so a failing sink leaves its batch for the next run (at least once delivery) and concurrent relays skip
+    # batches another relay is working on
+    result = RelayResult()
+    start = time.perf_counter()
+    while max_batches is None or result.batches < max_batches:
+        with transaction.atomic():
+            events = list(
+                OutboxEvent.objects.select_for_update(skip_locked=True)
+                .filter(relayed_at__isnull=True)
+                .order_by('pk')[:batch_size]
+            )
+            if not events:
+                break
+            sink.send(events)
+            now = timezone.now()
+            OutboxEvent.objects.filter(pk__in=[event.pk for event in events]).update(relayed_at=now)
+        for event in events:
+            lag = (now - event.created_at).total_seconds()
+            result.max_lag = max(result.max_lag, lag)
+            result.total_lag += lag
+        result.events += len(events)
+        result.batches += 1
+    result.elapsed = time.perf_counter() - start
+    result.backlog = OutboxEvent.objects.filter(relayed_at__isnull=True).count()
+    return result
+
+
+def prune(older_than, batch_size=BATCH_SIZE):
+    # deletes relayed events relayed before older_than, returns how many
+    deleted = 0
+    while True:
+        pks = list(
+            OutboxEvent.objects.filter(relayed_at__lt=older_than).order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not pks:
+            return deleted
+        deleted += OutboxEvent.objects.filter(pk__in=pks).delete()[0]
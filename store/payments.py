@@ -0,0 +1,155 @@
+# payment status state machine for orders
+# Order.payment_status is just a char field, so nothing stops code from setting it to anything at any time.
+# all changes should go through the functions below which only allow these transitions:
+#   pending  -> complete | failed
+#   failed   -> pending (the customer retries) | complete (the provider reports a late success)
+#   complete is final
+# every change is a conditional update (UPDATE ... WHERE payment_status IN (allowed sources)),
+# so two processes changing the same order can't overwrite each other: the second update simply matches no rows.
+# callers only know order ids, not customers, so the updates run on every order shard (see store/sharding.py)
+from itertools import islice
+
+from django.db import transaction
+
+from . import sharding
+from .models import Order
+
+PENDING = Order.PAYMENT_STATUS_PENDING
+COMPLETE = Order.PAYMENT_STATUS_COMPLETE
+FAILED = Order.PAYMENT_STATUS_FAILED
+
+TRANSITIONS = {
+    PENDING: {COMPLETE, FAILED},
+    FAILED: {PENDING, COMPLETE},
+    COMPLETE: set(),
+}
+
+# payment providers use words, we accept those as well as our own one letter codes
+PROVIDER_STATUSES = {
+    'pending': PENDING,
+    'complete': COMPLETE,
+    'completed': COMPLETE,
+    'paid': COMPLETE,
+    'failed': FAILED,
+    'declined': FAILED,
+    PENDING.lower(): PENDING,
+    COMPLETE.lower(): COMPLETE,
+    FAILED.lower(): FAILED,
+}
+
+
+class InvalidTransition(Exception):
+    pass
+
+
+def can_transition(source, target):
+    return target in TRANSITIONS.get(source, ())
+
+
+def sources_for(target):
+    if target not in TRANSITIONS:
+        raise InvalidTransition(f'unknown payment status {target!r}')
+    return [source for source, targets in TRANSITIONS.items() if target in targets]
+
+
+def transition(order_id, target, expected=None):
+    # moves one order to target and returns True, or returns False if the order wasn't in a state
+    # that allows it (including when another process changed it first).
+    # pass expected to only apply the change if the order is still in that exact state
+    sources = sources_for(target)
+    if expected is not None:
+        if not can_transition(expected, target):
+            raise InvalidTransition(f'cannot move a payment from {expected!r} to {target!r}')
+        sources = [expected]
+    return bulk_transition([order_id], target, sources) == 1
+
+
+def bulk_transition(order_ids, target, sources=None):
+    # returns the number of orders that were moved
+    orders = Order.objects.filter(pk__in=order_ids, payment_status__in=sources or sources_for(target))
+    return sum(orders.gather(lambda orders: orders.update(payment_status=target)).values())
+
+
+class ReconciliationResult:
+    def __init__(self):
+        self.records = 0
+        self.applied = 0  # orders whose status was changed
+        self.unchanged = 0  # already in the status the provider reports
+        self.rejected = 0  # the provider status isn't reachable from the current one (e.g complete -> failed)
+        self.conflicts = 0  # changed by someone else between our read and our update
+        self.unknown_orders = 0
+        self.invalid_records = 0  # bad order id or status in the file
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def parse_provider_record(record):
+    # record is a dict read from the provider file, returns (order_id, status) or None
+    try:
+        order_id = int(record['order_id'])
+        status = PROVIDER_STATUSES[record['status'].strip().lower()]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None
+    return order_id, status
+
+
+def reconcile(records, chunk_size=10000, dry_run=False):
+    # records is any iterable of dicts with order_id and status keys (e.g a csv.DictReader),
+    # it is consumed chunk by chunk so the provider file never has to fit in memory
+    result = ReconciliationResult()
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return result
+        result.records += len(chunk)
+        _reconcile_chunk(chunk, result, dry_run)
+
+
+def _reconcile_chunk(chunk, result, dry_run):
+    reported = {}
+    for record in chunk:
+        parsed = parse_provider_record(record)
+        if parsed is None:
+            result.invalid_records += 1
+            continue
+        order_id, status = parsed
+        reported[order_id] = status  # the last record for an order wins
+
+    current = {}
+    found = Order.objects.filter(pk__in=reported).gather(lambda orders: list(orders.values_list('id', 'payment_status')))
+    for statuses in found.values():
+        current.update(statuses)
+
+    by_target = {}
+    for order_id, status in reported.items():
+        source = current.get(order_id)
+        if source is None:
+            result.unknown_orders += 1
+        elif source == status:
+            result.unchanged += 1
+        elif not can_transition(source, status):
+            result.rejected += 1
+        else:
+            by_target.setdefault(status, []).append(order_id)
+
+    planned = sum(len(ids) for ids in by_target.values())
+    if dry_run:
+        result.applied += planned
+        return
+
+    # one conditional update per target status for the whole chunk, on every shard. the updates of a shard commit
+    # together, but every shard commits on its own: when one fails the others keep their changes. running the file
+    # again is safe, the orders already moved are counted as unchanged
+    def apply(alias):
+        with transaction.atomic(using=alias):
+            return sum(
+                Order.objects.using(alias).filter(pk__in=ids, payment_status__in=sources_for(target))
+                .update(payment_status=target)
+                for target, ids in by_target.items()
+            )
+
+    applied = sum(sharding.scatter(apply).values()) if by_target else 0
+    result.applied += applied
+    result.conflicts += planned - applied
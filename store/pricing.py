@@ -0,0 +1,25 @@
+# prices after promotions
+# Promotion.discount is the fraction taken off the unit price (0.15 is 15% off). a product with several
+# promotions gets the biggest discount, they don't add up
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Max
+
+from .models import Product
+
+CENT = Decimal('0.01')
+
+
+def apply_discount(unit_price, discount):
+    discount = min(max(discount or 0, 0), 1)
+    return (unit_price * (1 - Decimal(str(discount)))).quantize(CENT, ROUND_HALF_UP)
+
+
+def promotion_prices(product_ids):
+    # {product_id: price} of the products that exist, two queries however many products
+    unit_prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'unit_price'))
+    discounts = dict(
+        Product.promotions.through.objects.filter(product_id__in=unit_prices)
+        .values('product_id').annotate(discount=Max('promotion__discount')).values_list('product_id', 'discount')
+    )
+    return {pk: apply_discount(unit_price, discounts.get(pk)) for pk, unit_price in unit_prices.items()}
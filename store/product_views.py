@@ -0,0 +1,122 @@
+# product page views, counted without a database write per view
+# every process keeps a buffer {product_id: views} in memory. the buffer is written to ProductViewCount
+# (three statements whatever the number of products) when it's older than STORE_VIEW_FLUSH_INTERVAL seconds
+# or holds STORE_VIEW_FLUSH_MAX_PENDING products, and when the process exits.
+#   - gunicorn and runserver run atexit handlers when a worker stops, also on SIGTERM. a worker that is killed
+#     (SIGKILL, out of memory) loses the views of its last interval, which is fine for ranking
+#   - views of an idle worker are written on its next view or when it exits
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from .models import Product, ProductViewCount
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = getattr(settings, 'STORE_VIEW_FLUSH_INTERVAL', 30)
+FLUSH_MAX_PENDING = getattr(settings, 'STORE_VIEW_FLUSH_MAX_PENDING', 1000)
+
+
+def write(counts):
+    # adds counts {product_id: views} to the table. returns the number of views written
+    product_ids = sorted(Product.objects.filter(pk__in=counts).values_list('pk', flat=True))  # skips deleted products
+    if not product_ids:
+        return 0
+    # one WHEN per distinct count rather than per product, most products get one or two views per interval
+    by_count = {}
+    for product_id in product_ids:
+        by_count.setdefault(counts[product_id], []).append(product_id)
+    now = timezone.now()
+    with transaction.atomic():
+        ProductViewCount.objects.bulk_create(
+            [ProductViewCount(product_id=product_id, updated_at=now) for product_id in product_ids],
+            ignore_conflicts=True,  # rows of products viewed before are left alone
+        )
+        ProductViewCount.objects.filter(pk__in=product_ids).update(
+            views=Case(*[When(pk__in=ids, then=F('views') + count) for count, ids in by_count.items()]),
+            updated_at=now,
+        )
+    return sum(counts[product_id] for product_id in product_ids)
+
+
+class ViewBuffer:
+    def __init__(self, interval=FLUSH_INTERVAL, max_pending=FLUSH_MAX_PENDING):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._pid = os.getpid()
+
+    def add(self, product_id, views=1):
+        with self._lock:
+            if self._pid != os.getpid():
+                # a worker forked from the process that imported us, the views copied along aren't ours to write
+                self._pid = os.getpid()
+                self._counts = {}
+                self._last_flush = time.monotonic()
+            self._counts[product_id] = self._counts.get(product_id, 0) + views
+            due = len(self._counts) >= self.max_pending or time.monotonic() - self._last_flush >= self.interval
+        if due:
+            try:
+                self.flush()
+            except DatabaseError:
+                # the views went back into the buffer, the next flush tries again. the page view itself is fine
+                logger.exception('could not write product views')
+
+    def pending(self, product_id=None):
+        with self._lock:
+            return sum(self._counts.values()) if product_id is None else self._counts.get(product_id, 0)
+
+    def flush(self):
+        # writes the buffer, returns the number of views written. on failure the views are put back
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            self._last_flush = time.monotonic()
+        if not counts:
+            return 0
+        try:
+            return write(counts)
+        except Exception:
+            with self._lock:
+                for product_id, views in counts.items():
+                    self._counts[product_id] = self._counts.get(product_id, 0) + views
+            raise
+
+
+buffer = ViewBuffer()
+
+
+def record(product_id):
+    # called by the product page, a dict update unless the buffer is due
+    buffer.add(product_id)
+
+
+def _flush_at_exit():
+    try:
+        buffer.flush()
+    except Exception:
+        logger.exception('could not write product views at exit')
+
+
+atexit.register(_flush_at_exit)
+
+
+def views_of(product_id):
+    # the written views plus the ones still in this process' buffer
+    written = ProductViewCount.objects.filter(pk=product_id).values_list('views', flat=True).first() or 0
+    return written + buffer.pending(product_id)
+
+
+def most_viewed(limit=10):
+    return [
+        count.product
+        for count in ProductViewCount.objects.select_related('product').order_by('-views')[:limit]
+    ]
@@ -0,0 +1,100 @@
+# moves the orders of customers to the shard they belong to (see store/sharding.py), after shards were appended
+# to STORE_ORDER_SHARDS. jump hashing only moves customers to the shards that were added, about 1/n of them.
+# customers with orders on a shard they don't belong to are found a batch at a time by walking the distinct
+# customer ids of the shard's orders. every batch is moved in two transactions: the orders and items are copied
+# to their new shard with their ids, then deleted from the old one. the copy commits first, a batch that fails in
+# between is copied again by the next run (rows already there are skipped). until then its orders are on both
+# shards and reads gathering every shard count them twice, so rebalance when the shop is quiet.
+#
+# ids stay unique because each shard creates ids in its own range and the moved orders go to shards after theirs,
+# where the ids are below the range. moving orders the other way would push the new shard's id sequence into the
+# range of another shard, so shards can only be appended, never removed or reordered
+import time
+
+from django.db import transaction
+
+from . import sharding
+from .models import Order, OrderItem
+
+BATCH_SIZE = 1000
+
+
+class RebalanceError(Exception):
+    pass
+
+
+class RebalanceResult:
+    def __init__(self):
+        self.customers = 0
+        self.orders = 0
+        self.items = 0
+        self.batches = 0
+        self.elapsed = 0.0
+        self.moves = {}  # (from, to) -> customers
+
+    @property
+    def orders_per_second(self):
+        return self.orders / self.elapsed if self.elapsed else 0.0
+
+
+def misplaced_customers(alias, batch_size=BATCH_SIZE):
+    # yields {target: [customer ids]} for every batch of customers with orders on alias that belong on another shard
+    last = 0
+    while True:
+        customer_ids = list(
+            Order.objects.using(alias).filter(customer_id__gt=last)
+            .order_by('customer_id').values_list('customer_id', flat=True).distinct()[:batch_size]
+        )
+        if not customer_ids:
+            return
+        last = customer_ids[-1]
+        targets = {}
+        for customer_id in customer_ids:
+            target = sharding.shard_for(customer_id)
+            if target != alias:
+                targets.setdefault(target, []).append(customer_id)
+        if targets:
+            yield targets
+
+
+def move_customers(customer_ids, source, target, batch_size=BATCH_SIZE):
+    # copies the customers' orders and items from source to target, then deletes them from source.
+    # returns (orders, items) moved
+    with transaction.atomic(using=source):
+        orders = list(Order.objects.using(source).select_for_update().filter(customer_id__in=customer_ids))
+        order_ids = [order.pk for order in orders]
+        items = list(OrderItem.objects.using(source).filter(order_id__in=order_ids))
+        limit = sharding.first_id(target)
+        if any(pk >= limit for pk in order_ids + [item.pk for item in items]):
+            raise RebalanceError(f'orders on {source} have ids past the start of the id range of {target}')
+        placed_at = {order.pk: order.placed_at for order in orders}
+        with transaction.atomic(using=target):
+            Order.objects.using(target).bulk_create(orders, batch_size=batch_size, ignore_conflicts=True)
+            # bulk_create gave them the time of now (auto_now_add), put back when they were placed
+            for order in orders:
+                order.placed_at = placed_at[order.pk]
+            Order.objects.using(target).bulk_update(orders, ['placed_at'], batch_size=batch_size)
+            OrderItem.objects.using(target).bulk_create(items, batch_size=batch_size, ignore_conflicts=True)
+        OrderItem.objects.using(source).filter(order_id__in=order_ids).delete()
+        Order.objects.using(source).filter(pk__in=order_ids).delete()
+    return len(orders), len(items)
+
+
+def rebalance(batch_size=BATCH_SIZE, pause=0.0, dry_run=False):
+    # a dry run only counts the customers that would move
+    result = RebalanceResult()
+    start = time.perf_counter()
+    for source in sharding.SHARDS:
+        for targets in misplaced_customers(source, batch_size):
+            for target, customer_ids in targets.items():
+                if not dry_run:
+                    orders, items = move_customers(customer_ids, source, target, batch_size)
+                    result.orders += orders
+                    result.items += items
+                result.customers += len(customer_ids)
+                result.moves[source, target] = result.moves.get((source, target), 0) + len(customer_ids)
+            result.batches += 1
+            if pause and not dry_run:
+                time.sleep(pause)
+    result.elapsed = time.perf_counter() - start
+    return result
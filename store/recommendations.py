@@ -0,0 +1,235 @@
+# "frequently bought together" recommendations built from OrderItem co-occurrence
+# we stream (order_id, product_id) pairs ordered by order, turn every order into a basket of distinct products
+# and count how many baskets contain each pair of products. the counts form a sparse product x product matrix:
+# with numpy it is kept as an (n, 2) array of product id pairs reduced with np.unique, without numpy we fall back
+# to a Counter of pairs. only the top_k neighbours of every product end up in ProductRecommendation.
+#
+# a full build recounts every order. an incremental build only counts orders placed since the last run
+# and adds those counts to the stored scores of the products involved. pairs that never made a product's
+# top_k aren't stored, so incremental builds are an approximation: run a full build now and then.
+# with orders on several shards (see store/sharding.py) the baskets of every shard are counted one shard after the
+# other. order ids only grow within each shard's range, so every run remembers the last order id of every shard.
+# a shard the last run didn't know starts at its id range: the orders rebalance moved there have lower ids and were
+# counted on their old shard already (those moved before they were counted wait for the next full build)
+# full builds count the archived orders too (see store/archive.py), incremental builds only see new orders,
+# which are never in the archive yet
+import heapq
+import time
+from collections import Counter, defaultdict
+from itertools import chain, combinations
+
+from django.conf import settings
+from django.db import transaction
+
+from . import sharding
+from .models import ArchivedOrderItem, OrderItem, ProductRecommendation, RecommendationRun
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, the pure python counter gives the same results
+    np = None
+
+TOP_K = getattr(settings, 'STORE_RECOMMENDATIONS_TOP_K', 10)
+# a basket with n products has n * (n - 1) / 2 pairs, huge (wholesale) orders say little about what goes together
+MAX_BASKET_SIZE = 50
+CHUNK_SIZE = 10000
+MAX_CODE_SPAN = 3037000499  # the largest span with span ** 2 below 2 ** 63, see NumpyCounter._fold
+
+
+def stream_baskets(since_order_id=0, chunk_size=CHUNK_SIZE, shard='default', model=OrderItem):
+    # yields the sorted, distinct product ids of every order after since_order_id, plus the last order id seen.
+    # model is ArchivedOrderItem for the baskets of the archived orders
+    items = model.objects.using(shard).filter(order_id__gt=since_order_id) \
+        .order_by('order_id') \
+        .values_list('order_id', 'product_id') \
+        .iterator(chunk_size=chunk_size)
+    current, basket = None, set()
+    for order_id, product_id in items:
+        if order_id != current:
+            if len(basket) > 1:
+                yield current, sorted(basket)
+            current, basket = order_id, set()
+        basket.add(product_id)
+    if len(basket) > 1:
+        yield current, sorted(basket)
+
+
+class PythonCounter:
+    def __init__(self):
+        self.counts = Counter()
+
+    def add(self, basket):
+        self.counts.update(combinations(basket, 2))
+
+    def pairs(self):
+        # yields (a, b, count) with a < b
+        for (a, b), count in self.counts.items():
+            yield a, b, count
+
+    def top_k(self, k):
+        neighbours = defaultdict(list)
+        for a, b, count in self.pairs():
+            neighbours[a].append((count, -b, b))
+            neighbours[b].append((count, -a, a))
+        return {
+            product: [(other, count) for count, _, other in heapq.nlargest(k, candidates)]
+            for product, candidates in neighbours.items()
+        }
+
+
+class NumpyCounter:
+    # pairs are buffered flat in a python list and folded into (pairs, counts) arrays every flush_every pairs,
+    # so memory is bounded by the number of distinct pairs rather than the number of baskets.
+    # the pairs are kept as two int64 columns, product ids are big integers and can pass 2 ** 31
+    flush_every = 2000000
+
+    def __init__(self):
+        self.keys = np.empty((0, 2), dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.pending = []
+
+    def add(self, basket):
+        self.pending.extend(chain.from_iterable(combinations(basket, 2)))
+        if len(self.pending) >= 2 * self.flush_every:
+            self._fold()
+
+    def _fold(self):
+        if not self.pending:
+            return
+        pairs = np.fromiter(self.pending, dtype=np.int64).reshape(-1, 2)
+        keys = np.concatenate([self.keys, pairs])
+        counts = np.concatenate([self.counts, np.ones(len(pairs), dtype=np.int64)])
+        # every pair is reduced to one int64 code (a - low) * span + (b - low) for np.unique, sorting one column
+        # is several times faster than sorting rows. when the ids are too far apart for that the ids are replaced
+        # by their rank among the ids first
+        low, span, ids = int(keys.min()), int(keys.max() - keys.min()) + 1, None
+        if span > MAX_CODE_SPAN:
+            ids, keys = np.unique(keys, return_inverse=True)
+            keys, low, span = keys.reshape(-1, 2), 0, len(ids)
+        codes, inverse = np.unique((keys[:, 0] - low) * span + (keys[:, 1] - low), return_inverse=True)
+        self.counts = np.bincount(inverse.reshape(-1), weights=counts, minlength=len(codes)).astype(np.int64)
+        a, b = codes // span + low, codes % span + low
+        self.keys = np.stack([a, b] if ids is None else [ids[a], ids[b]], axis=1)
+        self.pending = []
+
+    def pairs(self):
+        self._fold()
+        for (a, b), count in zip(self.keys.tolist(), self.counts.tolist()):
+            yield a, b, count
+
+    def top_k(self, k):
+        self._fold()
+        if not len(self.keys):
+            return {}
+        a, b = self.keys[:, 0], self.keys[:, 1]
+        # both directions of every pair, sorted by product then best score first (ties by lower id)
+        products = np.concatenate([a, b])
+        others = np.concatenate([b, a])
+        counts = np.concatenate([self.counts, self.counts])
+        order = np.lexsort((others, -counts, products))
+        products, others, counts = products[order], others[order], counts[order]
+        # rank of every row within its product, keep the first k
+        starts = np.flatnonzero(np.r_[True, products[1:] != products[:-1]])
+        lengths = np.diff(np.r_[starts, len(products)])
+        ranks = np.arange(len(products)) - np.repeat(starts, lengths)
+        keep = ranks < k
+        result = defaultdict(list)
+        for product, other, count in zip(products[keep].tolist(), others[keep].tolist(), counts[keep].tolist()):
+            result[product].append((other, count))
+        return result
+
+
+def new_counter():
+    return NumpyCounter() if np is not None else PythonCounter()
+
+
+class BuildResult:
+    def __init__(self, full):
+        self.full = full
+        self.orders = 0
+        self.products = 0
+        self.rows = 0
+        self.elapsed = 0.0
+
+
+def count_baskets(since, counter, chunk_size=CHUNK_SIZE, archived=False):
+    # since is {shard: last order id counted}, shards missing from it are counted from the start of their id range.
+    # returns (number of orders counted, {shard: last order id}). archived also counts the orders in the archive,
+    # an order archive_orders copied but failed to delete from its shard is counted twice until it runs again
+    orders, last_order_ids = 0, {}
+    for shard in sharding.SHARDS:
+        start = since.get(shard, sharding.first_id(shard) - 1)
+        last_order_ids[shard] = max(start, sharding.first_id(shard) - 1)
+        for order_id, basket in stream_baskets(start, chunk_size, shard):
+            counter.add(basket[:MAX_BASKET_SIZE])
+            orders += 1
+            last_order_ids[shard] = max(last_order_ids[shard], order_id)
+    if archived:
+        for _, basket in stream_baskets(0, chunk_size, 'default', ArchivedOrderItem):
+            counter.add(basket[:MAX_BASKET_SIZE])
+            orders += 1
+    return orders, last_order_ids
+
+
+def _write(top, products=None, batch_size=5000):
+    # replaces the recommendations of `products` (every product when None) with top
+    rows = [
+        ProductRecommendation(product_id=product, recommended_id=other, score=count)
+        for product, neighbours in top.items()
+        for other, count in neighbours
+    ]
+    with transaction.atomic():
+        existing = ProductRecommendation.objects.all()
+        if products is not None:
+            existing = existing.filter(product_id__in=products)
+        existing.delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
+
+
+def build_recommendations(full=False, top_k=TOP_K, chunk_size=CHUNK_SIZE):
+    start = time.perf_counter()
+    last_run = RecommendationRun.objects.order_by('-pk').first()
+    # runs from before the last order ids were kept per shard don't say where to start on every shard
+    full = full or last_run is None or not last_run.last_order_ids
+    since = {shard: 0 for shard in sharding.SHARDS} if full else last_run.last_order_ids
+    result = BuildResult(full)
+
+    counter = new_counter()
+    result.orders, last_order_ids = count_baskets(since, counter, chunk_size, archived=full)
+    if full:
+        top = counter.top_k(top_k)
+        result.rows = _write(top)
+    elif result.orders:
+        # add the new counts to what is stored for every product those orders touched
+        scores = defaultdict(Counter)
+        for a, b, count in counter.pairs():
+            scores[a][b] += count
+            scores[b][a] += count
+        stored = ProductRecommendation.objects.filter(product_id__in=scores) \
+            .values_list('product_id', 'recommended_id', 'score')
+        for product, other, score in stored.iterator(chunk_size=chunk_size):
+            scores[product][other] += score
+        top = {
+            product: heapq.nsmallest(top_k, neighbours.items(), key=lambda pair: (-pair[1], pair[0]))
+            for product, neighbours in scores.items()
+        }
+        result.rows = _write(top, products=list(scores))
+    else:
+        top = {}
+
+    result.products = len(top)
+    RecommendationRun.objects.create(
+        last_order_id=max(last_order_ids.values()), last_order_ids=last_order_ids, full=full
+    )
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def recommendations_for(product_id, limit=TOP_K):
+    # a single query on the (product, -score) index
+    return list(
+        ProductRecommendation.objects.filter(product_id=product_id)
+        .select_related('recommended')
+        .order_by('-score', 'recommended_id')[:limit]
+    )
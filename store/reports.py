@@ -0,0 +1,351 @@
+# named, parameterized raw sql reports for analysts
+# a report is plain sql with %(name)s placeholders, registered once in REPORTS at the bottom of this module.
+# running one skips the orm entirely: rows come straight off the cursor with fetchmany, through a server side
+# (postgresql) or unbuffered (mysql) cursor, so a report over millions of rows streams in constant memory.
+#   - results small enough (STORE_REPORT_CACHE_MAX_ROWS) are cached per parameters for the report's timeout
+#   - every run is recorded in ReportRun with its row count and how long it took
+# with orders on several shards (see store/sharding.py) the order reports are ShardedReports instead: their sql runs
+# on every shard at once and the partial results are merged in python, see the bottom of this module.
+# the order reports cover the archived orders too (see store/archive.py)
+import hashlib
+import json
+import time
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+
+from . import sharding
+from .metrics import cache_lookup
+from .models import Customer, Product, ReportRun
+
+CHUNK_SIZE = 2000
+CACHE_TIMEOUT = getattr(settings, 'STORE_REPORT_CACHE_TIMEOUT', 300)
+CACHE_MAX_ROWS = getattr(settings, 'STORE_REPORT_CACHE_MAX_ROWS', 10000)
+
+
+class ReportError(Exception):
+    pass
+
+
+class Param:
+    def __init__(self, name, convert=str, default=None):
+        self.name = name
+        self.convert = convert  # turns the string from the query string into the value passed to the database
+        self.default = default
+
+
+class Report:
+    def __init__(self, name, sql, params=(), description='', timeout=CACHE_TIMEOUT):
+        self.name = name
+        self.sql = sql
+        self.params = list(params)
+        self.description = description
+        self.timeout = timeout
+
+    def clean(self, data):
+        # data is a dict of strings (e.g request.GET), returns the converted parameters
+        cleaned = {}
+        for param in self.params:
+            value = data.get(param.name)
+            if value in (None, ''):
+                if param.default is None:
+                    raise ReportError(f'{param.name} is required')
+                value = param.default() if callable(param.default) else param.default
+                cleaned[param.name] = value
+                continue
+            try:
+                cleaned[param.name] = param.convert(value)
+            except (TypeError, ValueError, InvalidOperation):
+                raise ReportError(f'{param.name} is not valid')
+        return cleaned
+
+    def cache_key(self, params):
+        encoded = json.dumps(sorted(params.items()), default=str)
+        return f'report:{self.name}:' + hashlib.md5(encoded.encode()).hexdigest()
+
+
+class ShardedReport(Report):
+    # sql that only reads store_order and store_orderitem, the tables every shard has, run on all of them.
+    # archive_sql returns the same columns from the archive tables of the default database, its rows are merged
+    # like another shard's. merge(rows of every shard, params) returns the rows of the report, columns are their names
+    def __init__(self, name, sql, merge, columns, params=(), description='', timeout=CACHE_TIMEOUT, archive_sql=None):
+        super().__init__(name, sql, params, description, timeout)
+        self.merge = merge
+        self.columns = columns
+        self.archive_sql = archive_sql
+
+    def gather(self, params):
+        def fetch(alias, sql=self.sql):
+            with connections[alias].cursor() as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+        shard_rows = list(sharding.scatter(fetch).values())
+        if self.archive_sql:
+            shard_rows.append(fetch('default', self.archive_sql))
+        return self.merge(shard_rows, params)
+
+
+REPORTS = {}
+
+
+def register(report):
+    REPORTS[report.name] = report
+    return report
+
+
+def get_report(name):
+    try:
+        return REPORTS[name]
+    except KeyError:
+        raise ReportError(f'no report named {name}')
+
+
+def _streaming_cursor():
+    # a cursor that doesn't load the whole result into memory when the query runs
+    if connection.vendor == 'mysql':
+        # mysqlclient buffers every row on the client unless it is given an unbuffered cursor class
+        from MySQLdb.cursors import SSCursor
+        connection.ensure_connection()
+        return connection.connection.cursor(SSCursor)
+    # a named (server side) cursor on postgresql, sqlite reads rows lazily anyway
+    return connection.chunked_cursor()
+
+
+def _record(report, params, rows, seconds, from_cache):
+    ReportRun.objects.create(
+        name=report.name,
+        params={name: str(value) for name, value in params.items()},
+        rows=rows,
+        seconds=seconds,
+        from_cache=from_cache,
+    )
+
+
+def _stream(report, params, cursor, columns, key, start, chunk_size):
+    kept = []  # the rows so far, as long as they fit in the cache
+    count = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            count += len(rows)
+            if kept is not None and count <= CACHE_MAX_ROWS:
+                kept.extend(rows)
+            else:
+                kept = None
+            yield from rows
+    finally:
+        cursor.close()
+    # only reached when the whole result was read
+    if kept is not None:
+        cache.set(key, (columns, kept), report.timeout)
+    _record(report, params, count, time.perf_counter() - start, False)
+
+
+def _cached(report, params, rows, start, from_cache=True):
+    yield from rows
+    _record(report, params, len(rows), time.perf_counter() - start, from_cache)
+
+
+def run_report(report, params, chunk_size=CHUNK_SIZE):
+    # returns (column names, iterator over the rows as tuples). the query runs right away,
+    # the rows are fetched as the iterator is consumed
+    start = time.perf_counter()
+    key = report.cache_key(params)
+    cached = cache.get(key)
+    cache_lookup('reports', cached is not None)
+    if cached is not None:
+        columns, rows = cached
+        return columns, _cached(report, params, rows, start)
+    if isinstance(report, ShardedReport):
+        # merged in memory, the rows are aggregates of the shards' rows
+        rows = report.gather(params)
+        if len(rows) <= CACHE_MAX_ROWS:
+            cache.set(key, (report.columns, rows), report.timeout)
+        return report.columns, _cached(report, params, rows, start, from_cache=False)
+    cursor = _streaming_cursor()
+    try:
+        cursor.execute(report.sql, params)
+    except Exception:
+        cursor.close()
+        raise
+    columns = [column[0] for column in cursor.description]
+    return columns, _stream(report, params, cursor, columns, key, start, chunk_size)
+
+
+def _date(value):
+    return date.fromisoformat(value)
+
+
+def _first_of_month():
+    return date.today().replace(day=1)
+
+
+def _tomorrow():
+    # end is exclusive, today's orders are included by default
+    return date.today() + timedelta(days=1)
+
+
+# the reports. placeholders are %(name)s, named after the report's params.
+# amounts are summed in sql and dates are compared as half open ranges [start, end)
+
+def _order_lines(columns, where, archived=False):
+    # a select of the items of the orders matching where, aliased oi and o, from the hot or the archive tables.
+    # the order reports sum the lines of both, each half filtered on its own indexes. an order is in one of
+    # them, except for a batch archive_orders copied but failed to delete, until it runs again
+    items, orders = ('store_archivedorderitem', 'store_archivedorder') if archived else ('store_orderitem', 'store_order')
+    return f'''
+        SELECT {columns}
+        FROM {items} oi
+        JOIN {orders} o ON o.id = oi.order_id
+        WHERE {where}'''
+
+
+def _all_order_lines(columns, where):
+    return _order_lines(columns, where) + '\n        UNION ALL' + _order_lines(columns, where, archived=True)
+
+
+COMPLETED = "o.payment_status = 'C'"
+COMPLETED_BETWEEN = "o.payment_status = 'C' AND o.placed_at >= %(start)s AND o.placed_at < %(end)s"
+
+register(Report(
+    'sales-by-product',
+    f'''
+    SELECT p.id, p.title, SUM(s.quantity) AS units, SUM(s.quantity * s.unit_price) AS revenue
+    FROM ({_all_order_lines('oi.product_id, oi.quantity, oi.unit_price', COMPLETED_BETWEEN)}
+    ) s
+    JOIN store_product p ON p.id = s.product_id
+    GROUP BY p.id, p.title
+    ORDER BY revenue DESC
+    ''',
+    params=[Param('start', _date, _first_of_month), Param('end', _date, _tomorrow)],
+    description='units sold and revenue per product for completed orders',
+))
+
+register(Report(
+    'daily-sales',
+    f'''
+    SELECT DATE(s.placed_at) AS day, COUNT(DISTINCT s.order_id) AS orders, SUM(s.quantity * s.unit_price) AS revenue
+    FROM ({_all_order_lines('o.id AS order_id, o.placed_at, oi.quantity, oi.unit_price', COMPLETED_BETWEEN)}
+    ) s
+    GROUP BY DATE(s.placed_at)
+    ORDER BY day
+    ''',
+    params=[Param('start', _date, _first_of_month), Param('end', _date, _tomorrow)],
+    description='completed orders and revenue per day',
+))
+
+register(Report(
+    'customer-spend',
+    f'''
+    SELECT c.id, c.first_name, c.last_name, c.email, c.membership,
+           COUNT(DISTINCT s.order_id) AS orders, SUM(s.quantity * s.unit_price) AS spent
+    FROM store_customer c
+    JOIN ({_all_order_lines('o.id AS order_id, o.customer_id, oi.quantity, oi.unit_price', COMPLETED)}
+    ) s ON s.customer_id = c.id
+    GROUP BY c.id, c.first_name, c.last_name, c.email, c.membership
+    HAVING SUM(s.quantity * s.unit_price) >= %(min_spent)s
+    ORDER BY spent DESC
+    ''',
+    params=[Param('min_spent', Decimal, 0)],
+    description='customers who spent at least min_spent on completed orders',
+))
+
+register(Report(
+    'low-inventory',
+    '''
+    SELECT p.id, p.title, p.inventory, c.title AS collection
+    FROM store_product p
+    JOIN store_collection c ON c.id = p.collection_id
+    WHERE p.inventory < %(below)s
+    ORDER BY p.inventory, p.id
+    ''',
+    params=[Param('below', int, 10)],
+    description='products with less than `below` units in stock',
+))
+
+
+# the order reports above join the products and customers, which aren't on the other shards. when orders are
+# sharded they are replaced by reports summing on every shard and on the archive tables, the names of products and
+# customers are read from the default database afterwards. a customer's orders can be on their shard and in the
+# archive, so min_spent is applied to the merged sums
+
+def _sum_rows(shard_rows, width):
+    # {key: [sums]} of rows (key, value, ...) from every shard
+    totals = {}
+    for rows in shard_rows:
+        for key, *values in rows:
+            sums = totals.setdefault(key, [0] * width)
+            for index, value in enumerate(values):
+                sums[index] += value or 0
+    return totals
+
+
+def _merge_sales_by_product(shard_rows, params):
+    totals = _sum_rows(shard_rows, 2)
+    titles = dict(Product.objects.filter(pk__in=totals).values_list('pk', 'title'))
+    rows = [(pk, titles.get(pk), units, revenue) for pk, (units, revenue) in totals.items()]
+    return sorted(rows, key=lambda row: row[3], reverse=True)
+
+
+def _merge_daily_sales(shard_rows, params):
+    return sorted((day, orders, revenue) for day, (orders, revenue) in _sum_rows(shard_rows, 2).items())
+
+
+def _merge_customer_spend(shard_rows, params):
+    totals = {pk: sums for pk, sums in _sum_rows(shard_rows, 2).items() if sums[1] >= params['min_spent']}
+    customers = Customer.objects.filter(pk__in=totals).in_bulk()
+    rows = [
+        (pk, customer.first_name, customer.last_name, customer.email, customer.membership, orders, spent)
+        for pk, (orders, spent) in totals.items()
+        if (customer := customers.get(pk)) is not None
+    ]
+    return sorted(rows, key=lambda row: row[6], reverse=True)
+
+
+def _grouped(columns, line_columns, where, group_by, archived=False):
+    return f'''
+        SELECT {columns}
+        FROM ({_order_lines(line_columns, where, archived)}
+        ) s
+        GROUP BY {group_by}
+        '''
+
+
+def _sharded(name, columns, line_columns, where, group_by, merge, report_columns):
+    # a ShardedReport with the same sql grouped on the hot tables of every shard and on the archive
+    report = REPORTS[name]
+    return ShardedReport(
+        name,
+        _grouped(columns, line_columns, where, group_by),
+        merge,
+        report_columns,
+        params=report.params,
+        description=report.description,
+        archive_sql=_grouped(columns, line_columns, where, group_by, archived=True),
+    )
+
+
+if sharding.is_sharded():
+    register(_sharded(
+        'sales-by-product',
+        's.product_id, SUM(s.quantity) AS units, SUM(s.quantity * s.unit_price) AS revenue',
+        'oi.product_id, oi.quantity, oi.unit_price', COMPLETED_BETWEEN, 's.product_id',
+        _merge_sales_by_product, ['id', 'title', 'units', 'revenue'],
+    ))
+    register(_sharded(
+        'daily-sales',
+        'DATE(s.placed_at) AS day, COUNT(DISTINCT s.order_id) AS orders, SUM(s.quantity * s.unit_price) AS revenue',
+        'o.id AS order_id, o.placed_at, oi.quantity, oi.unit_price', COMPLETED_BETWEEN, 'DATE(s.placed_at)',
+        _merge_daily_sales, ['day', 'orders', 'revenue'],
+    ))
+    register(_sharded(
+        'customer-spend',
+        's.customer_id, COUNT(DISTINCT s.order_id) AS orders, SUM(s.quantity * s.unit_price) AS spent',
+        'o.id AS order_id, o.customer_id, oi.quantity, oi.unit_price', COMPLETED, 's.customer_id',
+        _merge_customer_spend, ['id', 'first_name', 'last_name', 'email', 'membership', 'orders', 'spent'],
+    ))
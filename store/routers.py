@@ -0,0 +1,46 @@
+# database router of the order shards (see store/sharding.py), listed in DATABASE_ROUTERS
+# orders and items go to the database of the instance they are read or saved through:
+#   - an order or item loaded from a shard stays there, its items (order.orderitem_set) are read from there too
+#   - a new order goes to the shard of its customer, a new item to the database of its order
+#   - customer.order_set reads the customer's shard
+# everything else, and querysets without an instance, use the default database
+from . import sharding
+
+ORDER_MODELS = {'store.order', 'store.orderitem'}
+
+
+class OrderShardRouter:
+    def _db_for(self, model, instance=None, **hints):
+        if not sharding.is_sharded():
+            return None
+        label = instance._meta.label_lower if instance is not None else None
+        if model._meta.label_lower not in ORDER_MODELS:
+            # order.customer or item.product, not the shard the order was loaded from
+            return 'default' if label in ORDER_MODELS else None
+        if instance is None:
+            return None
+        if label in ORDER_MODELS and instance._state.db is not None:
+            return instance._state.db
+        if label == 'store.order' and instance.customer_id is not None:
+            return sharding.shard_for(instance.customer_id)
+        if label == 'store.customer' and instance.pk is not None:
+            return sharding.shard_for(instance.pk)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # orders point at customers and products of the default database
+        if {obj1._meta.label_lower, obj2._meta.label_lower} & ORDER_MODELS:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # shards only have the order tables. RunPython and RunSQL (no model_name) are for the default database
+        if db != 'default' and db in sharding.SHARDS:
+            return app_label == 'store' and model_name in ('order', 'orderitem')
+        return None
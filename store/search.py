@@ -0,0 +1,28 @@
+# prefix search over normalized "shadow" columns
+# a search like title__icontains='cof' has to look at every row, and istartswith can't use an index
+# under every collation. instead, the models keep a normalized copy of the searchable text
+# (e.g Product.title_key, lowercased with collapsed whitespace) in an indexed column and we search it
+# with a range: key >= 'cof' AND key < 'cog'. every database answers that from the index.
+from django.db.models import Q
+
+
+def normalize(value):
+    return ' '.join((value or '').casefold().split())
+
+
+def split_email(email):
+    # returns the normalized (local part, domain) of an email address
+    value = normalize(email)
+    if '@' not in value:
+        return value, ''
+    local, _, domain = value.rpartition('@')
+    return local, domain
+
+
+def prefix_upper_bound(prefix):
+    # the smallest string that sorts after every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def prefix_filter(field, prefix):
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix_upper_bound(prefix)})
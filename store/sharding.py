@@ -0,0 +1,94 @@
+# orders and their items spread over several databases by customer
+# STORE_ORDER_SHARDS lists the database aliases holding Order/OrderItem. a customer's orders all live on
+# shard_for(customer_id), every other table stays on the default database. with a single shard (the default)
+# nothing changes.
+#   - the router (store/routers.py) sends orders and items to the shard of the instance they belong to.
+#     querysets without an instance go to the default database, so code reading orders either asks the
+#     customer's shard (Order.objects.for_customer()) or all of them at once with scatter()
+#     (Order.objects.gather() on a queryset, the sharded reports in store/reports.py)
+#   - ids must stay unique across shards, orders move between them. migrate --database <alias> starts the id
+#     sequences of the n-th shard at n * ID_SPAN (reserve_ids, connected to post_migrate in store/signals.py)
+#   - customers are hashed with jump consistent hashing: appending a shard to the list only moves about 1/n of
+#     the customers, all of them to the new shard. the rebalance_order_shards command moves them (store/rebalance.py)
+# shards can't have foreign keys to the customers and products of the default database, Order.customer and
+# OrderItem.product have no constraint, the signals check a customer or product has no orders before deleting it
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+SHARDS = list(getattr(settings, 'STORE_ORDER_SHARDS', None) or ['default'])
+ID_SPAN = 10 ** 12  # ids reserved for the orders (and items) created on each shard
+MAX_WORKERS = 16
+
+
+def jump_hash(key, buckets):
+    # Lamping and Veach, "A Fast, Minimal Memory, Consistent Hash Algorithm". a key only ever moves to the
+    # bucket that was added, when the number of buckets grows
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(customer_id, shards=None):
+    shards = shards or SHARDS
+    return shards[jump_hash(int(customer_id), len(shards))]
+
+
+def is_sharded():
+    return len(SHARDS) > 1
+
+
+def scatter(function, shards=None):
+    # calls function(alias) for every shard, each in its own thread, and returns {alias: result}.
+    # the threads have their own connections, so they don't see what the caller's transaction hasn't committed yet.
+    # with one shard function runs in the calling thread, inside its transaction
+    shards = list(shards or SHARDS)
+    if len(shards) == 1:
+        return {shards[0]: function(shards[0])}
+
+    def run(alias):
+        try:
+            return function(alias)
+        finally:
+            connections.close_all()  # only closes the connections this thread opened
+
+    with ThreadPoolExecutor(max_workers=min(len(shards), MAX_WORKERS)) as pool:
+        futures = {alias: pool.submit(run, alias) for alias in shards}
+    return {alias: future.result() for alias, future in futures.items()}
+
+
+def first_id(alias):
+    # where the ids of the orders created on the shard start
+    return SHARDS.index(alias) * ID_SPAN + 1
+
+
+def reserve_ids(alias, models):
+    # moves the id sequences of the models' tables on a shard to the shard's range, unless they are past it
+    if alias not in SHARDS or SHARDS.index(alias) == 0:
+        return
+    connection = connections[alias]
+    start = first_id(alias)
+    with connection.cursor() as cursor:
+        for model in models:
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                # tables with an AUTOINCREMENT key continue after sqlite_sequence.seq
+                cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, start - 1])
+                elif row[0] < start - 1:
+                    cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [start - 1, table])
+            elif connection.vendor == 'mysql':
+                # mysql never moves AUTO_INCREMENT below the highest id in the table
+                cursor.execute(f'ALTER TABLE {connection.ops.quote_name(table)} AUTO_INCREMENT = {start:d}')
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'SELECT setval(pg_get_serial_sequence(%s, %s), '
+                    f'GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)})))',
+                    [table, 'id', start - 1],
+                )
@@ -0,0 +1,174 @@
+# signal receivers of the store app, connected in StoreConfig.ready()
+from decimal import Decimal
+
+from django.db.models import ProtectedError
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import carts, catalog, collection_summaries, history, sharding, stock
+from .models import Collection, Customer, Order, OrderItem, Product, Promotion
+from .slugs import slug_cache
+
+
+@receiver(pre_save, sender=Product)
+def remember_old_values(sender, instance, raw=False, **kwargs):
+    # the values before the save, one query for the receivers below
+    if instance.pk and not raw:
+        old = Product.objects.filter(pk=instance.pk) \
+            .values_list('slug', 'collection_id', 'unit_price', 'inventory').first()
+        if old is not None:
+            instance._old_slug, instance._old_collection_id, instance._old_unit_price, instance._old_inventory = old
+
+
+@receiver(post_save, sender=Product)
+def evict_changed_slug(sender, instance, **kwargs):
+    slug_cache.evict(instance.slug, getattr(instance, '_old_slug', None))
+
+
+@receiver(post_delete, sender=Product)
+def evict_deleted_slug(sender, instance, **kwargs):
+    slug_cache.evict(instance.slug)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    catalog.invalidate_products([instance.pk])
+
+
+def _price_changed(instance):
+    # compared as decimals, the instance may hold the price as the string a form or a script assigned
+    old_price = getattr(instance, '_old_unit_price', None)
+    return old_price is not None and old_price != Decimal(str(instance.unit_price))
+
+
+def _prices_changed(product_ids):
+    # the price after promotions of these products changed: cached prices and open carts follow
+    product_ids = list(product_ids)
+    catalog.invalidate_products(product_ids)
+    carts.reprice_after_commit(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw and _price_changed(instance):
+        carts.reprice_after_commit([instance.pk])
+
+
+@receiver(post_save, sender=Promotion)
+def promotion_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        _prices_changed(instance.product_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Promotion)
+def remember_promoted_products(sender, instance, **kwargs):
+    instance._product_ids = list(instance.product_set.values_list('pk', flat=True))  # unlinked by the delete
+
+
+@receiver(post_delete, sender=Promotion)
+def promotion_deleted(sender, instance, **kwargs):
+    _prices_changed(getattr(instance, '_product_ids', []))
+
+
+@receiver(m2m_changed, sender=Product.promotions.through)
+def promotions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        _prices_changed(pk_set if reverse else [instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_product_ids = list(instance.product_set.values_list('pk', flat=True)) if reverse else [instance.pk]
+    elif action == 'post_clear':
+        _prices_changed(getattr(instance, '_cleared_product_ids', []))
+
+
+@receiver(post_save, sender=Product)
+def update_collection_summary(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_collection_id = getattr(instance, '_old_collection_id', None)
+    if created:
+        collection_summaries.product_added(instance.pk, instance.collection_id)
+    elif old_collection_id is not None and old_collection_id != instance.collection_id:
+        collection_summaries.product_moved(instance.pk, old_collection_id, instance.collection_id)
+
+
+@receiver(post_delete, sender=Product)
+def update_deleted_product_summary(sender, instance, **kwargs):
+    collection_summaries.product_removed(instance.collection_id)
+
+
+@receiver(post_save, sender=Product)
+def record_history(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        history.record(instance.pk, instance.unit_price, instance.inventory)
+        return
+    price_changed = _price_changed(instance)
+    inventory_changed = getattr(instance, '_old_inventory', None) not in (None, instance.inventory)
+    if price_changed or inventory_changed:
+        history.record(
+            instance.pk,
+            instance.unit_price if price_changed else None,
+            instance.inventory if inventory_changed else None,
+        )
+
+
+@receiver(post_save, sender=Product)
+def refresh_low_stock(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields and not {'inventory', 'low_stock_threshold', 'collection'} & set(update_fields)):
+        return
+    stock.refresh([instance.pk])
+
+
+@receiver(pre_save, sender=Collection)
+def remember_old_collection_values(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        old = Collection.objects.filter(pk=instance.pk).values_list('low_stock_threshold', 'title').first()
+        if old is not None:
+            instance._old_low_stock_threshold, instance._old_title = old
+
+
+@receiver(post_save, sender=Collection)
+def create_collection_summary(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        collection_summaries.collection_added(instance.pk)
+
+
+@receiver(post_save, sender=Collection)
+def refresh_collection_low_stock(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw and instance.low_stock_threshold != getattr(instance, '_old_low_stock_threshold', None):
+        stock.refresh_collection(instance.pk)
+
+
+@receiver(post_save, sender=Collection)
+def touch_renamed_collection_products(sender, instance, created, raw=False, **kwargs):
+    # the product feeds show the collection, last_update tells them which products to write again (see store/feeds.py)
+    if not created and not raw and getattr(instance, '_old_title', instance.title) != instance.title:
+        Product.objects.filter(collection_id=instance.pk).update(last_update=timezone.now())
+
+
+@receiver(post_migrate)
+def reserve_order_ids(sender, using, **kwargs):
+    # migrate --database <shard> starts the order ids of the shard in its own range (see store/sharding.py)
+    if sender.label == 'store':
+        sharding.reserve_ids(using, [Order, OrderItem])
+
+
+def _shards_have(queryset):
+    # the orders on the default database are protected by the foreign keys, the other shards are asked here
+    shards = [alias for alias in sharding.SHARDS if alias != 'default']
+    return shards and any(sharding.scatter(lambda alias: queryset.using(alias).exists(), shards).values())
+
+
+@receiver(pre_delete, sender=Customer)
+def protect_sharded_orders(sender, instance, **kwargs):
+    if _shards_have(Order.objects.filter(customer_id=instance.pk)):
+        raise ProtectedError(f'{instance} has orders on another database', set())
+
+
+@receiver(pre_delete, sender=Product)
+def protect_sharded_order_items(sender, instance, **kwargs):
+    if _shards_have(OrderItem.objects.filter(product_id=instance.pk)):
+        raise ProtectedError(f'{instance} is in orders on another database', set())
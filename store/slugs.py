@@ -0,0 +1,79 @@
+# resolving product slugs to primary keys
+# product pages are addressed by slug, but looking the product up by its primary key is cheaper
+# and lets us reuse whatever is cached per pk. so we keep a bounded, in-process LRU map of slug -> pk.
+# entries are evicted by the signals in store/signals.py when a product's slug changes or it is deleted.
+# those signals only reach the current process, so the product views double check the slug of what they load
+# (see resolve_product) and evict mappings that another process made stale
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .metrics import cache_lookup
+from .models import Product
+
+
+class SlugCache:
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, slug):
+        with self._lock:
+            pk = self._entries.get(slug)
+            if pk is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(slug)
+            self.hits += 1
+            return pk
+
+    def set(self, slug, pk):
+        with self._lock:
+            self._entries[slug] = pk
+            self._entries.move_to_end(slug)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)  # least recently used
+
+    def evict(self, *slugs):
+        with self._lock:
+            for slug in slugs:
+                self._entries.pop(slug, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+slug_cache = SlugCache(getattr(settings, 'STORE_SLUG_CACHE_SIZE', 100000))
+
+
+def resolve_slug(slug):
+    # returns the pk of the product with this slug or None
+    pk = slug_cache.get(slug)
+    cache_lookup('slugs', pk is not None)
+    if pk is None:
+        pk = Product.objects.filter(slug=slug).values_list('pk', flat=True).first()
+        if pk is not None:
+            slug_cache.set(slug, pk)
+    return pk
+
+
+def resolve_product(slug, queryset=None):
+    # returns the product with this slug or None, loaded by primary key
+    queryset = Product.objects.all() if queryset is None else queryset
+    pk = resolve_slug(slug)
+    if pk is None:
+        return None
+    product = queryset.filter(pk=pk).first()
+    if product is None or product.slug != slug:
+        # the mapping was stale (the slug was changed or the product deleted in another process)
+        slug_cache.evict(slug)
+        return queryset.filter(slug=slug).first()
+    return product
@@ -0,0 +1,78 @@
+# low stock detection
+# a product is low on stock when its inventory is below its threshold: the product's own low_stock_threshold,
+# else its collection's, else the STORE_LOW_STOCK_THRESHOLD setting.
+# the result is stored in Product.stock_status whenever inventory (or a threshold) changes, instead of being
+# computed when reading, so:
+#   - the "low" filter of the product admin reads an index instead of scanning every product
+#   - we know the moment a product crosses its threshold and queue one LowStockAlert for it
+# code that changes inventory calls refresh() with the changed products inside its transaction,
+# Product.save() is covered by a signal (store/signals.py) and checkout by place_order (store/carts.py)
+from django.conf import settings
+from django.db import transaction
+
+from .models import Collection, LowStockAlert, Product
+
+DEFAULT_THRESHOLD = getattr(settings, 'STORE_LOW_STOCK_THRESHOLD', 10)
+BATCH_SIZE = 1000
+
+
+def threshold_for(product_threshold, collection_threshold):
+    if product_threshold is not None:
+        return product_threshold
+    if collection_threshold is not None:
+        return collection_threshold
+    return DEFAULT_THRESHOLD
+
+
+def refresh(product_ids, batch_size=BATCH_SIZE):
+    # updates stock_status of the products and queues an alert for every product that just went low.
+    # the rows are locked while they are checked, so concurrent checkouts can't both alert for the same crossing.
+    # returns the number of alerts queued
+    product_ids = sorted(set(product_ids))  # lock in the same order as place_order
+    queued = 0
+    with transaction.atomic():
+        for start in range(0, len(product_ids), batch_size):
+            rows = list(
+                Product.objects.select_for_update()
+                .filter(pk__in=product_ids[start:start + batch_size])
+                .order_by('pk')
+                .values_list('pk', 'inventory', 'stock_status', 'low_stock_threshold', 'collection_id')
+            )
+            collection_thresholds = dict(
+                Collection.objects.filter(pk__in={row[4] for row in rows}).values_list('pk', 'low_stock_threshold')
+            )
+            went_low, restocked, alerts = [], [], []
+            for pk, inventory, status, product_threshold, collection_id in rows:
+                threshold = threshold_for(product_threshold, collection_thresholds.get(collection_id))
+                if inventory < threshold and status != Product.STOCK_LOW:
+                    went_low.append(pk)
+                    alerts.append(LowStockAlert(product_id=pk, inventory=inventory, threshold=threshold))
+                elif inventory >= threshold and status != Product.STOCK_OK:
+                    restocked.append(pk)
+            # update() rather than save(), these writes shouldn't fire the signals again
+            if went_low:
+                Product.objects.filter(pk__in=went_low).update(stock_status=Product.STOCK_LOW)
+            if restocked:
+                Product.objects.filter(pk__in=restocked).update(stock_status=Product.STOCK_OK)
+            LowStockAlert.objects.bulk_create(alerts)
+            queued += len(alerts)
+    return queued
+
+
+def refresh_collection(collection_id, batch_size=BATCH_SIZE):
+    # after the threshold of a collection changed
+    product_ids = list(Product.objects.filter(collection_id=collection_id).values_list('pk', flat=True))
+    return refresh(product_ids, batch_size)
+
+
+def low_stock_products():
+    # served by the (stock_status, inventory) index, lowest inventory first
+    return Product.objects.filter(stock_status=Product.STOCK_LOW).order_by('inventory')
+
+
+def pending_alerts(batch_size=BATCH_SIZE):
+    return list(
+        LowStockAlert.objects.filter(notified_at__isnull=True)
+        .select_related('product')
+        .order_by('pk')[:batch_size]
+    )
@@ -1,3 +1,277 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connections, transaction
+from django.test import SimpleTestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from . import archive, carts, outbox, payments, rebalance, recommendations, reports, sharding
+from .admin import OrderAdmin
+from .benchmarking import seed_customers, seed_orders, seed_products
+from .management.commands.audit_indexes import full_scans
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Cart, CartItem, Collection, Order, OrderItem, OutboxEvent, Product,
+    ProductRecommendation, RecommendationRun,
+)
 
 # Create your tests here.
+
+
+class FullScansTests(SimpleTestCase):
+    def test_sqlite_scan_of_a_table(self):
+        self.assertEqual(full_scans('3 0 0 SCAN store_product', 'sqlite'), ['store_product'])
+        self.assertEqual(full_scans('2 0 0 SCAN TABLE store_order', 'sqlite'), ['store_order'])
+
+    def test_sqlite_scan_using_an_index(self):
+        # the lookahead used to backtrack into the name and report a scan of "store_produc"
+        self.assertEqual(full_scans('3 0 0 SCAN store_product USING INDEX store_product_views_idx', 'sqlite'), [])
+        self.assertEqual(full_scans('3 0 0 SCAN store_product USING COVERING INDEX store_product_slug', 'sqlite'), [])
+
+    def test_sqlite_search(self):
+        self.assertEqual(full_scans('3 0 0 SEARCH store_product USING INTEGER PRIMARY KEY (rowid=?)', 'sqlite'), [])
+
+    def test_unknown_database(self):
+        self.assertIsNone(full_scans('anything', 'oracle'))
+
+
+@skipUnless(recommendations.np is not None, 'numpy is not installed')
+class NumpyCounterTests(SimpleTestCase):
+    def test_same_counts_as_the_python_counter(self):
+        # product ids past 2 ** 31 don't fit two to an int64, and ids too far apart to be coded from their span
+        for first, second, third, fourth in [(1, 2, 3, 4), (2 ** 31, 2 ** 31 + 1, 2 ** 31 + 2, 2 ** 31 + 3),
+                                             (10 ** 12, 10 ** 12 + 1, 10 ** 12 + 2, 10 ** 12 + 3),
+                                             (1, 2 ** 31, 10 ** 12, 10 ** 13)]:
+            baskets = [[first, second, third], [first, third], [second, third, fourth]]
+            numpy_counter, python_counter = recommendations.NumpyCounter(), recommendations.PythonCounter()
+            numpy_counter.flush_every = 2  # folds while counting
+            for basket in baskets:
+                numpy_counter.add(basket)
+                python_counter.add(basket)
+            self.assertEqual(sorted(numpy_counter.pairs()), sorted(python_counter.pairs()))
+            self.assertEqual(numpy_counter.top_k(2), python_counter.top_k(2))
+            self.assertEqual(numpy_counter.top_k(2)[first], [(third, 2), (second, 1)])
+
+
+class OutboxTests(TransactionTestCase):
+    def test_a_failed_event_rolls_the_save_back(self):
+        collection = Collection.objects.create(title='outbox')
+        with mock.patch.object(outbox, 'record', side_effect=DatabaseError('no outbox')):
+            with self.assertRaises(DatabaseError):
+                Product.objects.create(title='lost', unit_price=Decimal(10), inventory=1, collection=collection)
+        self.assertFalse(Product.objects.filter(title='lost').exists())
+
+    def test_save_records_an_event(self):
+        collection = Collection.objects.create(title='outbox')
+        self.assertTrue(OutboxEvent.objects.filter(model='store.collection', object_id=collection.pk).exists())
+
+
+class OrderAdminTests(TransactionTestCase):
+    databases = set(sharding.SHARDS)
+
+    def setUp(self):
+        user = get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(user)
+
+    def test_archived_orders_redirect(self):
+        customer_id = seed_customers(1)[0]
+        ArchivedOrder.objects.create(id=5, placed_at=timezone.now(), payment_status=Order.PAYMENT_STATUS_COMPLETE,
+                                     customer_id=customer_id)
+        with mock.patch.object(OrderAdmin, 'get_object', autospec=True, side_effect=OrderAdmin.get_object) as get_object:
+            response = self.client.get(reverse('admin:store_order_change', args=[5]))
+        self.assertRedirects(response, reverse('admin:store_archivedorder_change', args=[5]))
+        self.assertEqual(get_object.call_count, 1)
+
+    def test_orders_are_looked_up_once(self):
+        order_id = seed_orders(1, seed_customers(1), seed_products(1))[0]
+        with mock.patch.object(OrderAdmin, 'get_object', autospec=True, side_effect=OrderAdmin.get_object) as get_object:
+            response = self.client.get(reverse('admin:store_order_change', args=[order_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_object.call_count, 1)
+
+    def test_unknown_order_id(self):
+        response = self.client.get(reverse('admin:store_order_change', args=['abc']))
+        self.assertRedirects(response, reverse('admin:index'))
+
+
+class SweepCartsTests(TransactionTestCase):
+    def test_sweeps_expired_carts_across_id_gaps(self):
+        old = timezone.now() - timedelta(days=60)
+        expired = [Cart.objects.create(pk=pk) for pk in [1, 2, 10 ** 12, 10 ** 12 + 5]]
+        fresh = Cart.objects.create(pk=3)
+        Cart.objects.filter(pk__in=[cart.pk for cart in expired]).update(last_touched=old)
+        # 3 transactions with a select each, the last one finds nothing. the 2 batches load and delete their carts
+        with self.assertNumQueries(3 * 3 + 2 * 3):
+            result = carts.sweep_expired_carts(batch_size=2)
+        self.assertEqual((result.carts, result.batches), (4, 2))
+        self.assertEqual(list(Cart.objects.values_list('pk', flat=True)), [fresh.pk])
+
+
+class RepriceCartsTests(TransactionTestCase):
+    def test_carts_are_repriced_after_the_price_change_commits(self):
+        product_id = seed_products(1)[0]
+        cart = Cart.objects.create()
+        carts.add_item(cart.pk, product_id, 2)
+        product = Product.objects.get(pk=product_id)
+        with transaction.atomic():
+            product.unit_price = Decimal('5.00')
+            product.save()
+            # the cart items aren't locked by the save's transaction
+            self.assertEqual(CartItem.objects.get(cart=cart).unit_price, Decimal('10.00'))
+        self.assertEqual(CartItem.objects.get(cart=cart).unit_price, Decimal('5.00'))
+        self.assertEqual(Cart.objects.get(pk=cart.pk).total, Decimal('10.00'))
+
+
+@skipUnless(sharding.is_sharded(), 'run with storefront.test_settings, the orders need more than one shard')
+class ShardingTests(TransactionTestCase):
+    # scatter() reads the shards from other threads, which don't see the transaction of a TestCase
+    databases = set(sharding.SHARDS)
+
+    def setUp(self):
+        cache.clear()  # the reports are cached
+        self.product_ids = seed_products(3)
+        # a customer on every shard
+        self.customers = {}
+        for customer_id in seed_customers(50):
+            self.customers.setdefault(sharding.shard_for(customer_id), customer_id)
+        self.assertEqual(set(self.customers), set(sharding.SHARDS))
+
+    def checkout(self, customer_id, quantities):
+        cart = Cart.objects.create()
+        for product_id, quantity in quantities.items():
+            carts.add_item(cart.pk, product_id, quantity)
+        return carts.place_order(cart.pk, customer_id)
+
+    def test_checkout_writes_to_the_customers_shard(self):
+        for shard, customer_id in self.customers.items():
+            order = self.checkout(customer_id, {self.product_ids[0]: 1})
+            self.assertEqual(order._state.db, shard)
+            self.assertGreaterEqual(order.pk, sharding.first_id(shard))
+            for alias in sharding.SHARDS:
+                self.assertEqual(Order.objects.using(alias).filter(pk=order.pk).exists(), alias == shard)
+            self.assertEqual(OrderItem.objects.using(shard).filter(order_id=order.pk).count(), 1)
+
+    def test_failed_commit_leaves_the_cart_and_no_order(self):
+        # either database failing to commit: no order on the shard, the stock and the cart are left as they were
+        shard = sharding.SHARDS[1]
+        for alias in ['default', shard]:
+            cart = Cart.objects.create()
+            carts.add_item(cart.pk, self.product_ids[0], 2)
+            with mock.patch.object(connections[alias], 'commit', side_effect=DatabaseError('commit failed')):
+                with self.assertRaises(DatabaseError):
+                    carts.place_order(cart.pk, self.customers[shard])
+            self.assertFalse(Order.objects.using(shard).exists())
+            self.assertFalse(OrderItem.objects.using(shard).exists())
+            self.assertTrue(Cart.objects.filter(pk=cart.pk).exists())
+            self.assertEqual(Product.objects.get(pk=self.product_ids[0]).inventory, 100)
+
+    def test_get_order_and_customer_orders(self):
+        shard = sharding.SHARDS[1]
+        customer_id = self.customers[shard]
+        first = self.checkout(customer_id, {self.product_ids[0]: 1})
+        second = self.checkout(customer_id, {self.product_ids[1]: 2})
+
+        order = archive.get_order(second.pk)
+        self.assertEqual(order._state.db, shard)
+        self.assertEqual([item.quantity for item in archive.order_items(order)], [2])
+        self.assertEqual([order.pk for order in archive.customer_orders(customer_id)], [second.pk, first.pk])
+        self.assertEqual([order.pk for order in archive.customer_orders(customer_id, limit=1)], [second.pk])
+        with self.assertRaises(Order.DoesNotExist):
+            archive.get_order(second.pk + 1)
+
+        Order.objects.using(shard).filter(pk=first.pk).update(payment_status=Order.PAYMENT_STATUS_COMPLETE)
+        archive.archive_orders(timezone.now() + timedelta(seconds=1))
+        self.assertTrue(archive.is_archived(archive.get_order(first.pk)))
+        self.assertEqual([order.pk for order in archive.customer_orders(customer_id)], [second.pk, first.pk])
+
+    def test_failed_orders_stay_hot_and_are_restored(self):
+        shard = sharding.SHARDS[1]
+        customer_id = self.customers[shard]
+        failed = self.checkout(customer_id, {self.product_ids[0]: 1})
+        payments.bulk_transition([failed.pk], Order.PAYMENT_STATUS_FAILED)
+        archive.archive_orders(timezone.now() + timedelta(seconds=1))
+        self.assertFalse(archive.is_archived(archive.get_order(failed.pk)))
+
+        # a failed order archived by an earlier version
+        placed_at = timezone.now() - timedelta(days=800)
+        ArchivedOrder.objects.create(id=7, placed_at=placed_at, payment_status=Order.PAYMENT_STATUS_FAILED,
+                                     customer_id=customer_id)
+        ArchivedOrderItem.objects.create(id=9, order_id=7, product_id=self.product_ids[0], quantity=1,
+                                         unit_price=Decimal('10.00'), placed_at=placed_at)
+        result = archive.restore_orders(ArchivedOrder.objects.exclude(payment_status__in=archive.ARCHIVED_STATUSES))
+        self.assertEqual((result.orders, result.items), (1, 1))
+        order = archive.get_order(7)
+        self.assertEqual((order._state.db, order.placed_at), (shard, placed_at))
+        self.assertEqual([item.pk for item in archive.order_items(order)], [9])
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertTrue(payments.transition(7, Order.PAYMENT_STATUS_COMPLETE))  # the late payment applies
+
+    def test_bulk_transition_updates_every_shard(self):
+        order_ids = [self.checkout(customer_id, {self.product_ids[0]: 1}).pk for customer_id in self.customers.values()]
+        self.assertEqual(payments.bulk_transition(order_ids, Order.PAYMENT_STATUS_COMPLETE), len(order_ids))
+        statuses = Order.objects.filter(pk__in=order_ids).gather(
+            lambda orders: list(orders.values_list('payment_status', flat=True))
+        )
+        self.assertEqual(sorted(sum(statuses.values(), [])), [Order.PAYMENT_STATUS_COMPLETE] * len(order_ids))
+        # already complete, nothing to move
+        self.assertEqual(payments.bulk_transition(order_ids, Order.PAYMENT_STATUS_COMPLETE), 0)
+
+    def test_sharded_report_merges_the_shards_and_the_archive(self):
+        first, second, third = self.product_ids
+        orders = [
+            self.checkout(self.customers[sharding.SHARDS[0]], {first: 1, second: 2}),
+            self.checkout(self.customers[sharding.SHARDS[1]], {first: 3}),
+            self.checkout(self.customers[sharding.SHARDS[1]], {second: 1}),
+        ]
+        self.checkout(self.customers[sharding.SHARDS[0]], {third: 5})  # pending, not counted
+        payments.bulk_transition([order.pk for order in orders], Order.PAYMENT_STATUS_COMPLETE)
+        archive.archive_orders(timezone.now() + timedelta(seconds=1), max_batches=1)  # only the first shard's
+
+        report = reports.get_report('sales-by-product')
+        self.assertIsInstance(report, reports.ShardedReport)
+        columns, rows = reports.run_report(report, report.clean({}))
+        self.assertEqual(columns, ['id', 'title', 'units', 'revenue'])
+        units = {pk: units for pk, _, units, _ in rows}
+        self.assertEqual(units, {first: 4, second: 3})
+
+    def test_recommendations_build_incrementally_per_shard(self):
+        first, second, third = self.product_ids
+        for customer_id in self.customers.values():
+            self.checkout(customer_id, {first: 1, second: 1})
+        result = recommendations.build_recommendations()
+        self.assertEqual((result.full, result.orders), (True, 2))
+
+        shard = sharding.SHARDS[1]
+        order = self.checkout(self.customers[shard], {first: 1, third: 1})
+        result = recommendations.build_recommendations()
+        self.assertEqual((result.full, result.orders), (False, 1))
+        self.assertEqual(RecommendationRun.objects.order_by('-pk').first().last_order_ids[shard], order.pk)
+        scores = {
+            (row.product_id, row.recommended_id): row.score
+            for row in ProductRecommendation.objects.filter(product_id=first)
+        }
+        self.assertEqual(scores, {(first, second): 2, (first, third): 1})
+        self.assertEqual(recommendations.build_recommendations().orders, 0)
+
+    def test_rebalance_then_nothing_to_move(self):
+        # orders written to the first shard before the second one was added
+        shard = sharding.SHARDS[1]
+        customer_id = self.customers[shard]
+        order_ids = seed_orders(3, [customer_id], self.product_ids)
+        self.assertEqual(Order.objects.using(sharding.SHARDS[0]).filter(customer_id=customer_id).count(), 3)
+
+        result = rebalance.rebalance()
+        self.assertEqual((result.customers, result.orders, result.items), (1, 3, 6))
+        self.assertEqual(result.moves, {(sharding.SHARDS[0], shard): 1})
+        self.assertFalse(Order.objects.using(sharding.SHARDS[0]).filter(customer_id=customer_id).exists())
+        self.assertEqual(
+            sorted(Order.objects.for_customer(customer_id).filter(customer_id=customer_id).values_list('pk', flat=True)),
+            order_ids,
+        )
+        self.assertEqual(OrderItem.objects.using(shard).filter(order_id__in=order_ids).count(), 6)
+
+        result = rebalance.rebalance()
+        self.assertEqual((result.customers, result.orders, result.batches), (0, 0, 0))
@@ -0,0 +1,12 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('orders/ingest/', views.order_ingest, name='order-ingest'),
+    path('products/<slug:slug>/', views.product_detail, name='product-detail'),
+    path('products/<slug:slug>/recommendations/', views.product_recommendations, name='product-recommendations'),
+    path('collections/<int:pk>/', views.collection_detail, name='collection-detail'),
+    path('customers/lookup/', views.customer_lookup, name='customer-lookup'),
+    path('reports/', views.report_list, name='report-list'),
+    path('reports/<slug:name>/', views.report, name='report'),
+]
@@ -1,3 +1,189 @@
+import csv
+import hmac
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+
+from .customers import lookup_customers
+from .ingestion import IngestionError, ingest_orders
+from . import catalog, collection_summaries, product_views
+from . import metrics as store_metrics
+from .models import Product
+from .recommendations import recommendations_for
+from .reports import REPORTS, ReportError, get_report, run_report
+from .slugs import resolve_product, resolve_slug
 
 # Create your views here.
+
+
+def _has_ingest_token(request):
+    # partners authenticate with "Authorization: Token <STORE_INGEST_TOKEN>"
+    # if no token is configured the endpoint stays closed
+    expected = getattr(settings, 'STORE_INGEST_TOKEN', None)
+    if not expected:
+        return False
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return scheme == 'Token' and hmac.compare_digest(token.encode(), expected.encode())
+
+
+@csrf_exempt  # partners call this endpoint from their servers, there is no browser session (and so no csrf token)
+@require_POST
+def order_ingest(request):
+    if not _has_ingest_token(request):
+        return JsonResponse({'detail': 'invalid or missing token'}, status=401)
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'detail': 'body must be valid json'}, status=400)
+
+    # the body can either be the list of orders itself or {"orders": [...]}
+    rows = payload.get('orders') if isinstance(payload, dict) else payload
+    try:
+        result = ingest_orders(rows)
+    except IngestionError as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+    return JsonResponse(result.as_dict())
+
+
+@require_GET
+def product_detail(request, slug):
+    # the product is cached by pk (see store/catalog.py), the slug only picks the pk
+    pk = resolve_slug(slug)
+    data = catalog.product(pk) if pk is not None else None
+    if data is None or data['slug'] != slug:
+        # the slug -> pk mapping was stale, resolve_product fixes it
+        product = resolve_product(slug, Product.objects.select_related('collection'))
+        if product is None:
+            raise Http404('No product with this slug')
+        data = catalog.product_dict(product)
+    price = catalog.prices([data['id']]).get(data['id'])
+    product_views.record(data['id']) # counted in memory, written in batches
+    return JsonResponse({**data, 'price': str(price) if price is not None else data['unit_price']})
+
+
+@require_GET
+def collection_detail(request, pk):
+    # ?by=sales (default) or ?by=likes picks the top products. two queries however big the collection is
+    by = request.GET.get('by', 'sales')
+    if by not in collection_summaries.RANKINGS:
+        return JsonResponse({'detail': f'by must be one of {", ".join(collection_summaries.RANKINGS)}'}, status=400)
+    # cached without invalidation: counts and rankings change with every sale, a few minutes behind is fine
+    data = catalog.collection(pk, by)
+    if data is None:
+        raise Http404('No collection with this id')
+    return JsonResponse(data)
+
+
+@require_GET
+def product_recommendations(request, slug):
+    product_id = resolve_slug(slug)
+    if product_id is None:
+        raise Http404('No product with this slug')
+    return JsonResponse({'results': [
+        {
+            'id': recommendation.recommended_id,
+            'title': recommendation.recommended.title,
+            'slug': recommendation.recommended.slug,
+            'unit_price': str(recommendation.recommended.unit_price),
+            'score': recommendation.score,
+        }
+        for recommendation in recommendations_for(product_id)
+    ]})
+
+
+@require_GET
+def customer_lookup(request):
+    # customer data is personal, only staff can search it
+    if not request.user.is_staff:
+        return JsonResponse({'detail': 'staff only'}, status=403)
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 20)), 100))
+    except ValueError:
+        limit = 20
+    results = lookup_customers(request.GET.get('q', ''), limit=limit)
+    return JsonResponse({'results': [
+        {
+            'id': customer.id,
+            'first_name': customer.first_name,
+            'last_name': customer.last_name,
+            'email': customer.email,
+            'membership': customer.membership,
+        }
+        for customer in results
+    ]})
+
+
+@require_GET
+def report_list(request):
+    if not request.user.is_staff:
+        return JsonResponse({'detail': 'staff only'}, status=403)
+    return JsonResponse({'results': [
+        {'name': report.name, 'description': report.description, 'params': [param.name for param in report.params]}
+        for report in REPORTS.values()
+    ]})
+
+
+class _Echo:
+    # csv.writer writes into this and gets the line back, so rows can be streamed one by one
+    def write(self, value):
+        return value
+
+
+def _csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def _json_lines(columns, rows):
+    encoder = DjangoJSONEncoder()
+    yield '{"columns": %s, "rows": [' % encoder.encode(columns)
+    for index, row in enumerate(rows):
+        yield (',' if index else '') + encoder.encode(dict(zip(columns, row)))
+    yield ']}'
+
+
+@require_GET
+def report(request, name):
+    # streams a report from store/reports.py as csv (?format=csv, the default) or json (?format=json),
+    # the other query parameters are the report's parameters
+    if not request.user.is_staff:
+        return JsonResponse({'detail': 'staff only'}, status=403)
+    output = request.GET.get('format', 'csv')
+    if output not in ('csv', 'json'):
+        return JsonResponse({'detail': 'format must be csv or json'}, status=400)
+    try:
+        selected = get_report(name)
+    except ReportError:
+        raise Http404('No report with this name')
+    try:
+        params = selected.clean(request.GET)
+    except ReportError as error:
+        return JsonResponse({'detail': str(error)}, status=400)
+
+    columns, rows = run_report(selected, params)
+    if output == 'json':
+        return StreamingHttpResponse(_json_lines(columns, rows), content_type='application/json')
+    response = StreamingHttpResponse(_csv_lines(columns, rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{name}.csv"'
+    return response
+
+
+@require_GET
+def metrics(request):
+    # with STORE_METRICS_TOKEN set, scrapers send "Authorization: Bearer <token>".
+    # without one the metrics are only served in development (DEBUG)
+    expected = getattr(settings, 'STORE_METRICS_TOKEN', '')
+    if expected:
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip(), expected):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        return HttpResponse(status=404)
+    return HttpResponse(store_metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,10 +1,18 @@
 # this app we combine features from the two plugable apps , store and tags
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
 from django.contrib.contenttypes.admin import GenericTabularInline
+from django.db import transaction
 
+from store import outbox
 from store.admin import ProductAdmin
-from store.models import Product
-from tags.models import TaggedItem
+from store.autocomplete import PrefixSearchMixin
+from store.models import OutboxEvent, Product
+from tags.admin import TagAdmin
+from tags.models import Tag, TaggedItem, normalize_label
+
+from .catalog import invalidate_tags
 # Register your models here.
 
 # we can go about defining the features to be combined
@@ -14,10 +22,69 @@ class TagInline(GenericTabularInline):# generic inline to be used in the Product
     autocomplete_fields = ['tag']
     model = TaggedItem
 
+# the changelist shows the fields of the action form next to the actions dropdown,
+# so the tags to add or remove are typed there before running the action
+class TagActionForm(ActionForm):
+    tags = forms.CharField(required=False, help_text='comma separated tags, for the add/remove tags actions')
+
+
 # we then need to create a new product admin that inherits from the product admin imported into this module
 # in this new implementation we will reference the tag inline class created above
 class CustomProductAdmin(ProductAdmin): # creating new product admin
     inlines = [TagInline]
+    action_form = TagActionForm
+    actions = ProductAdmin.actions + ['add_tags', 'remove_tags']
+
+    def _tags(self, request):
+        labels = request.POST.get('tags', '').split(',')
+        if not any(label.strip() for label in labels):
+            self.message_user(request, 'Type the tags in the box next to the actions', messages.ERROR)
+            return None
+        return labels
+
+    @admin.action(description='Add tags')
+    def add_tags(self, request, queryset):
+        # a few queries per thousand products instead of one insert per product and tag
+        labels = self._tags(request)
+        if labels is None:
+            return
+        with transaction.atomic():
+            tags = Tag.objects.get_or_create_labels(labels)
+            created = TaggedItem.objects.tag_objects(tags, Product, queryset.values_list('pk', flat=True))
+            # bulk_create skips the signals that record catalog changes
+            outbox.record_bulk(TaggedItem, created, OutboxEvent.ACTION_CREATED)
+            invalidate_tags(queryset.values_list('pk', flat=True))
+        self.message_user(
+            request,
+            f'{len(created)} tags were added to {queryset.count()} products',
+            messages.SUCCESS
+        )
+
+    @admin.action(description='Remove tags')
+    def remove_tags(self, request, queryset):
+        labels = self._tags(request)
+        if labels is None:
+            return
+        tags = Tag.objects.filter(label_key__in=[normalize_label(label) for label in labels])
+        with transaction.atomic():
+            deleted = TaggedItem.objects.untag_objects(tags, Product, queryset.values_list('pk', flat=True))
+            # the raw deletes skip the signals that record catalog changes
+            outbox.record_bulk(TaggedItem, deleted, OutboxEvent.ACTION_DELETED)
+            invalidate_tags(queryset.values_list('pk', flat=True))
+        self.message_user(
+            request,
+            f'{len(deleted)} tags were removed from {queryset.count()} products',
+            messages.SUCCESS
+        )
 # we then tell django to unregister the old product admin and register the new one above
 admin.site.unregister(Product)
-admin.site.register(Product,CustomProductAdmin) # registering Product model with the new custom admin
\ No newline at end of file
+admin.site.register(Product,CustomProductAdmin) # registering Product model with the new custom admin
+
+
+# the tags app doesn't know about the store's prefix search, so we add it to the tag admin here
+# TagInline above autocompletes tags on every keystroke
+class CustomTagAdmin(PrefixSearchMixin, TagAdmin):
+    prefix_search_fields = ['label_key']
+
+admin.site.unregister(Tag)
+admin.site.register(Tag, CustomTagAdmin)
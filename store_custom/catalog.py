@@ -0,0 +1,35 @@
+# cached tag lists of products, next to the store's cached catalog reads (store/catalog.py)
+# invalidated by the receivers in store_custom/signals.py and the bulk tag actions of the product admin
+from store import caching
+from store.models import Product
+from tags.models import TaggedItem
+
+
+def tags_key(product_id):
+    return f'tags:{product_id}'
+
+
+def load_product_tags(product_id):
+    return sorted(item.tag.label for item in TaggedItem.objects.get_tags_for(Product, product_id))
+
+
+def product_tags(product_id):
+    return caching.get_or_compute(tags_key(product_id), lambda: load_product_tags(product_id), name='tags')
+
+
+def warm_tags(product_ids):
+    # fills the tag lists of a batch of products in one query, returns how many were filled
+    keys = {tags_key(pk): pk for pk in product_ids}
+    missing = [keys[key] for key in caching.missing(list(keys))]
+    if not missing:
+        return 0
+    labels = {pk: [] for pk in missing}
+    for item in TaggedItem.objects.get_tags_for_many(Product, missing):
+        labels[item.object_id].append(item.tag.label)
+    caching.set_many({tags_key(pk): sorted(tags) for pk, tags in labels.items()})
+    return len(labels)
+
+
+def invalidate_tags(product_ids):
+    if product_ids:
+        caching.invalidate(*[tags_key(pk) for pk in product_ids])
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store_custom.signals import rebuild_product_likes
+
+
+class Command(BaseCommand):
+    help = 'Recounts the likes behind the "most liked" lists of the collection pages'
+
+    def handle(self, *args, **options):
+        rebuild_product_likes()
+        self.stdout.write(self.style.SUCCESS('recounted the likes of every product'))
@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from store import catalog
+from store.models import Product
+from store_custom.catalog import warm_tags
+
+
+class Command(BaseCommand):
+    help = 'Fills the catalog caches with the most sold and viewed products, e.g after a deploy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=7, help='sales and views of the last days rank the products')
+        parser.add_argument('--limit', type=int, default=5000, help='how many products to warm')
+        parser.add_argument('--view-weight', type=float, default=0.1, help='what a view is worth against a unit sold')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        product_ids = catalog.hot_products(options['days'], options['limit'], options['view_weight'])
+        collection_ids = sorted(set(
+            Product.objects.filter(pk__in=product_ids).values_list('collection_id', flat=True)
+        ))
+        self.stdout.write(f'{len(product_ids)} hot products in {len(collection_ids)} collections')
+
+        # the hottest products come first, so they are cached first
+        size = options['batch_size']
+        tasks = []
+        for begin in range(0, len(product_ids), size):
+            batch = product_ids[begin:begin + size]
+            tasks += [('products', catalog.warm_products, batch), ('prices', catalog.warm_prices, batch),
+                      ('tags', warm_tags, batch)]
+        for begin in range(0, len(collection_ids), size):
+            tasks.append(('collections', catalog.warm_collections, collection_ids[begin:begin + size]))
+
+        warmed = dict.fromkeys(['products', 'prices', 'tags', 'collections'], 0)
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(self.run_task, function, batch): name for name, function, batch in tasks}
+            for future in as_completed(futures):
+                warmed[futures[future]] += future.result()
+
+        for name, count in warmed.items():
+            self.stdout.write(f'  {name}: {count} keys')
+        self.stdout.write(self.style.SUCCESS(
+            f'warmed {sum(warmed.values())} keys in {time.perf_counter() - start:.2f}s'
+        ))
+
+    @staticmethod
+    def run_task(function, batch):
+        try:
+            return function(batch)
+        finally:
+            connection.close()  # each worker thread opened its own connection
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 15:30
+
+from django.db import migrations
+from django.db.models import Count
+
+
+def count_likes(apps, schema_editor):
+    # store 0017 created ProductPopularity with likes at 0, the store app doesn't know about likes.
+    # the same as store_custom.signals.rebuild_product_likes(), with the models of this migration
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    LikedItem = apps.get_model('likes', 'LikedItem')
+    Product = apps.get_model('store', 'Product')
+    ProductPopularity = apps.get_model('store', 'ProductPopularity')
+
+    content_type = ContentType.objects.filter(app_label='store', model='product').first()
+    if content_type is None:
+        return  # a new database, nothing was liked yet
+    counts = dict(
+        LikedItem.objects.filter(content_type=content_type)
+        .values('object_id').annotate(count=Count('pk')).values_list('object_id', 'count')
+    )
+    ProductPopularity.objects.update(likes=0)
+    for product_id, count in counts.items():
+        ProductPopularity.objects.filter(product_id=product_id).update(likes=count)
+    # products created with bulk_create since have no row yet
+    existing = set(ProductPopularity.objects.filter(product_id__in=counts).values_list('product_id', flat=True))
+    ProductPopularity.objects.bulk_create(
+        [
+            ProductPopularity(product_id=pk, collection_id=collection_id, likes=counts[pk])
+            for pk, collection_id in Product.objects.filter(pk__in=set(counts) - existing).values_list('pk', 'collection_id')
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0002_index_content_object'),
+        ('store', '0017_collection_summaries'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_likes, migrations.RunPython.noop),
+    ]
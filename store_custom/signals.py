@@ -0,0 +1,47 @@
+# signal receivers of store_custom, connected in StoreCustomConfig.ready()
+# the store app doesn't know about likes or tags, so keeping ProductPopularity.likes and the cached tag lists
+# up to date is done here
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from likes.models import LikedItem
+from store import collection_summaries
+from store.models import Product, ProductPopularity
+from tags.models import TaggedItem
+
+from .catalog import invalidate_tags
+
+
+def _is_product(item):
+    return item.content_type_id == ContentType.objects.get_for_model(Product).pk
+
+
+@receiver(post_save, sender=LikedItem)
+def count_like(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and _is_product(instance):
+        collection_summaries.record_likes(instance.object_id, 1)
+
+
+@receiver(post_delete, sender=LikedItem)
+def uncount_like(sender, instance, **kwargs):
+    if _is_product(instance):
+        collection_summaries.record_likes(instance.object_id, -1)
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_cached_tags(sender, instance, **kwargs):
+    if _is_product(instance):
+        invalidate_tags([instance.object_id])
+
+
+def rebuild_product_likes():
+    # recounts the likes of every product, e.g after rebuild_collection_summaries or a bulk import of likes
+    content_type = ContentType.objects.get_for_model(Product)
+    counts = LikedItem.objects.filter(content_type=content_type) \
+        .values('object_id').annotate(count=Count('pk')).values_list('object_id', 'count')
+    ProductPopularity.objects.update(likes=0)
+    for product_id, count in counts:
+        collection_summaries.record_likes(product_id, count)
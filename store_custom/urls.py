@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+# the store's urls that need another app, mounted under store/ next to store.urls
+urlpatterns = [
+    path('products/<slug:slug>/tags/', views.product_tag_list, name='product-tags'),
+]
@@ -1,3 +1,14 @@
-from django.shortcuts import render
+from django.http import Http404, JsonResponse
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from store.slugs import resolve_slug
+
+from .catalog import product_tags
+
+
+@require_GET
+def product_tag_list(request, slug):
+    product_id = resolve_slug(slug)
+    if product_id is None:
+        raise Http404('No product with this slug')
+    return JsonResponse({'product': product_id, 'tags': product_tags(product_id)})
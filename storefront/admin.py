@@ -0,0 +1,11 @@
+# the project's admin site. it is the default admin site (see storefront/apps.py and INSTALLED_APPS),
+# so admin.site and @admin.register in every app use it
+from django.contrib import admin
+
+from store.autocomplete import PrefixAutocompleteJsonView
+
+
+class StorefrontAdminSite(admin.AdminSite):
+    def autocomplete_view(self, request):
+        # prefix searches with cached results for admins using store.autocomplete.PrefixSearchMixin
+        return PrefixAutocompleteJsonView.as_view(admin_site=self)(request)
@@ -0,0 +1,5 @@
+from django.contrib.admin.apps import AdminConfig
+
+
+class StorefrontAdminConfig(AdminConfig):
+    default_site = 'storefront.admin.StorefrontAdminSite'
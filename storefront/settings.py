@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
+from email.utils import getaddresses
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -19,26 +21,41 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
 
+# the settings profile is picked with the STOREFRONT_ENV environment variable:
+#   development (the default)  debug on, the debug toolbar, templates and database connections not kept around
+#   production                 debug off, no debug only apps, cached templates, persistent database connections
+#                              and the redis cache at STOREFRONT_CACHE_URL. the secret key, cache url, metrics
+#                              token, hosts and database credentials come from the environment
+STOREFRONT_ENV = os.environ.get('STOREFRONT_ENV', 'development')
+PRODUCTION = STOREFRONT_ENV == 'production'
+
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'django-insecure-o-#1vmt5mj=ighrc96lcm-ch(b3v4@fk7m1&*yw$ynzkplvos7'
+if PRODUCTION:
+    SECRET_KEY = os.environ['DJANGO_SECRET_KEY']  # no default, production must not start with the key below
+else:
+    SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY', 'django-insecure-o-#1vmt5mj=ighrc96lcm-ch(b3v4@fk7m1&*yw$ynzkplvos7')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = not PRODUCTION
+
+# comma separated, e.g DJANGO_ALLOWED_HOSTS=shop.example.com,www.shop.example.com
+ALLOWED_HOSTS = [host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',') if host]
 
-ALLOWED_HOSTS = []
+# production is served over https, session and csrf cookies aren't sent over plain http
+SESSION_COOKIE_SECURE = PRODUCTION
+CSRF_COOKIE_SECURE = PRODUCTION
 
 
 # Application definition
 
 INSTALLED_APPS = [
     'django.contrib.sessions',
-    'django.contrib.admin',
+    'storefront.apps.StorefrontAdminConfig', # replaces 'django.contrib.admin' to use our admin site (storefront/admin.py)
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'playground',
-    'debug_toolbar',
     'store',
     'tags',
     'likes',
@@ -51,7 +68,7 @@ INTERNAL_IPS = [
 ]
 
 MIDDLEWARE = [
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
+    'store.middleware.MetricsMiddleware', # first, so it times everything below (see store/metrics.py)
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,6 +78,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# the debug toolbar only in development, storefront/urls.py adds its urls when the app is installed
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(1, 'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'storefront.urls'
 
 TEMPLATES = [
@@ -79,6 +101,17 @@ TEMPLATES = [
     },
 ]
 
+# in production templates are read and compiled once per process instead of on every render
+# (the loaders option can't be combined with APP_DIRS)
+if PRODUCTION:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'storefront.wsgi.application'
 
 
@@ -92,14 +125,63 @@ DATABASES = {
     # }
     'default': {
         'ENGINE': 'django.db.backends.mysql',
-        'NAME': 'storefront',# the database created using datagrip or mysqlworkbench
-        'HOST': 'localhost',
-        'USER': 'root',
-        'PASSWORD': 'Kingston818' # the passwword created when installing mysql
-        # in actual production, the password wont be included as plain text in this file
+        'NAME': os.environ.get('DATABASE_NAME', 'storefront'),# the database created using datagrip or mysqlworkbench
+        'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+        'USER': os.environ.get('DATABASE_USER', 'root'),
+        # the passwword created when installing mysql. in production it comes from the environment
+        'PASSWORD': os.environ['DATABASE_PASSWORD'] if PRODUCTION else os.environ.get('DATABASE_PASSWORD', 'Kingston818'),
+        # seconds a connection is reused across requests instead of connecting for every request,
+        # checked before a request reuses it so a connection the server dropped is replaced
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600 if PRODUCTION else 0)),
+        'CONN_HEALTH_CHECKS': PRODUCTION,
     }
 }
 
+# orders can be spread over several databases by customer (see STORE_ORDER_SHARDS and store/sharding.py)
+DATABASE_ROUTERS = ['store.routers.OrderShardRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# the catalog cache (store/caching.py), reports and autocomplete use the default cache.
+# STOREFRONT_CACHE_URL points it at redis (e.g redis://localhost:6379/1, needs the redis package) so every worker
+# shares it. production requires it: the catalog cache's refresh lock only works across processes in a shared
+# cache. in development each process has its own memory cache.
+# cache carts (store/cart_backends.py) use the carts cache, which must never evict keys: a redis running with
+# maxmemory-policy noeviction (STOREFRONT_CART_CACHE_URL, the default cache's redis unless set), or a memory
+# cache without a practical limit in development
+if PRODUCTION:
+    CACHE_URL = os.environ['STOREFRONT_CACHE_URL']  # no default, per-process caches break the locks
+else:
+    CACHE_URL = os.environ.get('STOREFRONT_CACHE_URL', '')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+            'KEY_PREFIX': 'storefront',
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('STOREFRONT_CART_CACHE_URL', CACHE_URL),
+            'KEY_PREFIX': 'storefront',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'storefront',
+            'OPTIONS': {'MAX_ENTRIES': 300},
+        },
+        'carts': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'storefront-carts',
+            'OPTIONS': {'MAX_ENTRIES': 10 ** 9},
+        },
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -141,3 +223,105 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Store settings
+
+# shared secret partners send as "Authorization: Token <token>" when posting order batches to store/orders/ingest/
+# leaving it empty keeps the ingestion endpoint closed
+STORE_INGEST_TOKEN = ''
+STORE_INGEST_MAX_BATCH_SIZE = 5000
+
+# where carts are kept, swap in 'store.cart_backends.CacheCartBackend' to keep anonymous carts in the cache
+# (the carts cache in CACHES above) and run the flush_carts command on an interval
+STORE_CART_BACKEND = 'store.cart_backends.DatabaseCartBackend'
+STORE_CART_CACHE = 'carts'
+STORE_CART_TIMEOUT = 7 * 24 * 60 * 60  # seconds an untouched cart stays in the cache
+
+# how many slug -> product id mappings each process keeps in memory (see store/slugs.py)
+STORE_SLUG_CACHE_SIZE = 100000
+
+# seconds a page of admin autocomplete results stays cached (see store/autocomplete.py)
+STORE_AUTOCOMPLETE_CACHE_TIMEOUT = 30
+
+# how many "frequently bought together" products are kept per product (see store/recommendations.py)
+STORE_RECOMMENDATIONS_TOP_K = 10
+
+# thresholds of the nightly recalculate_memberships job (see store/membership.py)
+# recency, frequency and monetary are each worth 0 to 3 points, one per threshold reached
+STORE_MEMBERSHIP_RFM = {
+    'recency_days': [365, 90, 30],
+    'frequency': [2, 5, 10],
+    'monetary': [100, 500, 2000],
+    'silver': 4,
+    'gold': 7,
+}
+
+# settled orders older than this move to the archive tables when the archive_orders command runs (see store/archive.py)
+STORE_ARCHIVE_AFTER_DAYS = 730
+
+# models whose changes are recorded in the outbox for the relay_outbox command (see store/outbox.py)
+STORE_OUTBOX_MODELS = ['store.Product', 'store.Collection', 'store.Promotion', 'tags.TaggedItem']
+
+# results of the raw sql reports (see store/reports.py) with at most this many rows are cached for this many seconds
+STORE_REPORT_CACHE_TIMEOUT = 300
+STORE_REPORT_CACHE_MAX_ROWS = 10000
+
+# metrics served at /metrics (see store/metrics.py). with several worker processes set STORE_METRICS_DIR to an
+# empty directory the workers can write to (emptied on every restart), otherwise each worker only reports its own
+STORE_METRICS_DIR = ''
+# when set, /metrics requires "Authorization: Bearer <token>". production requires one (STOREFRONT_METRICS_TOKEN),
+# without a token /metrics is only served while DEBUG is on
+if PRODUCTION:
+    STORE_METRICS_TOKEN = os.environ['STOREFRONT_METRICS_TOKEN']
+else:
+    STORE_METRICS_TOKEN = os.environ.get('STOREFRONT_METRICS_TOKEN', '')
+
+# products are low on stock below this many units, unless their collection or the product sets a threshold
+# (see store/stock.py). run the notify_low_stock command on an interval to email the alerts to ADMINS
+STORE_LOW_STOCK_THRESHOLD = 10
+
+# who gets the low stock alerts and the error emails, comma separated,
+# e.g STOREFRONT_ADMINS="Shop Admin <admin@shop.example.com>,ops@shop.example.com"
+ADMINS = [(name, address) for name, address in getaddresses([os.environ.get('STOREFRONT_ADMINS', '')]) if address]
+SERVER_EMAIL = os.environ.get('STOREFRONT_SERVER_EMAIL', 'root@localhost')  # the sender of those emails
+
+# how many best selling or most liked products a collection page lists (see store/collection_summaries.py)
+STORE_COLLECTION_TOP_N = 10
+
+# product page views are counted in memory and written every this many seconds, or once this many products
+# have pending views, and when the worker exits (see store/product_views.py)
+STORE_VIEW_FLUSH_INTERVAL = 30
+STORE_VIEW_FLUSH_MAX_PENDING = 1000
+
+# product and collection pages are cached this many seconds, then served stale for up to STORE_CATALOG_CACHE_STALE
+# more seconds while one request refreshes them. a higher STORE_CATALOG_CACHE_BETA refreshes busy entries earlier
+# (see store/caching.py)
+STORE_CATALOG_CACHE_TIMEOUT = 300
+STORE_CATALOG_CACHE_STALE = 60
+STORE_CATALOG_CACHE_BETA = 1.0
+
+# the compact_history command merges price and inventory changes older than these many days into one row per hour,
+# then per day, and everything older than STORE_HISTORY_KEEP_DAYS into a single row per product (see store/history.py)
+STORE_HISTORY_HOURLY_AFTER_DAYS = 30
+STORE_HISTORY_DAILY_AFTER_DAYS = 365
+STORE_HISTORY_KEEP_DAYS = 3 * 365
+
+# the databases orders and their items are spread over by customer, the first one is usually 'default' (see
+# store/sharding.py). every alias needs an entry in DATABASES and its tables: manage.py migrate --database <alias>
+# (on mysql add 'OPTIONS': {'init_command': 'SET foreign_key_checks = 0'} to the shard while migrating it, the first
+# migrations still reference the customer and product tables the shard doesn't have).
+# only append shards, then run the rebalance_order_shards command to move the customers of the new shard to it.
+# to try it locally, STOREFRONT_ORDER_SHARDS=3 adds two sqlite databases next to the project
+STORE_ORDER_SHARDS = ['default']
+if not PRODUCTION:
+    for index in range(1, int(os.environ.get('STOREFRONT_ORDER_SHARDS', 1))):
+        DATABASES[f'orders{index}'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / f'orders{index}.sqlite3'}
+        STORE_ORDER_SHARDS.append(f'orders{index}')
+
+# the generate_feeds command writes the sitemaps and the google product feed to STORE_FEEDS_DIR, which the web server
+# serves at STORE_FEEDS_URL. product urls start with STORE_SITE_URL (see store/feeds.py)
+STORE_FEEDS_DIR = BASE_DIR / 'feeds'
+STORE_SITE_URL = os.environ.get('STOREFRONT_SITE_URL', 'http://localhost:8000')
+STORE_FEEDS_URL = STORE_SITE_URL + '/feeds/'
+STORE_FEED_CURRENCY = 'USD'
@@ -0,0 +1,12 @@
+# settings for running the tests without mysql: sqlite databases, with the orders spread over two of them so the
+# tests cover the order shards (see store/sharding.py)
+#   python manage.py test --settings=storefront.test_settings
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'test_default.sqlite3'},
+    'orders1': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'test_orders1.sqlite3'},
+}
+STORE_ORDER_SHARDS = ['default', 'orders1']
+
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']  # the default hasher is slow on purpose
@@ -14,9 +14,12 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from store.views import metrics
+
 
 # we can include some customisation for the admin app here since it is imported above
 # admin.site.register(models.Collection)
@@ -25,12 +28,18 @@ admin.site.index_title = 'Admin'
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('__debug__/', include('debug_toolbar.urls')),
 
     # we add our playground url e.g playground/hello
     # we tell django that any urls that begin with playground/ should be routed to our plaground app
     # it would chop off the playground part (i.e playground/hello/ to just hello/ )
     # and send to rest of the request to the playground urls file which knows how to interprete the hello
     path('playground/',include('playground.urls')),
+    path('store/', include('store.urls')),
+    path('store/', include('store_custom.urls')),
+    path('metrics', metrics, name='metrics'), # scraped by prometheus, see store/metrics.py
 
 ]
+
+# only in development, the production settings don't install the debug toolbar
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
@@ -5,4 +5,5 @@ from .models import Tag
 
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
-    search_fields = ['label']
\ No newline at end of file
+    list_display = ['label', 'usage_count']
+    search_fields = ['label']
@@ -0,0 +1,12 @@
+# see store/hot_queries.py and the audit_indexes command
+from django.contrib.contenttypes.models import ContentType
+
+from .models import Tag, TaggedItem
+
+
+HOT_QUERIES = {
+    'tag by label': lambda: Tag.objects.filter(label='some-tag'),
+    'tag label prefix': lambda: Tag.objects.filter(label_key__gte='ho', label_key__lt='hp'),
+    'popular tags': lambda: Tag.objects.popular(),
+    'tags of object': lambda: TaggedItem.objects.filter(content_type=ContentType(pk=1), object_id=1),
+}
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tags.models import Tag
+
+
+class Command(BaseCommand):
+    help = 'Recomputes how many items every tag is applied to, behind the popular tags and the tag cloud'
+
+    def handle(self, *args, **options):
+        used = Tag.objects.recount()
+        self.stdout.write(self.style.SUCCESS(f'recounted the tags, {used} are in use'))
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:14
+
+from django.db import migrations, models
+
+
+def backfill_label_keys(apps, schema_editor):
+    Tag = apps.get_model('tags', 'Tag')
+    tags = list(Tag.objects.only('pk', 'label'))
+    for tag in tags:
+        tag.label_key = ' '.join(tag.label.casefold().split())
+    Tag.objects.bulk_update(tags, ['label_key'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tags', '0002_index_hot_lookups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='label_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_label_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:32
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicates_and_count(apps, schema_editor):
+    # keeps the first of every duplicated (content_type, object_id, tag) so the unique constraint can be added,
+    # then counts the items of every tag
+    Tag = apps.get_model('tags', 'Tag')
+    TaggedItem = apps.get_model('tags', 'TaggedItem')
+    duplicates = TaggedItem.objects.values('content_type_id', 'object_id', 'tag_id') \
+        .annotate(count=Count('pk'), first=Min('pk')).filter(count__gt=1)
+    for duplicate in duplicates:
+        TaggedItem.objects.filter(
+            content_type_id=duplicate['content_type_id'],
+            object_id=duplicate['object_id'],
+            tag_id=duplicate['tag_id'],
+        ).exclude(pk=duplicate['first']).delete()
+    counts = TaggedItem.objects.values('tag_id').annotate(count=Count('pk')).values_list('tag_id', 'count')
+    for tag_id, count in counts:
+        Tag.objects.filter(pk=tag_id).update(usage_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tags', '0003_tag_label_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tag',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['-usage_count', 'label'], name='tags_tag_usage_c_6988da_idx'),
+        ),
+        migrations.RunPython(remove_duplicates_and_count, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='taggeditem',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id', 'tag'), name='unique_tagged_item'),
+        ),
+        # the constraint's index starts with the same columns
+        migrations.RemoveIndex(
+            model_name='taggeditem',
+            name='tags_tagged_content_eaa81e_idx',
+        ),
+    ]
@@ -1,10 +1,18 @@
-from django.db import models
+import math
+
+from django.db import models, router, transaction
+from django.db.models import Count, F
 # from store.models import Product
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
 # Create your models here.
 
+def normalize_label(label):
+    # the same normalization the store app uses for its search keys, lowercase and collapsed whitespace
+    return ' '.join((label or '').casefold().split())
+
+
 # defining a custom manager class
 class TaggedItemManager(models.Manager):
     def get_tags_for(self, obj_type,obj_id):
@@ -17,7 +25,113 @@ class TaggedItemManager(models.Manager):
             )
         return queryset
 
-
+    def get_tags_for_many(self, obj_type, obj_ids):
+        # get_tags_for of several objects in one query, e.g to fill a cache
+        content_type = ContentType.objects.get_for_model(obj_type)
+        return self.select_related('tag').filter(content_type=content_type, object_id__in=obj_ids)
+
+    # bulk tagging, e.g from the product admin (see store_custom/admin.py)
+    # bulk_create and the raw deletes skip the signals, so these methods keep Tag.usage_count up to date themselves.
+    # saves and deletes of single tagged items are counted by tags/signals.py
+    def tag_objects(self, tags, model, object_ids, batch_size=1000):
+        # applies every tag to every object, returns the ids of the tagged items created.
+        # pairs that already exist are skipped, the unique constraint catches the ones added concurrently
+        content_type = ContentType.objects.get_for_model(model)
+        tag_ids = [tag.pk for tag in tags]
+        object_ids = list(object_ids)
+        created = []
+        with transaction.atomic():
+            added = dict.fromkeys(tag_ids, 0)
+            for start in range(0, len(object_ids), batch_size):
+                batch = object_ids[start:start + batch_size]
+                existing = set(
+                    self.filter(content_type=content_type, object_id__in=batch, tag_id__in=tag_ids)
+                    .values_list('tag_id', 'object_id')
+                )
+                missing = {(tag_id, object_id) for tag_id in tag_ids for object_id in batch} - existing
+                if not missing:
+                    continue
+                self.bulk_create(
+                    [TaggedItem(tag_id=tag_id, content_type=content_type, object_id=object_id) for tag_id, object_id in missing],
+                    ignore_conflicts=True,
+                )
+                # ignore_conflicts leaves the primary keys unset, read them back
+                for pk, tag_id, object_id in self.filter(content_type=content_type, object_id__in=batch, tag_id__in=tag_ids) \
+                        .values_list('pk', 'tag_id', 'object_id'):
+                    if (tag_id, object_id) in missing:
+                        created.append(pk)
+                        added[tag_id] += 1
+            for tag_id, count in added.items():
+                if count:
+                    Tag.objects.filter(pk=tag_id).update(usage_count=F('usage_count') + count)
+        return created
+
+    def untag_objects(self, tags, model, object_ids, batch_size=1000):
+        # removes the tags from the objects, returns the ids of the tagged items deleted.
+        # one DELETE per batch without the post_delete signals (one query per row), so like tag_objects
+        # this counts the removed items per tag itself
+        content_type = ContentType.objects.get_for_model(model)
+        tag_ids = [tag.pk for tag in tags]
+        object_ids = list(object_ids)
+        deleted = []
+        with transaction.atomic():
+            removed = dict.fromkeys(tag_ids, 0)
+            for start in range(0, len(object_ids), batch_size):
+                rows = list(
+                    self.filter(content_type=content_type, object_id__in=object_ids[start:start + batch_size], tag_id__in=tag_ids)
+                    .values_list('pk', 'tag_id')
+                )
+                if not rows:
+                    continue
+                batch = self.filter(pk__in=[pk for pk, _ in rows])
+                batch._raw_delete(batch.db)
+                for pk, tag_id in rows:
+                    deleted.append(pk)
+                    removed[tag_id] += 1
+            for tag_id, count in removed.items():
+                if count:
+                    Tag.objects.filter(pk=tag_id).update(usage_count=F('usage_count') - count)
+        return deleted
+
+
+class TagManager(models.Manager):
+    def get_or_create_labels(self, labels):
+        # the tags with these labels, creating the missing ones. labels are matched on their normalized form
+        wanted = {}
+        for label in labels:
+            if normalize_label(label):
+                wanted.setdefault(normalize_label(label), label.strip())
+        found = {tag.label_key: tag for tag in self.filter(label_key__in=wanted)}
+        for key, label in wanted.items():
+            if key not in found:
+                found[key] = self.create(label=label)
+        return [found[key] for key in wanted]
+
+    def popular(self, limit=20):
+        # read from the (-usage_count, label) index, nothing is counted
+        return self.filter(usage_count__gt=0).order_by('-usage_count', 'label')[:limit]
+
+    def cloud(self, limit=50, steps=5):
+        # the most used tags in label order, each with a weight from 1 to steps for its font size.
+        # weights grow with the log of the usage, so a few very popular tags don't flatten the rest
+        tags = sorted(self.popular(limit), key=lambda tag: tag.label_key)
+        if not tags:
+            return []
+        low = math.log(min(tag.usage_count for tag in tags))
+        high = math.log(max(tag.usage_count for tag in tags))
+        for tag in tags:
+            spread = (math.log(tag.usage_count) - low) / (high - low) if high > low else 1
+            tag.weight = 1 + round(spread * (steps - 1))
+        return tags
+
+    def recount(self):
+        # recomputes usage_count of every tag, e.g after tagged items were changed with raw sql
+        counts = dict(TaggedItem.objects.values('tag_id').annotate(count=Count('pk')).values_list('tag_id', 'count'))
+        with transaction.atomic():
+            self.update(usage_count=0)
+            for tag_id, count in counts.items():
+                self.filter(pk=tag_id).update(usage_count=count)
+        return len(counts)
 
 
 # the tags app is to be designed so we can reuse it in any project
@@ -26,11 +140,26 @@ class TaggedItemManager(models.Manager):
 # Taggeditem represents a tag applied to a particular item which can be anything
 
 class Tag(models.Model):
-    label = models.CharField(max_length=255)
+    label = models.CharField(max_length=255, db_index=True) # tags are looked up by label e.g in the admin
+    # lowercased copy of the label, indexed so autocomplete can search it by prefix
+    label_key = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    # how many items have this tag, kept up to date as items are tagged so popular tags don't need a count
+    usage_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = TagManager()
 
     def __str__(self):
         return self.label
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-usage_count', 'label'])
+        ]
+
+    def save(self, *args, **kwargs):
+        self.label_key = normalize_label(self.label)
+        super().save(*args, **kwargs)
+
 class TaggedItem(models.Model): # class for what tag applies to what object
     tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
 
@@ -65,6 +194,21 @@ class TaggedItem(models.Model): # class for what tag applies to what object
     # creating an objects field which is an instance of the TaggedItemManager class defined above
     objects = TaggedItemManager()
 
+    def save(self, *args, **kwargs):
+        # the post_save receivers run in the same transaction as the row, e.g an outbox recording the change
+        # must commit with it. savepoint=False like the transaction save_base opens itself
+        using = kwargs.get('using') or router.db_for_write(self.__class__, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+    class Meta:
+        # an object has a tag at most once. get_tags_for above (and the generic inline in the admin) look tagged
+        # items up by type and id, which is the start of this constraint's index, so it replaces the index on
+        # (content_type, object_id) we had. lookups by tag use the index of the tag foreign key
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id', 'tag'], name='unique_tagged_item')
+        ]
+
 
 
 
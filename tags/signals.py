@@ -0,0 +1,33 @@
+# signal receivers of the tags app, connected in TagsConfig.ready()
+# they count tagged items saved or deleted one at a time, TaggedItemManager.tag_objects/untag_objects count their own
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .models import Tag, TaggedItem
+
+
+@receiver(pre_save, sender=TaggedItem)
+def remember_old_tag(sender, instance, raw=False, **kwargs):
+    if instance.pk and not raw:
+        instance._old_tag_id = TaggedItem.objects.filter(pk=instance.pk).values_list('tag_id', flat=True).first()
+
+
+@receiver(post_save, sender=TaggedItem)
+def count_tagged_item(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Tag.objects.filter(pk=instance.tag_id).update(usage_count=F('usage_count') + 1)
+
+
+@receiver(post_save, sender=TaggedItem)
+def count_retagged_item(sender, instance, created, raw=False, **kwargs):
+    # the tag of an existing item was changed, e.g in the admin inline
+    old_tag_id = getattr(instance, '_old_tag_id', None)
+    if not created and not raw and old_tag_id is not None and old_tag_id != instance.tag_id:
+        Tag.objects.filter(pk=old_tag_id).update(usage_count=F('usage_count') - 1)
+        Tag.objects.filter(pk=instance.tag_id).update(usage_count=F('usage_count') + 1)
+
+
+@receiver(post_delete, sender=TaggedItem)
+def uncount_tagged_item(sender, instance, **kwargs):
+    Tag.objects.filter(pk=instance.tag_id, usage_count__gt=0).update(usage_count=F('usage_count') - 1)
@@ -1,3 +1,29 @@
 from django.test import TestCase
 
+from .models import Tag, TaggedItem
+
 # Create your tests here.
+
+
+class UntagObjectsTests(TestCase):
+    # tags are tagged here, the tags app doesn't know the models of the other apps
+    def setUp(self):
+        self.red, self.blue = Tag.objects.get_or_create_labels(['red', 'blue'])
+        self.objects = [Tag.objects.create(label=f'object {i}') for i in range(5)]
+        TaggedItem.objects.tag_objects([self.red, self.blue], Tag, [obj.pk for obj in self.objects])
+
+    def test_counts_the_removed_items_per_tag(self):
+        deleted = TaggedItem.objects.untag_objects([self.red], Tag, [obj.pk for obj in self.objects[:3]])
+        self.assertEqual(len(deleted), 3)
+        self.assertFalse(TaggedItem.objects.filter(pk__in=deleted).exists())
+        self.red.refresh_from_db()
+        self.blue.refresh_from_db()
+        self.assertEqual((self.red.usage_count, self.blue.usage_count), (2, 5))
+
+    def test_one_delete_per_batch(self):
+        # a select and a delete per batch of 2 objects, one update per tag and the savepoint. no query per row
+        with self.assertNumQueries(3 * 2 + 2 + 2):
+            deleted = TaggedItem.objects.untag_objects(
+                [self.red, self.blue], Tag, [obj.pk for obj in self.objects], batch_size=2
+            )
+        self.assertEqual(len(deleted), 10)